@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import os
 from functools import lru_cache
 from typing import List
 
@@ -19,6 +20,98 @@ class Settings(BaseModel):
         "http://localhost:8000",
     ]
 
+    # 埋め込みのプロバイダ: "auto"（API キーのあるプロバイダ。無ければ local）| "openai" | "gemini"
+    # | "local"（文字 n-gram の feature hashing。通信なし・再現可能）。環境変数でも指定できる
+    EMBEDDING_PROVIDER: str = os.getenv("EMBEDDING_PROVIDER", "auto")
+    LOCAL_EMBEDDING_DIM: int = 512
+
+    # クエリ埋め込みキャッシュ（search_similar_cases 用）
+    QUERY_CACHE_MAX_ENTRIES: int = 1024
+    QUERY_CACHE_TTL_SECONDS: float = 3600.0
+
+    # 類似検索インデックス: "exact"（全件内積・リファレンス）| "ivf"（近似最近傍）
+    SIMILARITY_INDEX: str = "exact"
+    # この件数未満のコーパスでは ivf 指定でも厳密検索を使う
+    ANN_MIN_CASES: int = 10000
+    # IVF のクラスタ数（0 の場合は件数から自動決定）と探索クラスタ数
+    IVF_NLIST: int = 0
+    IVF_NPROBE: int = 8
+    # 正規化済み行列の保持形式: "none"（float32）| "float16" | "int8"（行ごとスケール）
+    SIMILARITY_QUANTIZATION: str = "none"
+    # 量子化時、上位 topk × RESCORE_FACTOR 件の候補を float32 で採点し直す
+    SIMILARITY_RESCORE: bool = True
+    RESCORE_FACTOR: int = 4
+
+    # 検索方式: "vector"（埋め込みの cosine）| "hybrid"（cosine + BM25）| "lexical"（BM25 のみ・通信なし）
+    RETRIEVAL_MODE: str = "vector"
+    # hybrid の重み: alpha × cosine + (1 - alpha) × 正規化 BM25
+    HYBRID_ALPHA: float = 0.7
+    # 非同期検索でクエリ埋め込みを待つ上限秒数（超えたら BM25 のみで回答する。0 で無制限）
+    QUERY_EMBED_TIMEOUT_SECONDS: float = 10.0
+
+    # 同時に届いたクエリ埋め込みをまとめる待ち時間（秒）と1回の上限件数。0 でまとめない
+    EMBED_BATCH_WINDOW_SECONDS: float = 0.01
+    EMBED_BATCH_MAX_SIZE: int = 128
+
+    # POST /cases/search_batch で1回に受け付ける NewIdea の上限
+    BATCH_SEARCH_MAX_IDEAS: int = 1000
+
+    # 問い生成 (LLM) の応答キャッシュ
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_MAX_ENTRIES: int = 256
+    LLM_CACHE_MAX_DISK_ENTRIES: int = 5000
+    LLM_CACHE_TTL_SECONDS: float = 7 * 24 * 3600
+    # 問い生成の user メッセージのトークン予算（ローカルの推定値）。超える場合は類似度の低いケースほど
+    # summary を短くし、それでも超える場合は企画案の title / summary を短くする。0 で無制限。
+    # 既定値は現在のコーパス（上位10件）が切り詰めなしで収まる大きさ。下げるほど安くなるが情報は落ちる
+    PROMPT_TOKEN_BUDGET: int = 8000
+    # ケースの summary を切るとき、企画案に見込むトークン数。企画案の長さによらずケース部分を同じにして、
+    # プロバイダのプロンプトキャッシュ（先頭一致）に当たるようにする。これを超える企画案は企画案側を切る
+    PROMPT_PROPOSAL_RESERVE_TOKENS: int = 512
+    # シリアライズ済みのケース断片（compact JSON）を保持する件数（LRU）
+    PROMPT_FRAGMENT_CACHE_MAX_ENTRIES: int = 2048
+
+    # DecisionCase・内容ハッシュ・正規化済み行列・BM25・メタデータをまとめたスナップショット
+    # （data/decision_case.snapshot）。起動時は JSON の代わりにこれを memory-map で開く
+    CORPUS_SNAPSHOT_ENABLED: bool = True
+
+    # DecisionCase ファイルの変更監視（変更時に差分だけ埋め込んで索引を差し替える）
+    CORPUS_WATCH_ENABLED: bool = False
+    CORPUS_WATCH_INTERVAL_SECONDS: float = 5.0
+    # 管理用エンドポイント (/admin/...) のトークン（X-Admin-Token ヘッダーで渡す）。
+    # 空文字の場合、管理用エンドポイントはすべて 403 を返す
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+
+    # uvicorn --workers N で類似検索の索引を共有する。1プロセスだけが構築して世代番号つきの
+    # スナップショットとして公開し、各ワーカーはそれを memory-map で読み取り専用に開く
+    SHARED_INDEX_ENABLED: bool = False
+    # 共有索引の置き場所（空文字の場合は backend/data/shared_index）。同一ホストのプロセス間でのみ共有できる
+    SHARED_INDEX_DIR: str = ""
+    # 新しい世代が公開されたかを確認する間隔（秒）と、残しておく世代数
+    SHARED_INDEX_POLL_SECONDS: float = 2.0
+    SHARED_INDEX_KEEP_GENERATIONS: int = 3
+
+    # フィードバック集計（/api/analytics）。セッション作成・フィードバック保存のたびに
+    # logs/analytics に差分を記録し、ログディレクトリを走査せずに集計を返す
+    ANALYTICS_ENABLED: bool = True
+    # 集計の列を columns.npz に書き出す間隔（イベント数）。起動時はそれ以降のイベントだけを読む
+    ANALYTICS_CHECKPOINT_EVERY: int = 1000
+
+    # 保存された企画案のスナップショットをバックグラウンドで埋め込み、前の step からの距離と
+    # 合わせてセッションログに保存する（/api/sessions/{id}/trajectory で使う）
+    SNAPSHOT_EMBEDDING_ENABLED: bool = True
+
+    # 起動時の索引構築をバックグラウンドで行う（完了前からリクエストを受け付け、/ready で完了を通知する）
+    STARTUP_INDEX_IN_BACKGROUND: bool = True
+    # 構築中の検索: "degraded"（BM25 のみで回答）| "unavailable"（503 を返す）
+    SEARCH_WHILE_INDEXING: str = "degraded"
+    # 起動時の索引構築に失敗した場合に再試行するまでの秒数
+    STARTUP_INDEX_RETRY_SECONDS: float = 30.0
+
+    # 処理段階ごとの計測（/metrics で公開）と、リクエストごとの構造化タイミングログ（1行 JSON）
+    METRICS_ENABLED: bool = True
+    TIMING_LOG_ENABLED: bool = False
+
 
 @lru_cache()
 def get_settings() -> Settings:
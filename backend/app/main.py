@@ -1,13 +1,24 @@
 from __future__ import annotations
 
+import time
+
+# 起動時間レポート用（import の所要時間もここから計測する）
+_IMPORT_STARTED = time.perf_counter()
+
+import hmac
+import json
+import threading
+from datetime import date
 from pathlib import Path
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
 
 #12/3 .envに書いてあるAPIキーを読み取る(K.T)
 from dotenv import load_dotenv
@@ -16,6 +27,8 @@ load_dotenv()
 
 from .config import get_settings
 from .models import (
+    AnalyticsResponse,
+    CaseFilter,
     DecisionCase,
     FeedbackRequest,
     FeedbackResponse,
@@ -23,10 +36,25 @@ from .models import (
     GenerateQuestionsResponse,
     NewIdea,
     Question,
+    QuestionGenerationMeta,
     SearchCasesResponse,
     SimilarCase,
 )
-from .services import loader, logging_service, question_generator, similarity
+from .services import (
+    analytics,
+    loader,
+    logging_service,
+    metrics,
+    question_generator,
+    shared_index,
+    similarity,
+    startup,
+)
+from .services.ai_services import ai_service
+from .services.corpus_watcher import CorpusWatcher
+from .services.snapshot_embedder import session_trajectory, snapshot_embedder
+
+startup.report.record("import", _IMPORT_STARTED)
 
 
 app = FastAPI(title=get_settings().APP_NAME)
@@ -52,6 +80,20 @@ app.mount(
 )
 
 
+class BatchSearchCasesRequest(BaseModel):
+    """POST /cases/search_batch のリクエストボディ。"""
+
+    ideas: List[NewIdea]
+    top_k: int = 5
+    filters: Optional[CaseFilter] = None  # 全アイデア共通の絞り込み条件
+
+
+class BatchSearchCasesResponse(BaseModel):
+    """POST /cases/search_batch のレスポンスボディ（ideas と同じ順序）。"""
+
+    results: List[List[similarity.ScoredDecisionCase]]
+
+
 class NewIdeaForm(BaseModel):
     """フロントエンドのフォーム構造に対応する NewIdea 入力用モデル。"""
 
@@ -70,6 +112,8 @@ class ReviewSessionCreateRequest(BaseModel):
     new_idea: NewIdeaForm
     is_demo: bool
     tags: List[str] = []
+    no_cache: bool = False  # True の場合は LLM 応答キャッシュを使わずに再生成する
+    filters: Optional[CaseFilter] = None  # 類似ケース検索の対象を絞り込む条件
 
 
 class ReviewSessionCreateResponse(BaseModel):
@@ -85,7 +129,7 @@ class QuestionFeedbackV2(BaseModel):
     """フロントエンドのフィードバック形式に対応したモデル。"""
 
     question_id: str
-    usefulness_score: Optional[int] = None  # 1〜5（未選択は null）
+    usefulness_score: Optional[int] = Field(default=None, ge=1, le=5)  # 1〜5（未選択は null）
     applied: bool
     note: str = ""
 
@@ -100,20 +144,172 @@ class SaveSnapshotRequest(BaseModel):
     title: str
     content: str
 
+_corpus_watcher: Optional[CorpusWatcher] = None
+_generation_watcher: Optional[shared_index.GenerationWatcher] = None
+# バックグラウンドの索引構築の再試行を shutdown で打ち切るためのイベント
+_shutdown = threading.Event()
+
+
+def _reload_corpus() -> None:
+    """DecisionCase ファイルを読み直し、差分だけ埋め込んで類似検索の索引を差し替える。"""
+
+    if settings.SHARED_INDEX_ENABLED:
+        shared_index.sync()
+        return
+
+    loader.reload_decision_cases()
+    similarity.refresh_similarity()
+
+
+def _refresh_index() -> similarity.SimilarityState:
+    """loader の DecisionCase の変更を類似検索の索引に反映する。
+
+    SHARED_INDEX_ENABLED の場合は新しい世代として公開し、他のワーカーにも切り替えさせる。
+    """
+
+    if settings.SHARED_INDEX_ENABLED:
+        shared_index.sync()
+        state = similarity.get_state()
+        assert state is not None
+        return state
+    return similarity.refresh_similarity()
+
+
+def _initialize_index() -> None:
+    """DecisionCase を読み込んで類似検索の索引を作り、必要ならファイル監視を始める。"""
+    global _corpus_watcher, _generation_watcher
+
+    if settings.SHARED_INDEX_ENABLED:
+        # 公開済みの世代を開く（無ければ最初にロックを取ったプロセスが構築して公開する）
+        with startup.report.phase("shared_index"):
+            shared_index.sync()
+        _generation_watcher = shared_index.GenerationWatcher(
+            interval_seconds=settings.SHARED_INDEX_POLL_SECONDS
+        )
+        _generation_watcher.start()
+    else:
+        # デフォルトパス (services/loader.py からの相対パス ../data/decision_case.json) を利用してロード
+        with startup.report.phase("load_cases"):
+            loader.load_decision_cases()
+        with startup.report.phase("similarity_index"):
+            similarity.initialize_similarity()
+
+    if settings.CORPUS_WATCH_ENABLED:
+        _corpus_watcher = CorpusWatcher(
+            loader.get_decision_cases_path(),
+            _reload_corpus,
+            interval_seconds=settings.CORPUS_WATCH_INTERVAL_SECONDS,
+        )
+        _corpus_watcher.start()
+
+    startup.report.finish(
+        llm_provider=ai_service.llm_provider, embedding_model=ai_service.embedding_model
+    )
+
+
+def _initialize_index_in_background() -> None:
+    """_initialize_index を成功するまで STARTUP_INDEX_RETRY_SECONDS ごとに再試行する。"""
+
+    while True:
+        try:
+            _initialize_index()
+            return
+        except Exception as exc:
+            print(
+                f"startup: 類似検索の索引構築に失敗しました"
+                f"（{settings.STARTUP_INDEX_RETRY_SECONDS}秒後に再試行）: {exc!r}"
+            )
+        if _shutdown.wait(settings.STARTUP_INDEX_RETRY_SECONDS):
+            return
+
+
 @app.on_event("startup")
 def on_startup() -> None:
-    """アプリ起動時に DecisionCase や類似度計算の初期化を行う。"""
+    """アプリ起動時に DecisionCase や類似度計算の初期化を行う。
+
+    STARTUP_INDEX_IN_BACKGROUND の場合は索引をバックグラウンドで作り、完了を待たずに
+    リクエストの受け付けを始める（完了までは /ready が 503 を返し、検索は BM25 のみで回答する）。
+    """
+
+    if not settings.STARTUP_INDEX_IN_BACKGROUND:
+        _initialize_index()
+        return
+
+    threading.Thread(
+        target=_initialize_index_in_background, name="startup-index", daemon=True
+    ).start()
+    startup.report.mark("accepting")
 
-    # デフォルトパス (services/loader.py からの相対パス ../data/decision_case.json) を利用してロード
-    loader.load_decision_cases()
-    similarity.initialize_similarity()
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    """ファイル監視・世代の監視・スナップショット埋め込みのスレッドと索引構築の再試行を止める。"""
+
+    _shutdown.set()
+    if _corpus_watcher is not None:
+        _corpus_watcher.stop()
+    if _generation_watcher is not None:
+        _generation_watcher.stop()
+    snapshot_embedder.stop()
 
 
 @app.get("/health")
 def health_check() -> dict:
     """疎通確認用エンドポイント。"""
 
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "query_cache": similarity.query_cache.stats(),
+        "startup": startup.report.as_dict(),
+    }
+
+
+@app.get("/ready")
+def readiness_check() -> JSONResponse:
+    """類似検索の索引が使えるかを返す（構築完了前は 503）。
+
+    - status="starting": ケースの読み込み・BM25 の構築中（検索は 503）
+    - status="degraded": 埋め込みの構築中（検索は SEARCH_WHILE_INDEXING に従い BM25 のみ、または 503）
+    - status="ready": 構築完了
+    """
+
+    state = similarity.get_state()
+    if state is None:
+        status = "starting"
+    elif not state.complete:
+        status = "degraded"
+    else:
+        status = "ready"
+
+    return JSONResponse(
+        {
+            "ready": status == "ready",
+            "status": status,
+            "num_cases": len(state.cases) if state is not None else 0,
+            "generation": shared_index.attached_generation(),
+        },
+        status_code=200 if status == "ready" else 503,
+    )
+
+
+@app.exception_handler(similarity.SimilarityNotReady)
+async def similarity_not_ready_handler(request: Request, exc: similarity.SimilarityNotReady) -> JSONResponse:
+    """索引の構築前・構築中に検索できない場合は 503 を返す。"""
+
+    return JSONResponse(
+        {"detail": str(exc)},
+        status_code=503,
+        headers={"Retry-After": "5"},
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics() -> PlainTextResponse:
+    """Prometheus 形式（text format 0.0.4）のメトリクスを返す。"""
+
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 @app.get("/")
@@ -124,10 +320,24 @@ def index(request: Request) -> object:
 
 
 @app.post("/cases/search", response_model=SearchCasesResponse)
-def search_cases(idea: NewIdea) -> SearchCasesResponse:
-    """NewIdea を受け取り、類似する DecisionCase を上位5件返す。"""
+@metrics.timed("search_cases")
+async def search_cases(
+    idea: NewIdea,
+    status: List[str] = Query(default=[]),
+    project_id: List[str] = Query(default=[]),
+    decision_level: List[str] = Query(default=[]),
+    tag: List[str] = Query(default=[]),
+) -> SearchCasesResponse:
+    """NewIdea を受け取り、類似する DecisionCase を上位5件返す。
+
+    クエリパラメータ（例: ?status=rejected&project_id=P-001&tag=SaaS）で対象ケースを絞り込める。
+    同じパラメータを複数指定した場合はいずれかに一致するケースが対象になる。
+    """
 
-    scored_cases = similarity.search_similar_cases(idea, top_k=5)
+    filters = CaseFilter(
+        status=status, project_id=project_id, decision_level=decision_level, tags=tag
+    )
+    scored_cases = await similarity.asearch_similar_cases(idea, top_k=5, filters=filters)
 
     similar_cases: List[SimilarCase] = [
         SimilarCase(
@@ -143,21 +353,45 @@ def search_cases(idea: NewIdea) -> SearchCasesResponse:
     return SearchCasesResponse(similar_cases=similar_cases)
 
 
+@app.post("/cases/search_batch", response_model=BatchSearchCasesResponse)
+@metrics.timed("search_cases_batch")
+async def search_cases_batch(body: BatchSearchCasesRequest) -> BatchSearchCasesResponse:
+    """複数の NewIdea をまとめて検索し、アイデアごとに上位 top_k 件の類似ケースを返す。
+
+    夜間のスクリーニングなど大量の企画案を一括で処理する用途向け。
+    埋め込み API の呼び出しはバッチ全体で1回になる。
+    """
+
+    if len(body.ideas) > settings.BATCH_SEARCH_MAX_IDEAS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"ideas は最大 {settings.BATCH_SEARCH_MAX_IDEAS} 件までです",
+        )
+
+    results = await similarity.asearch_similar_cases_batch(
+        body.ideas, top_k=body.top_k, filters=body.filters
+    )
+    return BatchSearchCasesResponse(results=results)
+
+
 @app.post("/questions/generate", response_model=GenerateQuestionsResponse)
-def generate_questions(request_body: GenerateQuestionsRequest) -> GenerateQuestionsResponse:
+@metrics.timed("generate_questions")
+async def generate_questions(request_body: GenerateQuestionsRequest) -> GenerateQuestionsResponse:
     """NewIdea と選択された類似ケースから問いを生成し、セッションログを作成する。"""
 
-    all_cases = loader.get_decision_cases()
     # similar_case_ids に存在しないIDが含まれていても、該当分をスキップ
-    selected_cases: List[DecisionCase] = [
-        c for c in all_cases if c.id in set(request_body.similar_case_ids)
-    ]
+    selected_cases: List[DecisionCase] = loader.get_decision_cases_by_ids(
+        request_body.similar_case_ids
+    )
 
-    questions, meta = question_generator.generate_questions(
-        request_body.idea, selected_cases
+    questions, meta = await question_generator.agenerate_questions(
+        request_body.idea, selected_cases, use_cache=not request_body.no_cache
     )
 
-    session_id = logging_service.create_session_log(request_body.idea, questions)
+    # ファイル書き込みはイベントループを塞がないようスレッドプールで行う
+    session_id = await run_in_threadpool(
+        logging_service.create_session_log, request_body.idea, questions
+    )
 
     return GenerateQuestionsResponse(session_id=session_id, questions=questions)
 
@@ -174,16 +408,8 @@ def submit_feedback(session_id: str, body: FeedbackRequest) -> FeedbackResponse:
     return FeedbackResponse(session_id=session_id, saved_count=len(body.feedbacks))
 
 
-@app.post("/api/review_sessions", response_model=ReviewSessionCreateResponse)
-def create_review_session(payload: ReviewSessionCreateRequest) -> ReviewSessionCreateResponse:
-    """フロントエンド用の自己レビューセッション作成エンドポイント。
-
-    - NewIdeaForm を内部の NewIdea に変換
-    - 類似ケース検索
-    - 問い生成
-    - セッションログ作成
-    をまとめて実行し、1つのレスポンスとして返す。
-    """
+def _build_new_idea(payload: ReviewSessionCreateRequest) -> NewIdea:
+    """フロントエンドのフォーム入力 (NewIdeaForm) を内部の NewIdea に変換する。"""
 
     form = payload.new_idea
 
@@ -200,29 +426,50 @@ def create_review_session(payload: ReviewSessionCreateRequest) -> ReviewSessionC
     ]
     summary = "\n\n".join(summary_parts)
 
-    new_idea = NewIdea(
+    return NewIdea(
         title=form.title,
         summary=summary,
         tags=payload.tags or [],
     )
 
+
+@app.post("/api/review_sessions", response_model=ReviewSessionCreateResponse)
+@metrics.timed("review_session")
+async def create_review_session(payload: ReviewSessionCreateRequest) -> ReviewSessionCreateResponse:
+    """フロントエンド用の自己レビューセッション作成エンドポイント。
+
+    - NewIdeaForm を内部の NewIdea に変換
+    - 類似ケース検索
+    - 問い生成
+    - セッションログ作成
+    をまとめて実行し、1つのレスポンスとして返す。
+    """
+
+    new_idea = _build_new_idea(payload)
+
     # 類似ケース検索
-    scored_cases = similarity.search_similar_cases(new_idea, top_k=5)
+    scored_cases = await similarity.asearch_similar_cases(
+        new_idea, top_k=5, filters=payload.filters
+    )
     similar_cases: List[DecisionCase] = [sc.case for sc in scored_cases]
 
     # デモ実行時
     if payload.is_demo:
-        print("debug: デモデータから問いを作成中...")
         questions, _ = question_generator.generate_demo_questions()
-        print("debug: 作成完了")
     else:
         # 問い生成（上位類似ケースを渡す）
-        print("debug: 生成AIから問いを生成中...")
-        questions, meta = question_generator.generate_questions(new_idea, similar_cases)
-        print("debug: 生成終了")
+        questions, meta = await question_generator.agenerate_questions(
+            new_idea,
+            similar_cases,
+            use_cache=not payload.no_cache,
+            scores=[sc.similarity for sc in scored_cases],
+        )
 
     # セッションログ作成
-    session_id = logging_service.create_session_log(new_idea, questions)
+    session_id = await run_in_threadpool(
+        logging_service.create_session_log, new_idea, questions
+    )
+    metrics.annotate(session_id=session_id)
 
     return ReviewSessionCreateResponse(
         session_id=session_id,
@@ -232,6 +479,76 @@ def create_review_session(payload: ReviewSessionCreateRequest) -> ReviewSessionC
     )
 
 
+def _ndjson(event: dict) -> bytes:
+    """ストリーミング用に1イベントを NDJSON の1行へ変換する。"""
+
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@app.post("/api/review_sessions/stream")
+async def create_review_session_stream(payload: ReviewSessionCreateRequest) -> StreamingResponse:
+    """/api/review_sessions のストリーミング版（NDJSON）。
+
+    以下のイベントを1行ずつ順に送る。
+    - {"type": "similar_cases", "new_idea": ..., "similar_cases": [...]}: 類似ケース検索の直後
+    - {"type": "question", "question": {...}}: 問いが1つ生成されるたび
+    - {"type": "done", "session_id": ..., "meta": {...}}: セッションログ作成後
+    - {"type": "error", "detail": ...}: 途中で失敗した場合
+    """
+
+    new_idea = _build_new_idea(payload)
+
+    async def event_stream() -> AsyncIterator[bytes]:
+        with metrics.request_timer("review_session_stream"):
+            try:
+                scored_cases = await similarity.asearch_similar_cases(
+                    new_idea, top_k=5, filters=payload.filters
+                )
+                similar_cases: List[DecisionCase] = [sc.case for sc in scored_cases]
+                yield _ndjson(
+                    {
+                        "type": "similar_cases",
+                        "new_idea": new_idea.dict(),
+                        "similar_cases": [c.dict() for c in similar_cases],
+                    }
+                )
+
+                questions: List[Question] = []
+                meta: Optional[QuestionGenerationMeta] = None
+                if payload.is_demo:
+                    questions, meta = question_generator.generate_demo_questions()
+                    for q in questions:
+                        yield _ndjson({"type": "question", "question": q.dict()})
+                else:
+                    async for item in question_generator.astream_questions(
+                        new_idea,
+                        similar_cases,
+                        use_cache=not payload.no_cache,
+                        scores=[sc.similarity for sc in scored_cases],
+                    ):
+                        if isinstance(item, Question):
+                            questions.append(item)
+                            yield _ndjson({"type": "question", "question": item.dict()})
+                        else:
+                            meta = item
+
+                session_id = await run_in_threadpool(
+                    logging_service.create_session_log, new_idea, questions
+                )
+                metrics.annotate(session_id=session_id)
+                yield _ndjson(
+                    {
+                        "type": "done",
+                        "session_id": session_id,
+                        "meta": meta.dict() if meta else None,
+                    }
+                )
+            except Exception as exc:
+                yield _ndjson({"type": "error", "detail": str(exc)})
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
 @app.post("/api/review_sessions/{session_id}/feedback")
 def create_review_session_feedback(
     session_id: str,
@@ -268,13 +585,45 @@ def create_review_session_feedback(
 def get_decision_case(case_id: str) -> DecisionCase:
     """ID で指定された DecisionCase の詳細を返すエンドポイント。"""
 
-    cases = loader.get_decision_cases()
-    for c in cases:
-        if c.id == case_id:
-            return c
+    cases = loader.get_decision_cases_by_ids([case_id])
+    if cases:
+        return cases[0]
 
     raise HTTPException(status_code=404, detail="DecisionCase not found")
 
+@app.get("/api/sessions/{session_id}")
+def get_session(session_id: str) -> dict:
+    """セッションログの現在のビュー（イベントログを再生したもの）を返す。"""
+
+    try:
+        return logging_service.load_session_log(session_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+@app.get("/api/analytics", response_model=AnalyticsResponse)
+def get_analytics(
+    group_by: str = "theme",
+    key: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+) -> AnalyticsResponse:
+    """問いのフィードバックを theme / layer / risk_type / case（根拠ケース）ごとに集計して返す。
+
+    日付はセッションの作成日（UTC、両端を含む）。key を指定するとその値のグループだけを返す。
+    集計はフィードバック保存時に更新済みのものを読むだけで、ログディレクトリは走査しない。
+    """
+
+    if not settings.ANALYTICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Analytics is disabled")
+    if group_by not in analytics.DIMENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by は {', '.join(analytics.DIMENSIONS)} のいずれかです",
+        )
+    return logging_service.get_analytics().query(
+        group_by, date_from=date_from, date_to=date_to, key=key
+    )
+
 # 12/7 案を保存するためのエンドポイントの作成
 @app.post("/api/sessions/{session_id}/snapshots")
 def save_snapshot(session_id: str, body: SaveSnapshotRequest) -> dict:
@@ -287,8 +636,112 @@ def save_snapshot(session_id: str, body: SaveSnapshotRequest) -> dict:
         )
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Session not found")
+    # 埋め込みと前の step からの距離はバックグラウンドで計算してログに追記する
+    if settings.SNAPSHOT_EMBEDDING_ENABLED:
+        snapshot_embedder.submit(session_id)
     return{"ok":True}
 
+
+@app.get("/api/sessions/{session_id}/trajectory")
+def get_session_trajectory(session_id: str) -> dict:
+    """企画案の変遷（step ごとの前の step からの距離、全体の指標、PCA の2次元座標）を返す。
+
+    保存時にバックグラウンドで計算した埋め込みを使う。未計算の step（pending）がある場合は
+    計算を依頼し、指標と座標は null で返す。
+    """
+
+    try:
+        data = logging_service.load_session_log(session_id, include_vectors=True)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    trajectory = session_trajectory(data)
+    if trajectory["pending"] and settings.SNAPSHOT_EMBEDDING_ENABLED:
+        snapshot_embedder.submit(session_id)
+    return trajectory
+
+
+def _check_admin_token(token: Optional[str]) -> None:
+    """X-Admin-Token ヘッダーを ADMIN_TOKEN と照合する。
+
+    ADMIN_TOKEN が未設定（空文字）の場合は管理用エンドポイントを常に拒否する。
+    """
+
+    if not settings.ADMIN_TOKEN or token is None:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if not hmac.compare_digest(token.encode("utf-8"), settings.ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+class UpsertDecisionCasesResponse(BaseModel):
+    """管理用 DecisionCase 更新エンドポイントのレスポンスボディ。"""
+
+    upserted: int
+    num_cases: int
+
+
+@app.put("/admin/decision_cases", response_model=UpsertDecisionCasesResponse)
+def upsert_decision_cases(
+    cases: List[DecisionCase],
+    x_admin_token: Optional[str] = Header(default=None),
+) -> UpsertDecisionCasesResponse:
+    """DecisionCase を追加・更新する（同じ id は置き換え）。
+
+    変更されたケースだけを埋め込み、類似検索の索引をまとめて差し替える。
+    """
+
+    _check_admin_token(x_admin_token)
+    loader.upsert_decision_cases(cases)
+    state = _refresh_index()
+    return UpsertDecisionCasesResponse(upserted=len(cases), num_cases=len(state.cases))
+
+
+@app.delete("/admin/decision_cases/{case_id}")
+def delete_decision_case(
+    case_id: str,
+    x_admin_token: Optional[str] = Header(default=None),
+) -> dict:
+    """DecisionCase を削除し、類似検索の索引を差し替える。"""
+
+    _check_admin_token(x_admin_token)
+    if not loader.delete_decision_case(case_id):
+        raise HTTPException(status_code=404, detail="DecisionCase not found")
+    state = _refresh_index()
+    return {"ok": True, "num_cases": len(state.cases)}
+
+
+@app.post("/admin/decision_cases/reload")
+def reload_decision_cases(x_admin_token: Optional[str] = Header(default=None)) -> dict:
+    """DecisionCase ファイルを読み直し、差分だけ埋め込んで索引を差し替える。"""
+
+    _check_admin_token(x_admin_token)
+    _reload_corpus()
+    state = similarity.get_state()
+    return {"ok": True, "num_cases": len(state.cases) if state else 0}
+
+
+@app.post("/admin/analytics/rebuild")
+def rebuild_analytics(x_admin_token: Optional[str] = Header(default=None)) -> dict:
+    """全セッションログを読み直してフィードバック集計を作り直す（集計を有効にする前のログの取り込み用）。"""
+
+    _check_admin_token(x_admin_token)
+    return {"ok": True, "num_sessions": logging_service.rebuild_analytics()}
+
+
+@app.get("/admin/similarity/quantization_report")
+def get_quantization_report(
+    mode: str = "int8",
+    k: int = 5,
+    x_admin_token: Optional[str] = Header(default=None),
+) -> dict:
+    """現在のコーパスを量子化した場合の削減メモリと recall@k（float32 比）を返す。"""
+
+    _check_admin_token(x_admin_token)
+    if mode not in ("float16", "int8"):
+        raise HTTPException(status_code=400, detail="mode は float16 または int8 です")
+    return similarity.quantization_report(mode, k=k)
+
+
 # 実行例:
 #   (backend ディレクトリで)
 #   uvicorn app.main:app --reload
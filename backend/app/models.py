@@ -28,6 +28,18 @@ class NewIdea(BaseModel):
     tags: List[str] = Field(default_factory=list)
 
 
+class CaseFilter(BaseModel):
+    """類似検索の対象ケースを絞り込む条件。
+
+    同じ項目内の値はいずれかに一致（OR）、項目どうしは AND で結合する。空の項目は条件なし。
+    """
+
+    status: List[str] = Field(default_factory=list)
+    project_id: List[str] = Field(default_factory=list)
+    decision_level: List[str] = Field(default_factory=list)
+    tags: List[str] = Field(default_factory=list)
+
+
 class Question(BaseModel):
     """生成される問い（3レイヤーモデル対応）。"""
 
@@ -55,7 +67,7 @@ class QuestionFeedback(BaseModel):
     """問いに対するユーザー評価（1問分）。"""
 
     question_id: str
-    helpful_score: int  # 1〜5
+    helpful_score: int = Field(ge=0, le=5)  # 1〜5（0 は未評価）
     modified_idea: bool
     comment: Optional[str] = None
 
@@ -77,6 +89,7 @@ class SearchCasesResponse(BaseModel):
 class GenerateQuestionsRequest(BaseModel):
     idea: NewIdea
     similar_case_ids: List[str]
+    no_cache: bool = False  # True の場合は LLM 応答キャッシュを使わずに再生成する
 
 
 class GenerateQuestionsResponse(BaseModel):
@@ -92,6 +105,25 @@ class FeedbackResponse(BaseModel):
     session_id: str
     saved_count: int
 
+
+class AnalyticsGroup(BaseModel):
+    """フィードバック集計の1グループ（theme / layer / risk_type / 根拠ケースの値ごと）。"""
+
+    key: str
+    questions: int  # 出した問いの数
+    feedbacks: int  # フィードバックのあった問いの数
+    rated: int  # helpful_score（1〜5）が付いた問いの数
+    avg_helpful_score: Optional[float] = None
+    modified_idea_rate: Optional[float] = None  # feedbacks のうち modified_idea=True の割合
+
+
+class AnalyticsResponse(BaseModel):
+    group_by: str
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    total: AnalyticsGroup
+    groups: List[AnalyticsGroup]
+
 ### LLM質問生成用モデル
 class LLMQuestionItem(BaseModel):
     id: str
@@ -111,6 +143,7 @@ class LLMQuestionsPayload(BaseModel):
 __all__ = [
     "DecisionCase",
     "NewIdea",
+    "CaseFilter",
     "Question",
     "QuestionGenerationMeta",
     "QuestionFeedback",
@@ -120,5 +153,8 @@ __all__ = [
     "GenerateQuestionsResponse",
     "FeedbackRequest",
     "FeedbackResponse",
+    "AnalyticsGroup",
+    "AnalyticsResponse",
+    "LLMQuestionItem",
     "LLMQuestionsPayload",
 ]
@@ -1,38 +1,138 @@
 from __future__ import annotations
 
 import os
+from typing import TYPE_CHECKING, Any, AsyncIterator
+
 import numpy as np
-from openai import OpenAI
-from google import genai
-from google.genai import types
 
+from app.config import get_settings
 from app.models import LLMQuestionsPayload
+from app.services import metrics
+from app.services.local_embeddings import LocalEmbedder
+
+# プロバイダ SDK（openai / google.genai）は import に時間がかかるため、
+# 実際に使うプロバイダの分だけ初回利用時に import する
+if TYPE_CHECKING:
+    from google import genai
+    from openai import AsyncOpenAI, OpenAI
+
+# 埋め込みモデル名（埋め込みキャッシュのキーにも使う）
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+GEMINI_EMBEDDING_MODEL = "gemini-embedding-001"
+# 問い生成に使う LLM モデル名
+OPENAI_CHAT_MODEL = "gpt-4o-mini"
+GEMINI_CHAT_MODEL = "gemini-2.5-flash"
 
 # 11/27 add: AIを使うサービスはここに集約
 class AI_Services:
     def __init__(self):
-        self.client = self.get_ai_client()
+        self.settings = get_settings()
+        # プロバイダは API キーの有無だけで決め、クライアントは初回利用時に作る
+        self._llm_provider = self.select_provider()
+        self._client: OpenAI | genai.Client | None = None
+        # 非同期クライアントは async 経路で初めて使われたときに作る
+        self._async_client: AsyncOpenAI | None = None
+        # EMBEDDING_PROVIDER="local"、または "auto" で API キーが無い場合はローカル埋め込みを使う
+        self.local_embedder: LocalEmbedder | None = None
+        if self.settings.EMBEDDING_PROVIDER == "local" or self._llm_provider == "none":
+            self.local_embedder = LocalEmbedder(dim=self.settings.LOCAL_EMBEDDING_DIM)
+
+    @property
+    def client(self) -> OpenAI | genai.Client | None:
+        """選択したプロバイダのクライアント（SDK の import を含め、初回アクセス時に作る）。"""
+        if self._client is None:
+            self._client = self.get_ai_client()
+        return self._client
+
+    @property
+    def llm_provider(self) -> str:
+        """問い生成に使うプロバイダ名 ("openai" / "gemini" / "none") を返す。"""
+        return self._llm_provider
+
+    @property
+    def provider(self) -> str:
+        """埋め込みに使うプロバイダ名 ("openai" / "gemini" / "local") を返す。"""
+        if self.local_embedder is not None:
+            return "local"
+        return self.llm_provider
+
+    @property
+    def embedding_model(self) -> str:
+        """使用中の埋め込みモデル名を返す。"""
+        if self.local_embedder is not None:
+            return self.local_embedder.model_name
+        if self._llm_provider == "openai":
+            return OPENAI_EMBEDDING_MODEL
+        return GEMINI_EMBEDDING_MODEL
 
-    def get_ai_client(self) -> OpenAI | genai.Client:
+    @property
+    def llm_model(self) -> str:
+        """使用中の LLM モデル名を返す。"""
+        if self._llm_provider == "openai":
+            return OPENAI_CHAT_MODEL
+        if self._llm_provider == "gemini":
+            return GEMINI_CHAT_MODEL
+        return "none"
+
+    @property
+    def async_client(self) -> Any:
+        """同じプロバイダの非同期クライアントを返す。
+
+        - OpenAI: AsyncOpenAI を遅延生成する
+        - Gemini: genai.Client の .aio (非同期インターフェース) を使う
+        """
+        if self._llm_provider == "openai":
+            if self._async_client is None:
+                from openai import AsyncOpenAI
+
+                self._async_client = AsyncOpenAI()
+            return self._async_client
+        return self.client.aio
+
+    def select_provider(self) -> str:
         """
-        初回で呼ばれた際にAPIキーの有無に基づいて使用するAIクライアントを選択する関数
+        APIキーの有無に基づいて使用するプロバイダ ("openai" / "gemini" / "none") を選択する関数
+
+        EMBEDDING_PROVIDER が "auto" / "local" の場合、APIキーが無くても "none" を返して起動できる
+        （埋め込みはローカル、問い生成は呼び出し側のフォールバックになる）。
         """
         openai_key = os.getenv("OPENAI_API_KEY")
         gemini_key = os.getenv("GEMINI_API_KEY")
         
-        # デフォルトはOpenAI
-        if openai_key:
+        # デフォルトはOpenAI（EMBEDDING_PROVIDER="gemini" で Gemini キーがある場合は Gemini）
+        prefer_gemini = self.settings.EMBEDDING_PROVIDER == "gemini" and bool(gemini_key)
+        if openai_key and not prefer_gemini:
             print("OpenAI APIを使用します。")
-            return OpenAI()
+            return "openai"
         
         # OpenAIキーがない場合、Geminiキーの有無を確認
         elif gemini_key:
             print("OpenAI APIキーがないため、Gemini API (2.5 Flash) を使用します。")
-            return genai.Client()
+            return "gemini"
         
         # どちらのキーもない場合
+        elif self.settings.EMBEDDING_PROVIDER in ("auto", "local"):
+            print("AIサービスのAPIキーが設定されていないため、ローカル埋め込みのみを使用します（問い生成は固定の問い）。")
+            return "none"
+
         else:
             raise ValueError("AIサービスのAPIキーが設定されていません。")
+
+    def get_ai_client(self) -> OpenAI | genai.Client | None:
+        """
+        選択済みのプロバイダのクライアントを作る関数（その SDK だけを import する）
+        """
+        if self._llm_provider == "openai":
+            from openai import OpenAI
+
+            return OpenAI()
+
+        if self._llm_provider == "gemini":
+            from google import genai
+
+            return genai.Client()
+
+        return None
     
     def embed_texts(self, texts: list[str]) -> np.ndarray:
         """
@@ -44,23 +144,28 @@ class AI_Services:
         """
         if not texts:
             return np.zeros((0, 0), dtype="float32")
+
+        if self.local_embedder is not None:
+            return self.local_embedder.embed_texts(texts)
         
         vectors = []
         
         # OpenAIクライアントの場合
-        if isinstance(self.client, OpenAI):
+        if self._llm_provider == "openai":
             # モデル名: text-embedding-3-small (OpenAI)
             res = self.client.embeddings.create(
-                model="text-embedding-3-small",
+                model=OPENAI_EMBEDDING_MODEL,
                 input=texts,
             )
             vectors = [item.embedding for item in res.data]
 
         # Geminiクライアントの場合
-        elif isinstance(self.client, genai.Client):
+        elif self._llm_provider == "gemini":
+            from google.genai import types
+
             # モデル名: gemini-embedding-001 (Google)
             res = self.client.models.embed_content(
-                model="gemini-embedding-001", 
+                model=GEMINI_EMBEDDING_MODEL,
                 contents=texts,
                 config=types.EmbedContentConfig(
                     task_type="SEMANTIC_SIMILARITY" # 例: 意味的類似性のタスク
@@ -75,13 +180,31 @@ class AI_Services:
         arr = np.array(vectors, dtype="float32")
         return arr
     
+    def _record_usage(self, usage: Any) -> None:
+        """LLM の応答の usage から、入力トークン数とプロンプトキャッシュに一致したトークン数を記録する。
+
+        OpenAI は usage.prompt_tokens_details.cached_tokens、Gemini は usage_metadata.cached_content_token_count。
+        """
+        if usage is None:
+            return
+        if self._llm_provider == "openai":
+            details = getattr(usage, "prompt_tokens_details", None)
+            prompt_tokens = getattr(usage, "prompt_tokens", None)
+            cached_tokens = getattr(details, "cached_tokens", None) if details is not None else None
+        else:
+            prompt_tokens = getattr(usage, "prompt_token_count", None)
+            cached_tokens = getattr(usage, "cached_content_token_count", None)
+        metrics.record_llm_usage(
+            self._llm_provider, self.llm_model, prompt_tokens or 0, cached_tokens or 0
+        )
+
     def call_llm(self, system_prompt: str, user_message: str) -> LLMQuestionsPayload:
         """
         services/question_generator.pyで使用
         
         OpenAI Responses API を呼び出し、JSON をパースして内部モデルに変換する。
         """
-        if isinstance(self.client, OpenAI):
+        if self._llm_provider == "openai":
             # res = _client.responses.create(
             #     model="gpt-4.1-mini",
             #     input=[
@@ -95,13 +218,14 @@ class AI_Services:
             # 11/27 add: 未確認！
             # OpenAI SDK v1.40.0以降ならこれでも動くらしい (Pydanticモデルで返してくれる)
             completion = self.client.beta.chat.completions.parse(
-                model="gpt-4o-mini",
+                model=OPENAI_CHAT_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_message},
                 ],
                 response_format=LLMQuestionsPayload, # ここにPydanticクラスを渡せる
             )
+            self._record_usage(completion.usage)
             parsed_data = completion.choices[0].message.parsed
 
             # None防止
@@ -110,11 +234,12 @@ class AI_Services:
 
             return parsed_data
 
-        elif isinstance(self.client, genai.Client):
+        elif self._llm_provider == "gemini":
+            from google.genai import types
 
             # Gemini (gemini-2.5-flash) の処理
             res = self.client.models.generate_content(
-                model="gemini-2.5-flash",
+                model=GEMINI_CHAT_MODEL,
                 contents=[types.Content(role="user", parts=[types.Part.from_text(text=user_message)])],
                 config=types.GenerateContentConfig(
                     system_instruction=system_prompt,
@@ -122,6 +247,7 @@ class AI_Services:
                     response_schema=LLMQuestionsPayload,
                 ),
             )
+            self._record_usage(res.usage_metadata)
 
             # None防止
             if res.text is None:
@@ -131,4 +257,123 @@ class AI_Services:
         else:
             raise ValueError("Unknown API client")
 
+    async def aembed_texts(self, texts: list[str]) -> np.ndarray:
+        """embed_texts の非同期版。待機中にワーカースレッドを占有しない。"""
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+
+        # ローカル埋め込みは CPU だけで完結し、待ち時間が無いのでそのまま計算する
+        if self.local_embedder is not None:
+            return self.local_embedder.embed_texts(texts)
+
+        vectors = []
+
+        if self._llm_provider == "openai":
+            res = await self.async_client.embeddings.create(
+                model=OPENAI_EMBEDDING_MODEL,
+                input=texts,
+            )
+            vectors = [item.embedding for item in res.data]
+
+        elif self._llm_provider == "gemini":
+            from google.genai import types
+
+            res = await self.client.aio.models.embed_content(
+                model=GEMINI_EMBEDDING_MODEL,
+                contents=texts,
+                config=types.EmbedContentConfig(
+                    task_type="SEMANTIC_SIMILARITY"
+                )
+            )
+            if res.embeddings is None:
+                raise ValueError()
+            vectors = [list(e.values or []) for e in res.embeddings]
+
+        return np.array(vectors, dtype="float32")
+
+    async def acall_llm(self, system_prompt: str, user_message: str) -> LLMQuestionsPayload:
+        """call_llm の非同期版。"""
+        if self._llm_provider == "openai":
+            completion = await self.async_client.beta.chat.completions.parse(
+                model=OPENAI_CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message},
+                ],
+                response_format=LLMQuestionsPayload,
+            )
+            self._record_usage(completion.usage)
+            parsed_data = completion.choices[0].message.parsed
+
+            if parsed_data is None:
+                raise ValueError(f"[OpenAI API] refused of failed to parse: {completion.choices[0].message.refusal}")
+
+            return parsed_data
+
+        elif self._llm_provider == "gemini":
+            from google.genai import types
+
+            res = await self.client.aio.models.generate_content(
+                model=GEMINI_CHAT_MODEL,
+                contents=[types.Content(role="user", parts=[types.Part.from_text(text=user_message)])],
+                config=types.GenerateContentConfig(
+                    system_instruction=system_prompt,
+                    response_mime_type="application/json",
+                    response_schema=LLMQuestionsPayload,
+                ),
+            )
+            self._record_usage(res.usage_metadata)
+
+            if res.text is None:
+                raise ValueError("[Gemini API] failed generate content")
+
+            return LLMQuestionsPayload.model_validate_json(res.text)
+        else:
+            raise ValueError("Unknown API client")
+
+    async def astream_llm(self, system_prompt: str, user_message: str) -> AsyncIterator[str]:
+        """構造化出力 (LLMQuestionsPayload の JSON) をテキスト断片として逐次返す。
+
+        パースは呼び出し側 (question_generator) で行う。
+        """
+        if self._llm_provider == "openai":
+            async with self.async_client.beta.chat.completions.stream(
+                model=OPENAI_CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message},
+                ],
+                response_format=LLMQuestionsPayload,
+                # 最後のチャンクに usage（cached_tokens を含む）を付けてもらう
+                stream_options={"include_usage": True},
+            ) as stream:
+                async for event in stream:
+                    if event.type == "content.delta" and event.delta:
+                        yield event.delta
+                    elif event.type == "chunk" and event.chunk.usage is not None:
+                        self._record_usage(event.chunk.usage)
+
+        elif self._llm_provider == "gemini":
+            from google.genai import types
+
+            stream = await self.client.aio.models.generate_content_stream(
+                model=GEMINI_CHAT_MODEL,
+                contents=[types.Content(role="user", parts=[types.Part.from_text(text=user_message)])],
+                config=types.GenerateContentConfig(
+                    system_instruction=system_prompt,
+                    response_mime_type="application/json",
+                    response_schema=LLMQuestionsPayload,
+                ),
+            )
+            usage = None
+            async for chunk in stream:
+                # usage_metadata は各チャンクに付くことがあるので、最後のものだけを記録する
+                if chunk.usage_metadata is not None:
+                    usage = chunk.usage_metadata
+                if chunk.text:
+                    yield chunk.text
+            self._record_usage(usage)
+        else:
+            raise ValueError("Unknown API client")
+
 ai_service = AI_Services()
\ No newline at end of file
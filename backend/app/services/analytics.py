@@ -0,0 +1,520 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from datetime import date
+from pathlib import Path
+from typing import Any, Iterable
+
+import numpy as np
+
+from app.models import AnalyticsGroup, AnalyticsResponse, Question, QuestionFeedback
+
+# 集計できる軸（case は based_on_case_ids。1つの問いが複数のケースに数えられる）
+DIMENSIONS = ("theme", "layer", "risk_type", "case")
+
+# 集計値の並び: 出題数 / フィードバックのあった問い数 / helpful_score の合計 / 評価数（1〜5）/ modified_idea 数
+_QUESTIONS, _FEEDBACKS, _HELPFUL_SUM, _RATED, _MODIFIED = range(5)
+_NUM_STATS = 5
+
+# modified 列の「フィードバック無し」
+_NO_FEEDBACK = -1
+
+_JOURNAL_FILE = "events.jsonl"
+_CHECKPOINT_FILE = "columns.npz"
+
+
+class _Codes:
+    """文字列 ↔ 連番の対応表。"""
+
+    def __init__(self, values: Iterable[str] = ()) -> None:
+        self.values: list[str] = list(values)
+        self.index = {v: i for i, v in enumerate(self.values)}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def code(self, value: str) -> int:
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class _Column:
+    """末尾への追加が償却 O(1) の numpy 列。"""
+
+    def __init__(self, dtype: Any, data: np.ndarray | None = None) -> None:
+        self._data = np.zeros(max(16, 0 if data is None else len(data)), dtype=dtype)
+        self.size = 0
+        if data is not None:
+            self._data[: len(data)] = data
+            self.size = len(data)
+
+    def append(self, value: int) -> int:
+        if self.size == len(self._data):
+            self._data = np.concatenate([self._data, np.zeros_like(self._data)])
+        self._data[self.size] = value
+        self.size += 1
+        return self.size - 1
+
+    def __getitem__(self, i: int) -> int:
+        return int(self._data[i])
+
+    def __setitem__(self, i: int, value: int) -> None:
+        self._data[i] = value
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._data[: self.size]
+
+
+def _contribution(helpful: np.ndarray, modified: np.ndarray) -> np.ndarray:
+    """問いごとの集計値 (rows, _NUM_STATS) を返す。"""
+
+    rated = (helpful >= 1) & (helpful <= 5)
+    out = np.zeros((len(helpful), _NUM_STATS), dtype=np.int64)
+    out[:, _QUESTIONS] = 1
+    out[:, _FEEDBACKS] = modified != _NO_FEEDBACK
+    out[:, _HELPFUL_SUM] = np.where(rated, helpful, 0)
+    out[:, _RATED] = rated
+    out[:, _MODIFIED] = modified == 1
+    return out
+
+
+def _helpful_score(value: Any) -> int:
+    """helpful_score を 1〜5 の整数にする（それ以外・未評価は 0）。"""
+
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= 5:
+        return 0
+    return value
+
+
+def _to_day(value: str) -> int:
+    """ISO8601 の日時・日付文字列を日番号（date.toordinal）にする。"""
+    return date.fromisoformat(value[:10]).toordinal()
+
+
+class FeedbackAnalytics:
+    """問いの theme / layer / risk_type / 根拠ケースごとのフィードバック集計。
+
+    - セッション作成・フィードバック保存のたびに、1行のイベントを追記専用のジャーナル
+      (events.jsonl) に書き、メモリ上の集計に差分だけ反映する。ログディレクトリは走査しない。
+    - メモリ上は問い1件を1行とする列（セッション・theme・layer・risk_type・日付・helpful_score・
+      modified_idea）と、軸ごとの集計配列 (値, 日, 集計値) を持つ。query はこの配列の日付範囲を
+      足し合わせるだけなので、ログの件数によらない。
+    - checkpoint_every 件ごとに列を columns.npz に書き出し、起動時はそれとジャーナルの続きだけを読む。
+    - 他のプロセスが追記したイベントも、次の記録・問い合わせの前にジャーナルの続きから取り込む。
+    """
+
+    def __init__(self, directory: Path, *, checkpoint_every: int = 1000) -> None:
+        self.directory = directory
+        self.checkpoint_every = checkpoint_every
+        self._lock = threading.Lock()
+        self._reset()
+        self._loaded = False
+
+    @property
+    def journal_path(self) -> Path:
+        return self.directory / _JOURNAL_FILE
+
+    @property
+    def checkpoint_path(self) -> Path:
+        return self.directory / _CHECKPOINT_FILE
+
+    def _reset(self) -> None:
+        self._offset = 0
+        self._journal_inode: int | None = None
+        self._since_checkpoint = 0
+        self._codes = {name: _Codes() for name in (*DIMENSIONS, "session", "question")}
+        self._columns = {
+            "session": _Column(np.int32),
+            "question": _Column(np.int32),
+            "theme": _Column(np.int32),
+            "layer": _Column(np.int32),
+            "risk_type": _Column(np.int32),
+            "day": _Column(np.int32),
+            "helpful": _Column(np.int8),
+            "modified": _Column(np.int8),
+        }
+        self._edge_row = _Column(np.int32)
+        self._edge_case = _Column(np.int32)
+        self._row_cases: dict[int, list[int]] = {}
+        # session のコード → {question のコード: 行番号}
+        self._session_rows: dict[int, dict[int, int]] = {}
+        self._day0: int | None = None
+        self._aggregates = {dim: np.zeros((0, 0, _NUM_STATS), dtype=np.int64) for dim in DIMENSIONS}
+
+    # ---- 集計配列 ----
+
+    def _ensure_day(self, day: int) -> int:
+        """day の列を確保し、集計配列上の日のインデックスを返す。"""
+
+        if self._day0 is None:
+            self._day0 = day
+        if day < self._day0:
+            shift = self._day0 - day
+            for dim, arr in self._aggregates.items():
+                self._aggregates[dim] = np.pad(arr, ((0, 0), (shift, 0), (0, 0)))
+            self._day0 = day
+        return day - self._day0
+
+    def _add(self, dim: str, codes: np.ndarray, days: np.ndarray, values: np.ndarray) -> None:
+        if len(codes) == 0:
+            return
+        arr = self._aggregates[dim]
+        need_v = max(arr.shape[0], int(codes.max()) + 1)
+        need_d = max(arr.shape[1], int(days.max()) + 1)
+        if (need_v, need_d) != arr.shape[:2]:
+            arr = np.pad(arr, ((0, need_v - arr.shape[0]), (0, need_d - arr.shape[1]), (0, 0)))
+            self._aggregates[dim] = arr
+        np.add.at(arr, (codes, days), values)
+
+    def _apply_rows(self, rows: np.ndarray, sign: int) -> None:
+        """rows の問いの現在の集計値を、各軸の集計配列に sign 倍して加える。"""
+
+        if len(rows) == 0:
+            return
+        col = {name: c.values[rows] for name, c in self._columns.items()}
+        values = sign * _contribution(col["helpful"], col["modified"])
+        assert self._day0 is not None
+        days = col["day"] - self._day0
+        for dim in ("theme", "layer", "risk_type"):
+            self._add(dim, col[dim], days, values)
+
+        pairs = [(i, c) for i, row in enumerate(rows.tolist()) for c in self._row_cases.get(row, ())]
+        if pairs:
+            idx = np.array([i for i, _ in pairs])
+            self._add("case", np.array([c for _, c in pairs]), days[idx], values[idx])
+
+    # ---- イベントの反映 ----
+
+    def _apply_event(self, event: dict) -> None:
+        """イベントを集計に反映する。
+
+        先にイベント全体を読み取って検証し、不正な場合は何も変えずに例外を送出する
+        （集計の引き戻しと加算は、検証が済んでからまとめて行う）。
+        """
+
+        kind = event.get("type")
+        session_id = str(event["session_id"])
+        if kind == "session":
+            day = _to_day(event["created_at"])
+            questions = [
+                (
+                    str(q["id"]),
+                    str(q["theme"]),
+                    str(q["layer"]),
+                    str(q["risk_type"]),
+                    [str(c) for c in q.get("based_on_case_ids") or []],
+                )
+                for q in event["questions"]
+            ]
+
+            session = self._codes["session"].code(session_id)
+            self._ensure_day(day)
+            rows = self._session_rows.setdefault(session, {})
+            new_rows: list[int] = []
+            for qid, theme, layer, risk_type, case_ids in questions:
+                qcode = self._codes["question"].code(qid)
+                row = self._columns["session"].append(session)
+                self._columns["question"].append(qcode)
+                self._columns["theme"].append(self._codes["theme"].code(theme))
+                self._columns["layer"].append(self._codes["layer"].code(layer))
+                self._columns["risk_type"].append(self._codes["risk_type"].code(risk_type))
+                self._columns["day"].append(day)
+                self._columns["helpful"].append(0)
+                self._columns["modified"].append(_NO_FEEDBACK)
+                cases = [self._codes["case"].code(c) for c in case_ids]
+                for c in cases:
+                    self._edge_row.append(row)
+                    self._edge_case.append(c)
+                self._row_cases[row] = cases
+                rows[qcode] = row
+                new_rows.append(row)
+            self._apply_rows(np.array(new_rows, dtype=np.int64), 1)
+
+        elif kind == "feedbacks":
+            feedbacks = [
+                (str(fb["question_id"]), _helpful_score(fb.get("helpful_score")), bool(fb.get("modified_idea")))
+                for fb in event["feedbacks"]
+            ]
+            session = self._codes["session"].index.get(session_id)
+            rows = self._session_rows.get(session) if session is not None else None
+            if not rows:
+                # 集計を始める前に作られたセッション（logging_service.rebuild_analytics で取り込む）
+                return
+            updates: dict[int, tuple[int, int]] = {}
+            for qid, helpful, modified in feedbacks:
+                row = rows.get(self._codes["question"].index.get(qid, -1))
+                if row is not None:
+                    updates[row] = (helpful, 1 if modified else 0)
+
+            targets = np.array(sorted(rows.values()), dtype=np.int64)
+            self._apply_rows(targets, -1)
+            # append_feedback は feedbacks 全体を置き換えるので、一度すべて「無し」に戻す
+            self._columns["helpful"].values[targets] = 0
+            self._columns["modified"].values[targets] = _NO_FEEDBACK
+            for row, (helpful, modified) in updates.items():
+                self._columns["helpful"][row] = helpful
+                self._columns["modified"][row] = modified
+            self._apply_rows(targets, 1)
+
+    def _catch_up(self) -> None:
+        """ジャーナルのうち、まだ反映していない続きを読み込む（_lock を取った状態で呼ぶ）。"""
+
+        if not self._loaded:
+            self._load_checkpoint()
+            self._loaded = True
+
+        try:
+            st = self.journal_path.stat()
+        except OSError:
+            return
+        if self._journal_inode is not None and (
+            st.st_ino != self._journal_inode or st.st_size < self._offset
+        ):
+            # rebuild（logging_service.rebuild_analytics）などでジャーナルが作り直された
+            self._reset()
+        self._journal_inode = st.st_ino
+        if st.st_size == self._offset:
+            return
+
+        with self.journal_path.open("rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # 書き込み途中の最終行は次回に回す
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply_event(json.loads(line))
+            except (ValueError, KeyError, TypeError, AttributeError) as exc:
+                # 不正な行は読み飛ばす（offset は進めるので、次回に同じ行で止まらない）
+                print(f"analytics: ジャーナルの不正な行を読み飛ばします: {exc!r} {line[:200]!r}")
+                continue
+            self._since_checkpoint += 1
+        self._offset += end
+
+        if self._since_checkpoint >= self.checkpoint_every:
+            self._save_checkpoint()
+
+    # ---- チェックポイント ----
+
+    def _save_checkpoint(self) -> None:
+        arrays: dict[str, np.ndarray] = {
+            "offset": np.array([self._offset], dtype=np.int64),
+            "inode": np.array([self._journal_inode or 0], dtype=np.int64),
+            "edge_row": self._edge_row.values,
+            "edge_case": self._edge_case.values,
+        }
+        for name, column in self._columns.items():
+            arrays[f"col_{name}"] = column.values
+        for name, codes in self._codes.items():
+            arrays[f"codes_{name}"] = np.array(codes.values, dtype=str)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.checkpoint_path.with_suffix(f".{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, self.checkpoint_path)
+        self._since_checkpoint = 0
+
+    def _load_checkpoint(self) -> None:
+        """columns.npz から列を読み、集計配列を作り直す（無い・壊れている場合は空から）。"""
+
+        try:
+            st = self.journal_path.stat()
+            with np.load(self.checkpoint_path, allow_pickle=False) as z:
+                arrays = {k: z[k] for k in z.files}
+        except (OSError, ValueError, KeyError):
+            return
+        # ジャーナルと対応しないチェックポイント（作り直し前のもの）は使わない
+        if int(arrays["inode"][0]) != st.st_ino or int(arrays["offset"][0]) > st.st_size:
+            return
+
+        self._offset = int(arrays["offset"][0])
+        self._journal_inode = st.st_ino
+        self._codes = {name: _Codes(arrays[f"codes_{name}"].tolist()) for name in self._codes}
+        self._columns = {
+            name: _Column(column.values.dtype, arrays[f"col_{name}"])
+            for name, column in self._columns.items()
+        }
+        self._edge_row = _Column(np.int32, arrays["edge_row"])
+        self._edge_case = _Column(np.int32, arrays["edge_case"])
+        for row, case in zip(self._edge_row.values.tolist(), self._edge_case.values.tolist()):
+            self._row_cases.setdefault(row, []).append(case)
+        sessions = self._columns["session"].values.tolist()
+        questions = self._columns["question"].values.tolist()
+        for row, (session, qcode) in enumerate(zip(sessions, questions)):
+            self._session_rows.setdefault(session, {})[qcode] = row
+
+        days = self._columns["day"].values
+        if len(days):
+            self._ensure_day(int(days.min()))
+            self._apply_rows(np.arange(len(days)), 1)
+
+    # ---- 記録 ----
+
+    def _record(self, event: dict) -> None:
+        line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self._catch_up()
+
+    def record_session(self, session_id: str, created_at: str, questions: list[Question]) -> None:
+        """セッションで出した問いを記録する（create_session_log から呼ばれる）。"""
+        self._record(_session_event(session_id, created_at, [q.dict() for q in questions]))
+
+    def record_feedbacks(self, session_id: str, feedbacks: list[QuestionFeedback]) -> None:
+        """セッションのフィードバックを記録する（append_feedback と同じく全体を置き換える）。"""
+        self._record(_feedbacks_event(session_id, [fb.dict() for fb in feedbacks]))
+
+    def rebuild(self, sessions: Iterable[dict]) -> int:
+        """セッションログ（load_session_log のビュー）からジャーナルを作り直す。返り値はセッション数。"""
+
+        lines: list[str] = []
+        count = 0
+        for data in sessions:
+            session_id, created_at = data.get("session_id"), data.get("created_at")
+            if not session_id or not created_at:
+                continue
+            count += 1
+            events = [_session_event(session_id, created_at, data.get("questions") or [])]
+            if data.get("feedbacks"):
+                events.append(_feedbacks_event(session_id, data["feedbacks"]))
+            lines.extend(json.dumps(e, ensure_ascii=False) + "\n" for e in events)
+
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = self.journal_path.with_suffix(f".{os.getpid()}.tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                f.write("".join(lines))
+            os.replace(tmp, self.journal_path)
+            self._reset()
+            self._loaded = True  # 古いチェックポイントは読まない
+            self._catch_up()
+            self._save_checkpoint()
+        return count
+
+    # ---- 問い合わせ ----
+
+    def query(
+        self,
+        group_by: str,
+        *,
+        date_from: date | None = None,
+        date_to: date | None = None,
+        key: str | None = None,
+    ) -> AnalyticsResponse:
+        """group_by の値ごとの集計を返す（日付はセッション作成日、両端を含む）。"""
+
+        if group_by not in DIMENSIONS:
+            raise ValueError(f"group_by は {', '.join(DIMENSIONS)} のいずれかです: {group_by}")
+
+        with self._lock:
+            self._catch_up()
+            arr = self._aggregates[group_by]
+            values = list(self._codes[group_by].values)
+            theme_arr = self._aggregates["theme"]
+            day0 = self._day0
+
+        def window(a: np.ndarray) -> np.ndarray:
+            start, stop = 0, a.shape[1]
+            if day0 is not None:
+                if date_from is not None:
+                    start = max(0, date_from.toordinal() - day0)
+                if date_to is not None:
+                    stop = min(stop, date_to.toordinal() - day0 + 1)
+            if stop <= start:
+                return np.zeros((a.shape[0], _NUM_STATS), dtype=np.int64)
+            return a[:, start:stop].sum(axis=1)
+
+        sums = window(arr)
+        groups = [
+            _to_group(value, sums[code])
+            for code, value in enumerate(values[: sums.shape[0]])
+            if sums[code, _QUESTIONS] > 0 and (key is None or value == key)
+        ]
+        groups.sort(key=lambda g: (-g.questions, g.key))
+
+        # 合計は theme 軸から求める（case 軸は1つの問いを複数回数えるため）
+        total = window(theme_arr).sum(axis=0) if theme_arr.size else np.zeros(_NUM_STATS, dtype=np.int64)
+        return AnalyticsResponse(
+            group_by=group_by,
+            date_from=date_from.isoformat() if date_from else None,
+            date_to=date_to.isoformat() if date_to else None,
+            total=_to_group("total", total),
+            groups=groups,
+        )
+
+
+def _session_event(session_id: str, created_at: str, questions: list[dict]) -> dict:
+    return {
+        "type": "session",
+        "session_id": session_id,
+        "created_at": created_at,
+        "questions": [
+            {
+                "id": q["id"],
+                "theme": q["theme"],
+                "layer": q["layer"],
+                "risk_type": q["risk_type"],
+                "based_on_case_ids": list(q.get("based_on_case_ids") or []),
+            }
+            for q in questions
+        ],
+    }
+
+
+def _feedbacks_event(session_id: str, feedbacks: list[dict]) -> dict:
+    return {
+        "type": "feedbacks",
+        "session_id": session_id,
+        "feedbacks": [
+            {
+                "question_id": fb["question_id"],
+                "helpful_score": _helpful_score(fb.get("helpful_score")),
+                "modified_idea": fb.get("modified_idea"),
+            }
+            for fb in feedbacks
+        ],
+    }
+
+
+def _to_group(key: str, stats: np.ndarray) -> AnalyticsGroup:
+    rated = int(stats[_RATED])
+    feedbacks = int(stats[_FEEDBACKS])
+    return AnalyticsGroup(
+        key=key,
+        questions=int(stats[_QUESTIONS]),
+        feedbacks=feedbacks,
+        rated=rated,
+        avg_helpful_score=round(float(stats[_HELPFUL_SUM]) / rated, 4) if rated else None,
+        modified_idea_rate=round(float(stats[_MODIFIED]) / feedbacks, 4) if feedbacks else None,
+    )
+
+
+_STORES: dict[Path, FeedbackAnalytics] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_store(directory: Path, *, checkpoint_every: int = 1000) -> FeedbackAnalytics:
+    """directory の集計ストアを返す（ディレクトリごとに1つ）。"""
+
+    with _STORES_LOCK:
+        store = _STORES.get(directory)
+        if store is None:
+            store = _STORES[directory] = FeedbackAnalytics(directory, checkpoint_every=checkpoint_every)
+        return store
+
+
+__all__ = ["DIMENSIONS", "FeedbackAnalytics", "get_store"]
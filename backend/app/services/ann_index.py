@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+from app.services.utils import normalize_rows, topk_desc
+
+# k-means の学習に使う最大サンプル数（nlist あたり）
+_TRAIN_SAMPLES_PER_LIST = 256
+# 割り当て計算時のチャンクサイズ（N×nlist の行列を一度に作らないため）
+_ASSIGN_CHUNK = 65536
+
+
+class ExactIndex:
+    """全件の内積を計算する厳密検索（リファレンス実装）。"""
+
+    kind = "exact"
+
+    def __init__(self, X_n: np.ndarray) -> None:
+        self.X_n = X_n
+
+    def search(self, Q_n: np.ndarray, k: int) -> list[list[tuple[int, float]]]:
+        """正規化済みクエリ行列 Q_n (Q, D) に対し、行ごとに上位 k 件を返す。"""
+
+        if self.X_n.size == 0:
+            return [[] for _ in range(Q_n.shape[0])]
+
+        scores = Q_n @ self.X_n.T
+        results: list[list[tuple[int, float]]] = []
+        for row in scores:
+            idx = topk_desc(row, k)
+            results.append([(int(i), float(row[i])) for i in idx])
+        return results
+
+
+class IVFIndex:
+    """k-means による粗量子化を使った IVF (inverted file) 近似最近傍インデックス。
+
+    - build: 正規化済み行列を球面 k-means で nlist 個のクラスタに分け、
+      クラスタごとの行番号リストを作る。
+    - search: クエリに近いクラスタを nprobe 個選び、その中だけを厳密に採点する。
+      nprobe を大きくすると recall が上がり、小さくするとレイテンシが下がる。
+    - save / load: セントロイドと転置リストを .npz に保存する。行列本体は保存しない。
+    """
+
+    kind = "ivf"
+
+    def __init__(self, nlist: int, nprobe: int = 8, seed: int = 0) -> None:
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        self.X_n: np.ndarray | None = None
+        self.centroids: np.ndarray | None = None  # shape (nlist, D)
+        self.list_offsets: np.ndarray | None = None  # shape (nlist + 1,)
+        self.list_ids: np.ndarray | None = None  # shape (N,)  リストごとに連続
+        self.fingerprint = ""
+
+    def _assign(self, X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """各行を最も近いセントロイドに割り当てる。"""
+
+        labels = np.empty(X.shape[0], dtype=np.int32)
+        for start in range(0, X.shape[0], _ASSIGN_CHUNK):
+            chunk = X[start : start + _ASSIGN_CHUNK]
+            labels[start : start + chunk.shape[0]] = np.argmax(chunk @ centroids.T, axis=1)
+        return labels
+
+    def build(self, X_n: np.ndarray, *, n_iter: int = 20, fingerprint: str = "") -> "IVFIndex":
+        """正規化済み行列 X_n からインデックスを構築する。"""
+
+        rng = np.random.default_rng(self.seed)
+        n = X_n.shape[0]
+        nlist = max(1, min(self.nlist, n))
+
+        # 学習用サンプル
+        n_train = min(n, nlist * _TRAIN_SAMPLES_PER_LIST)
+        train = X_n[rng.choice(n, size=n_train, replace=False)] if n_train < n else X_n
+        train = np.asarray(train, dtype="float32")
+
+        centroids = train[rng.choice(train.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            labels = self._assign(train, centroids)
+            counts = np.bincount(labels, minlength=nlist)
+
+            # ラベル順に並べて reduceat でクラスタごとの和を取る（np.add.at より高速）
+            order = np.argsort(labels, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros_like(centroids)
+            nonempty = counts > 0
+            sums[nonempty] = np.add.reduceat(train[order], starts[nonempty], axis=0)
+
+            # 空クラスタはランダムなサンプルで埋め直す
+            empty = counts == 0
+            if np.any(empty):
+                sums[empty] = train[rng.choice(train.shape[0], size=int(empty.sum()))]
+            centroids = normalize_rows(sums).astype("float32")
+
+        labels = self._assign(X_n, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+
+        self.nlist = nlist
+        self.X_n = X_n
+        self.centroids = centroids
+        self.list_ids = order.astype(np.int64)
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.fingerprint = fingerprint
+        return self
+
+    def reassign(self, X_n: np.ndarray, *, fingerprint: str = "") -> "IVFIndex":
+        """既存のセントロイドを再利用し、新しい行列で転置リストだけを作り直した索引を返す。
+
+        ケースの追加・更新・削除時に k-means をやり直さずに済ませるためのもの。
+        自身は変更しない（検索中のスナップショットを壊さない）。
+        """
+
+        assert self.centroids is not None
+        labels = self._assign(X_n, self.centroids)
+        counts = np.bincount(labels, minlength=self.nlist)
+
+        index = IVFIndex(nlist=self.nlist, nprobe=self.nprobe, seed=self.seed)
+        index.X_n = X_n
+        index.centroids = self.centroids
+        index.list_ids = np.argsort(labels, kind="stable").astype(np.int64)
+        index.list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        index.fingerprint = fingerprint
+        return index
+
+    def attach(self, X_n: np.ndarray) -> "IVFIndex":
+        """load したインデックスに対応する行列を紐づける。"""
+
+        self.X_n = X_n
+        return self
+
+    def search(
+        self,
+        Q_n: np.ndarray,
+        k: int,
+        *,
+        nprobe: int | None = None,
+    ) -> list[list[tuple[int, float]]]:
+        """正規化済みクエリ行列 Q_n (Q, D) に対し、行ごとに近似上位 k 件を返す。"""
+
+        if self.X_n is None or self.centroids is None:
+            raise RuntimeError("IVFIndex が構築されていません。")
+        assert self.list_offsets is not None and self.list_ids is not None
+
+        probe = max(1, min(nprobe or self.nprobe, self.nlist))
+        centroid_scores = Q_n @ self.centroids.T
+
+        results: list[list[tuple[int, float]]] = []
+        for q, cs in zip(Q_n, centroid_scores):
+            lists = topk_desc(cs, probe)
+            candidates = np.concatenate(
+                [self.list_ids[self.list_offsets[l] : self.list_offsets[l + 1]] for l in lists]
+            )
+            if candidates.size == 0:
+                results.append([])
+                continue
+
+            scores = self.X_n[candidates] @ q
+            idx = topk_desc(scores, k)
+            results.append([(int(candidates[i]), float(scores[i])) for i in idx])
+        return results
+
+    def save(self, path: Path) -> None:
+        """インデックスを .npz に保存する（一時ファイル + os.replace）。"""
+
+        assert self.centroids is not None
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp.npz")
+        np.savez(
+            tmp,
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_ids=self.list_ids,
+            nprobe=np.array(self.nprobe),
+            seed=np.array(self.seed),
+            fingerprint=np.array(self.fingerprint),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        """save したインデックスを読み込む。行列は attach で別途紐づける。"""
+
+        with np.load(path) as data:
+            centroids = data["centroids"]
+            index = cls(
+                nlist=int(centroids.shape[0]),
+                nprobe=int(data["nprobe"]),
+                seed=int(data["seed"]),
+            )
+            index.centroids = centroids
+            index.list_offsets = data["list_offsets"]
+            index.list_ids = data["list_ids"]
+            index.fingerprint = str(data["fingerprint"])
+        return index
+
+
+def default_nlist(n: int) -> int:
+    """件数 n に対する nlist の目安（おおよそ 4√n）を返す。"""
+
+    return max(1, int(4 * np.sqrt(n)))
+
+
+def evaluate_recall(
+    index: IVFIndex,
+    X_n: np.ndarray,
+    Q_n: np.ndarray,
+    k: int,
+    *,
+    nprobe: int | None = None,
+) -> float:
+    """厳密検索を正解として、近似検索の recall@k を計算する（nprobe 調整用）。"""
+
+    exact = ExactIndex(X_n).search(Q_n, k)
+    approx = index.search(Q_n, k, nprobe=nprobe)
+
+    hit = 0
+    total = 0
+    for e, a in zip(exact, approx):
+        truth = {i for i, _ in e}
+        hit += len(truth & {i for i, _ in a})
+        total += len(truth)
+    return hit / total if total else 1.0
+
+
+__all__ = ["ExactIndex", "IVFIndex", "default_nlist", "evaluate_recall"]
@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Iterable, overload
+
+import numpy as np
+
+from app.models import DecisionCase
+from app.services.lexical_index import BM25Index
+from app.services.metadata_index import MetadataIndex
+
+# ファイル形式:
+#   [magic 8B][ヘッダ長 uint64][ヘッダ JSON][パディング][セクション...]
+# 各セクションは 64 バイト境界に置いた numpy 配列で、ヘッダの sections に
+# dtype / shape / offset を持つ。文字列の列は「offsets (N+1,) uint64 + UTF-8 の連結バイト列」。
+_MAGIC = b"DCSNAP\x00\x01"
+_VERSION = 1
+_ALIGN = 64
+
+# DecisionCase の列（tags はリストなので JSON 文字列として保存する）
+_CASE_FIELDS = (
+    "id", "project_id", "title", "summary", "status", "main_reason",
+    "tags", "decision_date", "decision_level", "source",
+)
+
+
+def get_snapshot_path(source: Path) -> Path:
+    """DecisionCase ファイルに対応するスナップショットのパス（decision_case.snapshot）を返す。"""
+
+    return source.with_suffix(".snapshot")
+
+
+def source_signature(source: Path) -> dict | None:
+    """元ファイルの (サイズ, 更新時刻) を返す。スナップショットが古くないかの判定に使う。"""
+
+    try:
+        st = source.stat()
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+class StringColumn(Sequence[str]):
+    """offsets + 連結バイト列で表した文字列の列。要素は参照されたときにだけデコードする。"""
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray) -> None:
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @overload
+    def __getitem__(self, i: int) -> str: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> list[str]: ...
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._data[start:end].tobytes().decode("utf-8")
+
+    def to_list(self) -> list[str]:
+        blob = self._data.tobytes()
+        offsets = self._offsets.tolist()
+        return [blob[offsets[i] : offsets[i + 1]].decode("utf-8") for i in range(len(self))]
+
+
+def _encode_strings(values: Iterable[str]) -> tuple[np.ndarray, np.ndarray]:
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    if encoded:
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+class SnapshotCases(Sequence[DecisionCase]):
+    """スナップショット上の DecisionCase 一覧。
+
+    DecisionCase は参照された行だけを組み立てる（書き出し時に検証済みなので model_construct を使う）。
+    """
+
+    def __init__(self, snapshot: "CorpusSnapshot") -> None:
+        self.snapshot = snapshot
+        self._cache: dict[int, DecisionCase] = {}
+        self._rows_by_id: dict[str, int] | None = None
+
+    def __len__(self) -> int:
+        return self.snapshot.num_cases
+
+    @overload
+    def __getitem__(self, i: int) -> DecisionCase: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> list[DecisionCase]: ...
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        case = self._cache.get(i)
+        if case is None:
+            case = self._cache[i] = self.snapshot.build_case(i)
+        return case
+
+    def index_of(self, case_id: str) -> int | None:
+        """id の行番号を返す（初回のみ id 列をデコードして辞書を作る）。"""
+
+        if self._rows_by_id is None:
+            self._rows_by_id = {
+                case_id: row for row, case_id in enumerate(self.snapshot.column("case.id").to_list())
+            }
+        return self._rows_by_id.get(case_id)
+
+
+class CorpusSnapshot:
+    """コンパイル済みコーパス（DecisionCase の列・内容ハッシュ・正規化済み行列・BM25・メタデータ）。
+
+    ファイル全体を memory-map し、各セクションはそのビューとして参照する。開く処理は
+    ヘッダの読み込みだけで、件数によらずほぼ一定時間で終わる。
+    """
+
+    def __init__(self, path: Path, header: dict, buffer: mmap.mmap) -> None:
+        self.path = path
+        self.header = header
+        self._buffer = buffer
+        self.num_cases: int = header["num_cases"]
+        self.source: dict = header["source"]
+        # 行列を作ったときの埋め込み（"{provider}/{model}"）。行列を含まない場合は None
+        self.embedding: str | None = header.get("embedding")
+        self.cases = SnapshotCases(self)
+
+    def _array(self, name: str) -> np.ndarray:
+        spec = self.header["sections"][name]
+        dtype = np.dtype(spec["dtype"])
+        shape = tuple(spec["shape"])
+        count = int(np.prod(shape)) if shape else 1
+        return np.frombuffer(self._buffer, dtype=dtype, count=count, offset=spec["offset"]).reshape(shape)
+
+    def has(self, name: str) -> bool:
+        return name in self.header["sections"]
+
+    def column(self, name: str) -> StringColumn:
+        return StringColumn(self._array(f"{name}.offsets"), self._array(f"{name}.data"))
+
+    def build_case(self, row: int) -> DecisionCase:
+        fields: dict = {}
+        for name in _CASE_FIELDS:
+            column = f"case.{name}"
+            if self.has(f"{column}.null") and self._array(f"{column}.null")[row]:
+                fields[name] = None
+                continue
+            value = self.column(column)[row]
+            fields[name] = json.loads(value) if name == "tags" else value
+        return DecisionCase.model_construct(**fields)
+
+    @property
+    def keys(self) -> list[str]:
+        """各行の build_case_text の内容ハッシュ。"""
+        return self.column("keys").to_list()
+
+    @property
+    def vectors(self) -> np.ndarray | None:
+        """L2 正規化済みの埋め込み行列 (N, D)（読み取り専用のビュー）。"""
+        return self._array("vectors") if self.has("vectors") else None
+
+    @property
+    def lexical(self) -> BM25Index:
+        params = self.header["bm25"]
+        return BM25Index.restore(
+            self.column("bm25.terms").to_list(),
+            self._array("bm25.offsets"),
+            self._array("bm25.doc_ids"),
+            self._array("bm25.weights"),
+            num_docs=self.num_cases,
+            n=params["n"],
+            k1=params["k1"],
+            b=params["b"],
+        )
+
+    @property
+    def metadata(self) -> MetadataIndex:
+        masks = self._array("metadata.masks")
+        values = self.column("metadata.values").to_list()
+        grouped: dict[str, dict[str, np.ndarray]] = {}
+        for i, item in enumerate(values):
+            field, value = item.split("\x1f", 1)
+            grouped.setdefault(field, {})[value] = masks[i]
+        return MetadataIndex.restore(self.num_cases, grouped)
+
+
+def open_snapshot(path: Path, source: Path | None = None) -> CorpusSnapshot | None:
+    """スナップショットを開く。存在しない・壊れている・元ファイルより古い場合は None。"""
+
+    try:
+        with path.open("rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                return None
+            header_len = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_len).decode("utf-8"))
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if header.get("version") != _VERSION:
+        return None
+    if source is not None and header.get("source") != source_signature(source):
+        return None
+    return CorpusSnapshot(path, header, buffer)
+
+
+def write_snapshot(
+    path: Path,
+    *,
+    cases: Sequence[DecisionCase],
+    keys: Sequence[str],
+    lexical: BM25Index,
+    metadata: MetadataIndex,
+    source: dict | None,
+    vectors: np.ndarray | None = None,
+    embedding: str | None = None,
+) -> None:
+    """スナップショットを書き出す（一時ファイル + os.replace）。
+
+    source には元ファイルの source_signature を渡す（読み込み時に一致しなければ使わない）。
+    vectors は L2 正規化済みの float32 行列で、embedding はそれを作った "{provider}/{model}"。
+    """
+
+    sections: dict[str, np.ndarray] = {}
+
+    def add_strings(name: str, values: Iterable[str]) -> None:
+        sections[f"{name}.offsets"], sections[f"{name}.data"] = _encode_strings(values)
+
+    for name in _CASE_FIELDS:
+        values = [getattr(c, name) for c in cases]
+        nulls = np.array([v is None for v in values], dtype=bool)
+        if nulls.any():
+            sections[f"case.{name}.null"] = nulls
+        if name == "tags":
+            values = [json.dumps(v or [], ensure_ascii=False) for v in values]
+        add_strings(f"case.{name}", (v or "" for v in values))
+
+    add_strings("keys", keys)
+
+    terms = [""] * len(lexical.vocab)
+    for term, tid in lexical.vocab.items():
+        terms[tid] = term
+    add_strings("bm25.terms", terms)
+    sections["bm25.offsets"] = lexical.offsets
+    sections["bm25.doc_ids"] = lexical.doc_ids
+    sections["bm25.weights"] = lexical.weights
+
+    names = [f"{field}\x1f{value}" for field, masks in metadata.masks.items() for value in masks]
+    add_strings("metadata.values", names)
+    rows = [mask for masks in metadata.masks.values() for mask in masks.values()]
+    sections["metadata.masks"] = (
+        np.stack(rows) if rows else np.zeros((0, len(cases)), dtype=bool)
+    )
+
+    if vectors is not None:
+        sections["vectors"] = np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def layout(start: int) -> dict:
+        specs: dict = {}
+        offset = start
+        for name, arr in sections.items():
+            offset = -(-offset // _ALIGN) * _ALIGN
+            specs[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+            offset += arr.nbytes
+        return specs
+
+    header = {
+        "version": _VERSION,
+        "num_cases": len(cases),
+        "source": source,
+        "embedding": embedding if vectors is not None else None,
+        "bm25": {"n": lexical.n, "k1": lexical.k1, "b": lexical.b},
+        "sections": {},
+    }
+    # セクションのオフセットはヘッダの長さに依存するので、ヘッダが収まるまで開始位置をずらす
+    start = _ALIGN
+    while True:
+        header["sections"] = layout(start)
+        encoded = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        needed = len(_MAGIC) + 8 + len(encoded)
+        if needed <= start:
+            break
+        start = -(-needed // _ALIGN) * _ALIGN
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with tmp.open("wb") as f:
+        f.write(_MAGIC)
+        f.write(len(encoded).to_bytes(8, "little"))
+        f.write(encoded)
+        for name, arr in sections.items():
+            f.write(b"\x00" * (header["sections"][name]["offset"] - f.tell()))
+            f.write(np.ascontiguousarray(arr).tobytes())
+    os.replace(tmp, path)
+
+
+__all__ = [
+    "CorpusSnapshot",
+    "SnapshotCases",
+    "StringColumn",
+    "get_snapshot_path",
+    "open_snapshot",
+    "source_signature",
+    "write_snapshot",
+]
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+from typing import Callable
+
+
+class CorpusWatcher:
+    """DecisionCase ファイルの変更をポーリングで監視し、変更時にコールバックを呼ぶ。
+
+    外部ライブラリに依存しないよう、一定間隔で mtime とサイズを確認するだけの実装。
+    コールバックで例外が出ても監視は続ける（次の変更で再試行される）。
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        on_change: Callable[[], None],
+        *,
+        interval_seconds: float = 5.0,
+    ) -> None:
+        self.path = path
+        self.on_change = on_change
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._last_signature = self._signature()
+
+    def _signature(self) -> tuple[int, int] | None:
+        try:
+            st = self.path.stat()
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def check(self) -> bool:
+        """ファイルが変更されていればコールバックを呼び、True を返す。"""
+
+        signature = self._signature()
+        if signature is None or signature == self._last_signature:
+            return False
+
+        self._last_signature = signature
+        try:
+            self.on_change()
+        except Exception as exc:
+            print(f"corpus watcher: 再読み込みに失敗しました: {exc}")
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            self.check()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="corpus-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval_seconds)
+            self._thread = None
+
+
+__all__ = ["CorpusWatcher"]
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable
+
+import numpy as np
+
+from app.services import metrics
+
+
+class EmbeddingBatcher:
+    """同時に届いた埋め込みリクエストを1回のプロバイダ呼び出しにまとめる。
+
+    - 最初のリクエストから window_seconds 待つ間に届いたテキストを1つのバッチにする。
+      待機中のテキスト数が max_batch_size に達した場合はその時点で送る。
+    - バッチ内の重複テキストは1回だけ埋め込み、呼び出し元ごとに自分の行だけを返す。
+    - プロバイダ呼び出しが失敗した場合は、そのバッチの全呼び出し元に同じ例外を返す。
+    - 呼び出し元がキャンセル（タイムアウト）されてもバッチ自体は続行し、他の呼び出し元に影響しない。
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[list[str]], Awaitable[np.ndarray]],
+        *,
+        window_seconds: float = 0.01,
+        max_batch_size: int = 128,
+    ) -> None:
+        self.embed_fn = embed_fn
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pending: list[tuple[list[str], asyncio.Future]] = []
+        self._pending_count = 0
+        self._timer: asyncio.TimerHandle | None = None
+        # 実行中のバッチ（タスクが GC されないよう参照を保持する）
+        self._tasks: set[asyncio.Task] = set()
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        """texts を埋め込み、shape = (len(texts), D) の行列を返す。"""
+
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # イベントループが変わった場合（テストなど）は古い待機分を破棄してやり直す
+            self._loop = loop
+            self._pending, self._pending_count, self._timer = [], 0, None
+
+        future: asyncio.Future = loop.create_future()
+        self._pending.append((list(texts), future))
+        self._pending_count += len(texts)
+
+        if self._pending_count >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_seconds, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        """待機中のリクエストを1つのバッチとして送り出す。"""
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending, self._pending_count = self._pending, [], 0
+        if not batch:
+            return
+
+        assert self._loop is not None
+        task = self._loop.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[list[str], asyncio.Future]]) -> None:
+        rows: dict[str, int] = {}
+        for texts, _ in batch:
+            for t in texts:
+                rows.setdefault(t, len(rows))
+
+        metrics.EMBED_BATCH_SIZE.observe(len(rows))
+        try:
+            vectors = await self.embed_fn(list(rows.keys()))
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for texts, future in batch:
+            if not future.done():
+                future.set_result(vectors[[rows[t] for t in texts]])
+
+
+__all__ = ["EmbeddingBatcher"]
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+# manifest.json に {"vectors": ベクトルのファイル名, "keys": [...]} を保存する。
+# ベクトルは保存のたびに別名のファイル（vectors.<id>.npy）に書き、manifest.json の
+# 置き換えだけでキーと行列を同時に切り替える（keys[i] が行列の i 行目に対応する）
+_MANIFEST_FILE = "manifest.json"
+_VECTORS_GLOB = "vectors*.npy"
+# 複数プロセスの書き込みを1つずつにするためのロック（flock）
+_LOCK_FILE = "store.lock"
+
+
+def _get_default_root_dir() -> Path:
+    """埋め込みキャッシュのルートディレクトリ (backend/data/embeddings) を返す。"""
+
+    services_dir = Path(__file__).resolve().parent
+    return services_dir.parent.parent / "data" / "embeddings"
+
+
+def text_hash(text: str) -> str:
+    """テキストの内容ハッシュ (sha256) を返す。"""
+
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """内容ハッシュ → 埋め込みベクトルの永続キャッシュ。
+
+    - キーは「テキストの sha256 + プロバイダ名 + モデル名」。
+      プロバイダ/モデルごとにディレクトリを分けて保存する。
+    - ベクトルは .npy として保存し、読み込み時は memory-map で開く。
+      そのため再起動や追加ワーカーは未登録のテキストだけを埋め込めばよい。
+    - 書き込みは flock で1プロセスずつ行い、ディスク上の最新の内容に追記してから
+      manifest.json を os.replace で置き換える（uvicorn --workers N の各ワーカーが
+      同時に追加しても互いの追加を失わず、キーと行がずれることもない）。
+    """
+
+    def __init__(self, provider: str, model: str, root: Path | None = None) -> None:
+        self.provider = provider
+        self.model = model
+        safe_model = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        self.directory = (root or _get_default_root_dir()) / f"{provider}__{safe_model}"
+
+        self._keys: list[str] = []
+        self._index: dict[str, int] = {}
+        self._vectors: np.ndarray | None = None
+        self._vectors_file: str | None = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def _load(self) -> None:
+        """ディスク上のキャッシュを memory-map で開く。無い・壊れている場合は何もしない。"""
+
+        try:
+            with (self.directory / _MANIFEST_FILE).open("r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            keys = manifest["keys"]
+            vectors = np.load(self.directory / manifest["vectors"], mmap_mode="r")
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+
+        if vectors.ndim != 2 or len(keys) != vectors.shape[0]:
+            return
+
+        self._keys = list(keys)
+        self._index = {k: i for i, k in enumerate(self._keys)}
+        self._vectors = vectors
+        self._vectors_file = manifest["vectors"]
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        """書き込みを1プロセスずつに限るロック（fcntl が無い環境ではロックしない）。"""
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with (self.directory / _LOCK_FILE).open("a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _save(self, keys: list[str], vectors: np.ndarray) -> str:
+        """ベクトルを新しいファイルに書き、manifest.json を置き換える（_write_lock の中で呼ぶ）。
+
+        返り値は新しいベクトルのファイル名。
+        """
+
+        vectors_file = f"vectors.{uuid.uuid4().hex}.npy"
+        tmp_vectors = self.directory / f"{vectors_file}.{os.getpid()}.tmp"
+        with tmp_vectors.open("wb") as f:
+            np.save(f, vectors)
+        os.replace(tmp_vectors, self.directory / vectors_file)
+
+        manifest_path = self.directory / _MANIFEST_FILE
+        tmp_manifest = manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        with tmp_manifest.open("w", encoding="utf-8") as f:
+            json.dump({"vectors": vectors_file, "keys": keys}, f)
+        os.replace(tmp_manifest, manifest_path)
+
+        # 直前の世代は読み込み途中のプロセスのために残し、それより古いものを消す
+        keep = {vectors_file, self._vectors_file}
+        for path in self.directory.glob(_VECTORS_GLOB):
+            if path.name not in keep:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+        return vectors_file
+
+    def lookup(self, keys: list[str]) -> list[int | None]:
+        """キーごとの行番号を返す（未登録は None）。"""
+
+        return [self._index.get(k) for k in keys]
+
+    def get(self, key: str) -> np.ndarray | None:
+        """1件分のベクトルを返す（未登録は None）。"""
+
+        row = self._index.get(key)
+        if row is None or self._vectors is None:
+            return None
+        return np.asarray(self._vectors[row])
+
+    def get_many(self, keys: list[str]) -> np.ndarray:
+        """複数キーのベクトルをまとめて返す（すべて登録済みであること）。"""
+
+        assert self._vectors is not None
+        rows = [self._index[k] for k in keys]
+        return np.asarray(self._vectors[rows], dtype="float32")
+
+    def add(self, keys: list[str], vectors: np.ndarray) -> None:
+        """新しいキーとベクトルを追記して保存する。既存キーは無視する。"""
+
+        if vectors.size == 0:
+            return
+
+        with self._write_lock():
+            # 他のプロセスが保存した分を取り込んでから追記する
+            self._load()
+
+            # 既存キー・同一バッチ内の重複キーは1つにまとめる
+            seen: set[str] = set()
+            unique_rows: list[int] = []
+            for i, k in enumerate(keys):
+                if k not in self._index and k not in seen:
+                    seen.add(k)
+                    unique_rows.append(i)
+            if not unique_rows:
+                return
+
+            new_vecs = np.asarray(vectors[unique_rows], dtype="float32")
+            if self._vectors is not None and self._vectors.shape[1] != new_vecs.shape[1]:
+                # 次元が変わった場合（モデル側の仕様変更など）は作り直す
+                self._keys, self._index, self._vectors = [], {}, None
+
+            if self._vectors is None:
+                merged = new_vecs
+            else:
+                merged = np.concatenate([np.asarray(self._vectors), new_vecs], axis=0)
+            merged_keys = self._keys + [keys[i] for i in unique_rows]
+
+            vectors_file = self._save(merged_keys, merged)
+
+        # 保存したファイルは読み直さず、手元の行列をそのまま使う
+        self._keys = merged_keys
+        self._index = {k: i for i, k in enumerate(self._keys)}
+        self._vectors = merged
+        self._vectors_file = vectors_file
+
+    def get_or_embed(
+        self,
+        texts: list[str],
+        embed_fn: Callable[[list[str]], np.ndarray],
+    ) -> np.ndarray:
+        """キャッシュ済みのベクトルを返し、未登録のテキストだけ embed_fn で埋め込む。
+
+        戻り値は texts と同じ順序の shape = (len(texts), D) の float32 行列。
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+
+        keys = [text_hash(t) for t in texts]
+
+        missing: dict[str, str] = {}
+        for k, t in zip(keys, texts):
+            if k not in self._index and k not in missing:
+                missing[k] = t
+
+        if missing:
+            missing_keys = list(missing.keys())
+            vecs = embed_fn([missing[k] for k in missing_keys])
+            self.add(missing_keys, vecs)
+
+        assert self._vectors is not None
+        rows = [self._index[k] for k in keys]
+        return np.asarray(self._vectors[rows], dtype="float32")
+
+
+__all__ = ["EmbeddingStore", "text_hash"]
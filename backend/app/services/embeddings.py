@@ -3,13 +3,71 @@ from __future__ import annotations
 import numpy as np
 from dotenv import load_dotenv
 
+from app.config import get_settings
 from app.services.ai_services import ai_service
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.embedding_store import EmbeddingStore
 
 load_dotenv()
 
+_settings = get_settings()
+_STORE: EmbeddingStore | None = None
+
 # 11/27 add: services/ai_services.pyに集約
 def embed_texts(texts: list[str]) -> np.ndarray:
     return ai_service.embed_texts(texts)
 
-__all__ = ["embed_texts"]
 
+async def _aembed_texts_direct(texts: list[str]) -> np.ndarray:
+    return await ai_service.aembed_texts(texts)
+
+
+# 同時リクエストのクエリ埋め込みを1回のプロバイダ呼び出しにまとめる
+embedding_batcher = EmbeddingBatcher(
+    _aembed_texts_direct,
+    window_seconds=_settings.EMBED_BATCH_WINDOW_SECONDS,
+    max_batch_size=_settings.EMBED_BATCH_MAX_SIZE,
+)
+
+
+async def aembed_texts(texts: list[str]) -> np.ndarray:
+    """embed_texts の非同期版。
+
+    EMBED_BATCH_WINDOW_SECONDS > 0 の場合、同時に呼ばれた分をまとめて1回で埋め込む。
+    """
+    if _settings.EMBED_BATCH_WINDOW_SECONDS <= 0:
+        return await _aembed_texts_direct(texts)
+    return await embedding_batcher.embed(texts)
+
+
+def get_embedding_model() -> str:
+    """キャッシュキー用の "<provider>/<model>" 文字列を返す。"""
+    return f"{ai_service.provider}/{ai_service.embedding_model}"
+
+
+def get_embedding_store() -> EmbeddingStore:
+    """使用中のプロバイダ/モデルに対応する EmbeddingStore を返す。"""
+    global _STORE
+
+    provider, model = ai_service.provider, ai_service.embedding_model
+    if _STORE is None or (_STORE.provider, _STORE.model) != (provider, model):
+        _STORE = EmbeddingStore(provider, model)
+    return _STORE
+
+
+def embed_texts_cached(texts: list[str]) -> np.ndarray:
+    """ディスク上の埋め込みキャッシュを通して埋め込みを取得する。
+
+    未登録（新規・変更された）テキストだけを embed_texts で計算する。
+    """
+    return get_embedding_store().get_or_embed(texts, embed_texts)
+
+
+__all__ = [
+    "aembed_texts",
+    "embed_texts",
+    "embed_texts_cached",
+    "embedding_batcher",
+    "get_embedding_model",
+    "get_embedding_store",
+]
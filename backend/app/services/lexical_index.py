@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import re
+import unicodedata
+
+import numpy as np
+
+from app.services.utils import topk_desc
+
+# 英数字の連続は1単語として扱い、それ以外（日本語など）は文字 n-gram に分割する
+_ASCII_WORD = re.compile(r"[0-9a-z]+")
+_NON_ASCII_RUN = re.compile(r"[^\x00-\x7f\s　-〿！-／]+")
+
+
+def tokenize(text: str, n: int = 2) -> list[str]:
+    """BM25 用のトークン列を返す。
+
+    形態素解析器を使わずに日本語を扱えるよう、非 ASCII の連続部分は文字 n-gram
+    （長さ n 未満の連続部分はそのまま1トークン）に分割する。英数字は単語単位。
+    """
+
+    return tokenize_ngram_range(text, n, n)
+
+
+def tokenize_ngram_range(text: str, lo: int, hi: int) -> list[str]:
+    """lo〜hi の各 n の文字 n-gram を合わせたトークン列を返す。
+
+    英数字の単語と長さ lo 未満の連続部分は1回だけ数える（tokenize を n ごとに呼んで
+    足し合わせると、これらが n の種類の数だけ重複し、文字 n-gram より重くなる）。
+    """
+
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = _ASCII_WORD.findall(text)
+    for run in _NON_ASCII_RUN.findall(text):
+        if len(run) < lo:
+            tokens.append(run)
+            continue
+        for n in range(lo, min(hi, len(run)) + 1):
+            tokens.extend(run[i : i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+
+class BM25Index:
+    """文字 n-gram ベースの BM25 転置インデックス。
+
+    - build: 文書ごとのトークン頻度から、語ごとの (文書番号, 重み) の転置リストを作る。
+      重みは idf × tf 正規化項をあらかじめ掛けたもので、検索時は足し合わせるだけになる。
+    - scores: クエリの全文書に対するスコア (N,) を返す。
+    - search: 上位 k 件を返す。mask を渡すとその行だけを対象にする。
+    """
+
+    def __init__(self, *, n: int = 2, k1: float = 1.5, b: float = 0.75) -> None:
+        self.n = n
+        self.k1 = k1
+        self.b = b
+        self.num_docs = 0
+        self.vocab: dict[str, int] = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0, dtype=np.float32)
+
+    def build(self, docs: list[str]) -> "BM25Index":
+        """文書一覧からインデックスを構築する。"""
+
+        self.num_docs = len(docs)
+        postings: dict[str, list[tuple[int, int]]] = {}
+        doc_lens = np.zeros(len(docs), dtype=np.float32)
+
+        for doc_id, doc in enumerate(docs):
+            tokens = tokenize(doc, self.n)
+            doc_lens[doc_id] = len(tokens)
+            counts: dict[str, int] = {}
+            for t in tokens:
+                counts[t] = counts.get(t, 0) + 1
+            for t, tf in counts.items():
+                postings.setdefault(t, []).append((doc_id, tf))
+
+        avgdl = float(doc_lens.mean()) if len(docs) else 0.0
+        norm = self.k1 * (1 - self.b + self.b * doc_lens / avgdl) if avgdl > 0 else doc_lens
+
+        self.vocab = {}
+        offsets = [0]
+        all_ids: list[np.ndarray] = []
+        all_weights: list[np.ndarray] = []
+        for term, plist in postings.items():
+            ids = np.fromiter((d for d, _ in plist), dtype=np.int32, count=len(plist))
+            tfs = np.fromiter((tf for _, tf in plist), dtype=np.float32, count=len(plist))
+            df = len(plist)
+            idf = np.log(1.0 + (self.num_docs - df + 0.5) / (df + 0.5))
+            all_ids.append(ids)
+            all_weights.append((idf * tfs * (self.k1 + 1) / (tfs + norm[ids])).astype(np.float32))
+            self.vocab[term] = len(offsets) - 1
+            offsets.append(offsets[-1] + df)
+
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.doc_ids = np.concatenate(all_ids) if all_ids else np.zeros(0, dtype=np.int32)
+        self.weights = np.concatenate(all_weights) if all_weights else np.zeros(0, dtype=np.float32)
+        return self
+
+    @classmethod
+    def restore(
+        cls,
+        terms: list[str],
+        offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        weights: np.ndarray,
+        *,
+        num_docs: int,
+        n: int = 2,
+        k1: float = 1.5,
+        b: float = 0.75,
+    ) -> "BM25Index":
+        """build 済みの配列（corpus_snapshot に保存したもの）からインデックスを復元する。
+
+        terms[i] は語番号 i の語。配列はコピーせずにそのまま使う。
+        """
+
+        index = cls(n=n, k1=k1, b=b)
+        index.num_docs = num_docs
+        index.vocab = {term: tid for tid, term in enumerate(terms)}
+        index.offsets = offsets
+        index.doc_ids = doc_ids
+        index.weights = weights
+        return index
+
+    def scores(self, query: str) -> np.ndarray:
+        """クエリに対する全文書の BM25 スコア (N,) を返す。"""
+
+        out = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query, self.n)):
+            tid = self.vocab.get(term)
+            if tid is None:
+                continue
+            start, end = self.offsets[tid], self.offsets[tid + 1]
+            # 1つの語の転置リスト内で文書番号は重複しないので、そのまま加算できる
+            out[self.doc_ids[start:end]] += self.weights[start:end]
+        return out
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        *,
+        mask: np.ndarray | None = None,
+    ) -> list[tuple[int, float]]:
+        """上位 k 件の (文書番号, スコア) を返す。スコア 0 の文書は含めない。"""
+
+        scores = self.scores(query)
+        if mask is not None:
+            scores = np.where(mask, scores, 0.0)
+        idx = topk_desc(scores, k)
+        return [(int(i), float(scores[i])) for i in idx if scores[i] > 0]
+
+
+__all__ = ["BM25Index", "tokenize", "tokenize_ngram_range"]
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from pydantic import ValidationError
+
+from app.models import LLMQuestionsPayload
+
+
+def _get_default_cache_dir() -> Path:
+    """LLM 応答キャッシュの保存先 (backend/data/cache/llm) を返す。"""
+
+    services_dir = Path(__file__).resolve().parent
+    return services_dir.parent.parent / "data" / "cache" / "llm"
+
+
+def make_cache_key(system_prompt: str, user_message: str, model: str) -> str:
+    """(system プロンプト, user メッセージ, モデル名) の内容ハッシュを返す。"""
+
+    raw = json.dumps([system_prompt, user_message, model], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """検証済み LLMQuestionsPayload の内容アドレス型キャッシュ。
+
+    - メモリ上の LRU（max_entries 件）と、ディスク上の JSON ファイル
+      （max_disk_entries 件）の2段構成。
+    - ttl_seconds を過ぎたエントリはどちらの層でもミス扱いにして削除する。
+    - ディスク層は件数が上限を超えたら更新時刻の古いものから削除する。
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = 256,
+        max_disk_entries: int = 5000,
+        ttl_seconds: float = 7 * 24 * 3600,
+        directory: Path | None = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.directory = directory or _get_default_cache_dir()
+
+        self._memory: OrderedDict[str, tuple[float, LLMQuestionsPayload]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_count: int | None = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _expired(self, created_at: float) -> bool:
+        return time.time() - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> LLMQuestionsPayload | None:
+        """キャッシュ済みの応答を返す。無い・期限切れ・壊れている場合は None。"""
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, payload = entry
+                if not self._expired(created_at):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return payload
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            created_at = float(data["created_at"])
+            payload = LLMQuestionsPayload.model_validate(data["payload"])
+        except (OSError, KeyError, TypeError, ValueError, ValidationError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if self._expired(created_at):
+            path.unlink(missing_ok=True)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            self._put_memory(key, created_at, payload)
+        return payload
+
+    def _put_memory(self, key: str, created_at: float, payload: LLMQuestionsPayload) -> None:
+        """メモリ層に登録する（ロック取得済みで呼ぶこと）。"""
+
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = (created_at, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key: str, payload: LLMQuestionsPayload) -> None:
+        """応答をメモリ層とディスク層に登録する。"""
+
+        created_at = time.time()
+        with self._lock:
+            self._put_memory(key, created_at, payload)
+
+        if self.max_disk_entries <= 0:
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(
+                {"created_at": created_at, "payload": payload.model_dump()},
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp, path)
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """ディスク層の件数が上限を超えたら古いものから削除する。"""
+
+        with self._lock:
+            if self._disk_count is not None:
+                self._disk_count += 1
+                if self._disk_count <= self.max_disk_entries:
+                    return
+
+            files = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+            overflow = len(files) - self.max_disk_entries
+            for p in files[: max(0, overflow)]:
+                p.unlink(missing_ok=True)
+            self._disk_count = min(len(files), self.max_disk_entries)
+
+    def clear(self) -> None:
+        """メモリ層・ディスク層の両方を空にする。"""
+
+        with self._lock:
+            self._memory.clear()
+            for p in self.directory.glob("*.json"):
+                p.unlink(missing_ok=True)
+            self._disk_count = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory_size": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+__all__ = ["LLMResponseCache", "make_cache_key"]
@@ -1,36 +1,166 @@
 from __future__ import annotations
 
 import json
+import os
+import threading
 from pathlib import Path
+from typing import Iterable, Sequence
 
+from app.config import get_settings
 from app.models import DecisionCase, Question
+from app.services.corpus_snapshot import (
+    CorpusSnapshot,
+    SnapshotCases,
+    get_snapshot_path,
+    open_snapshot,
+    source_signature,
+)
 
-_CASES: list[DecisionCase] | None = None
+_settings = get_settings()
 
+_CASES: Sequence[DecisionCase] | None = None
+# 最後に読み込み・保存した JSON ファイルのパスと (サイズ, 更新時刻)。スナップショットの書き出しに使う
+_SOURCE: tuple[Path, dict | None] | None = None
+# 追加・更新・削除を直列化するためのロック
+_WRITE_LOCK = threading.Lock()
 
-def load_decision_cases(path: Path | None = None) -> list[DecisionCase]:
+
+def get_decision_cases_path() -> Path:
+    """デフォルトの DecisionCase ファイル (backend/data/decision_case.json) のパスを返す。"""
+    services_dir = Path(__file__).resolve().parent
+    # backend/app/services/ から 2つ上に上がって backend/ を起点に data/decision_case.json を探す
+    return services_dir.parent.parent / "data" / "decision_case.json"
+
+
+def _read_decision_cases(path: Path) -> list[DecisionCase]:
+    global _SOURCE
+
+    # 読み込み中に書き換えられた場合にスナップショットを古いと判定できるよう、読む前に記録する
+    signature = source_signature(path)
+    with path.open("r", encoding="utf-8") as f:
+        raw_data = json.load(f)
+
+    cases = [DecisionCase(**item) for item in raw_data]
+    _SOURCE = (path, signature)
+    return cases
+
+
+def load_decision_cases(path: Path | None = None) -> Sequence[DecisionCase]:
     """JSON ファイルから DecisionCase の一覧を読み込んでキャッシュする。
 
     - path が None の場合は、現在ファイルからの相対パスで
       ../data/decision_case.json をデフォルトとする。
     - すでに読み込まれている場合は再読み込みせず、キャッシュを返す。
+    - CORPUS_SNAPSHOT_ENABLED の場合、JSON より新しいスナップショットがあればそれを開く。
+      この場合の一覧は SnapshotCases で、DecisionCase は参照された行だけが作られる。
     """
-    global _CASES
+    global _CASES, _SOURCE
 
     if _CASES is not None:
         return _CASES
 
     if path is None:
-        services_dir = Path(__file__).resolve().parent
-        # backend/app/services/ から 2つ上に上がって backend/ を起点に data/decision_case.json を探す
-        path = services_dir.parent.parent / "data" / "decision_case.json"
+        path = get_decision_cases_path()
+
+    if _settings.CORPUS_SNAPSHOT_ENABLED:
+        snapshot = open_snapshot(get_snapshot_path(path), path)
+        if snapshot is not None:
+            _SOURCE = (path, snapshot.source)
+            _CASES = snapshot.cases
+            return _CASES
+
+    _CASES = _read_decision_cases(path)
+    return _CASES
+
+
+def reload_decision_cases(path: Path | None = None) -> Sequence[DecisionCase]:
+    """キャッシュを無視して JSON ファイルから DecisionCase を読み直す。
+
+    読み込みに失敗した場合は例外を送出し、現在のキャッシュはそのまま残す。
+    """
+    global _CASES
+
+    if path is None:
+        path = get_decision_cases_path()
+
+    cases = _read_decision_cases(path)
+    # 新しいリストを1回の代入で差し替える（読み手が作りかけのリストを見ないように）
+    _CASES = cases
+    return _CASES
 
-    with path.open("r", encoding="utf-8") as f:
-        raw_data = json.load(f)
 
-    _CASES = [DecisionCase(**item) for item in raw_data]
+def use_snapshot(snapshot: CorpusSnapshot, path: Path | None = None) -> Sequence[DecisionCase]:
+    """開いたスナップショットの DecisionCase 一覧に差し替える（shared_index の世代切り替え用）。
+
+    path はスナップショットの元になった DecisionCase ファイル（省略時はデフォルトのパス）。
+    """
+    global _CASES, _SOURCE
+
+    if path is None:
+        path = get_decision_cases_path()
+
+    _SOURCE = (path, snapshot.source)
+    _CASES = snapshot.cases
     return _CASES
 
+
+def get_source() -> tuple[Path, dict | None] | None:
+    """最後に読み込み・保存した DecisionCase ファイルのパスと (サイズ, 更新時刻) を返す。"""
+    return _SOURCE
+
+
+def _save_decision_cases(cases: list[DecisionCase], path: Path | None = None) -> None:
+    """DecisionCase の一覧を JSON ファイルに保存する（一時ファイル + os.replace）。"""
+    global _SOURCE
+
+    if path is None:
+        path = get_decision_cases_path()
+
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump([c.dict() for c in cases], f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    os.replace(tmp, path)
+    _SOURCE = (path, source_signature(path))
+
+
+def upsert_decision_cases(cases: list[DecisionCase]) -> list[DecisionCase]:
+    """DecisionCase を追加・更新し、ファイルにも保存する。
+
+    - 同じ id のケースがあれば置き換え（位置は維持）、無ければ末尾に追加する。
+    - 戻り値は更新後の一覧。
+    """
+    global _CASES
+
+    with _WRITE_LOCK:
+        current = list(get_decision_cases())
+        positions = {c.id: i for i, c in enumerate(current)}
+        for case in cases:
+            if case.id in positions:
+                current[positions[case.id]] = case
+            else:
+                positions[case.id] = len(current)
+                current.append(case)
+
+        _save_decision_cases(current)
+        _CASES = current
+        return current
+
+
+def delete_decision_case(case_id: str) -> bool:
+    """指定 id の DecisionCase を削除し、ファイルにも保存する。存在しなければ False。"""
+    global _CASES
+
+    with _WRITE_LOCK:
+        current = get_decision_cases()
+        remaining = [c for c in current if c.id != case_id]
+        if len(remaining) == len(current):
+            return False
+
+        _save_decision_cases(remaining)
+        _CASES = remaining
+        return True
+
 # 11/27 add: デモデータの取り込み
 def load_demo_questions(path: Path | None = None) -> list[Question]:
     """
@@ -47,7 +177,7 @@ def load_demo_questions(path: Path | None = None) -> list[Question]:
     questions = [Question(**item) for item in raw_data]
     return questions
 
-def get_decision_cases() -> list[DecisionCase]:
+def get_decision_cases() -> Sequence[DecisionCase]:
     """キャッシュされた DecisionCase の一覧を返す。
 
     - 未ロードの場合は load_decision_cases() を内部で呼び出す。
@@ -61,4 +191,28 @@ def get_decision_cases() -> list[DecisionCase]:
     return _CASES
 
 
-__all__ = ["load_decision_cases", "get_decision_cases"]
+def get_decision_cases_by_ids(case_ids: Iterable[str]) -> list[DecisionCase]:
+    """指定 id の DecisionCase を一覧の順序で返す（存在しない id は無視する）。
+
+    スナップショットから開いた場合は、該当する行の DecisionCase だけを作る。
+    """
+    cases = get_decision_cases()
+    if isinstance(cases, SnapshotCases):
+        rows = {cases.index_of(case_id) for case_id in case_ids}
+        return [cases[row] for row in sorted(r for r in rows if r is not None)]
+
+    wanted = set(case_ids)
+    return [c for c in cases if c.id in wanted]
+
+
+__all__ = [
+    "load_decision_cases",
+    "get_decision_cases",
+    "get_decision_cases_by_ids",
+    "get_decision_cases_path",
+    "get_source",
+    "reload_decision_cases",
+    "upsert_decision_cases",
+    "use_snapshot",
+    "delete_decision_case",
+]
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import zlib
+
+import numpy as np
+
+from app.services.lexical_index import tokenize_ngram_range
+
+# トークンの数え方を変えたら名前を変える（埋め込みキャッシュ・スナップショットを作り直させる）
+LOCAL_EMBEDDING_MODEL = "hashed-char-ngram-v2"
+
+
+class LocalEmbedder:
+    """外部 API を使わない埋め込み（文字 n-gram の feature hashing）。
+
+    - トークンは lexical_index.tokenize_ngram_range（英単語＋非 ASCII 部分の ngram_range の
+      各 n の文字 n-gram）。英単語は1回だけ数え、日本語混じりの文で英単語に偏らないようにする。
+    - 各トークンを crc32 で dim 次元のどれかに割り当て、符号もハッシュから決める
+      （signed feature hashing。衝突による偏りを打ち消し、ランダム射影と同じ性質を持つ）。
+    - 値は 1 + log(tf) の劣線形 TF。IDF はコーパスに依存してベクトルが変わってしまうため使わない。
+    - 同じテキストからは常に同じベクトルが得られる（プロセス・マシンをまたいでも同じ）。
+    """
+
+    def __init__(self, dim: int = 512, ngram_range: tuple[int, int] = (2, 3)) -> None:
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    @property
+    def model_name(self) -> str:
+        """埋め込みキャッシュのキーに使うモデル名（パラメータを含める）。"""
+        lo, hi = self.ngram_range
+        return f"{LOCAL_EMBEDDING_MODEL}-{lo}{hi}-d{self.dim}"
+
+    def _features(self, text: str) -> dict[int, float]:
+        counts: dict[str, int] = {}
+        for t in tokenize_ngram_range(text, *self.ngram_range):
+            counts[t] = counts.get(t, 0) + 1
+
+        features: dict[int, float] = {}
+        for token, tf in counts.items():
+            h = zlib.crc32(token.encode("utf-8"))
+            col = h % self.dim
+            sign = 1.0 if (h >> 31) & 1 else -1.0
+            features[col] = features.get(col, 0.0) + sign * (1.0 + np.log(tf))
+        return features
+
+    def embed_texts(self, texts: list[str]) -> np.ndarray:
+        """shape = (len(texts), dim) の float32 行列を返す（正規化は呼び出し側で行う）。"""
+
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            if features:
+                cols = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+                out[row, cols] = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+        return out
+
+
+__all__ = ["LOCAL_EMBEDDING_MODEL", "LocalEmbedder"]
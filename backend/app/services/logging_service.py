@@ -1,12 +1,20 @@
 from __future__ import annotations
 
+import base64
 import json
+import os
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, List
 from uuid import uuid4
 
+import numpy as np
+
+from app.config import get_settings
 from app.models import NewIdea, Question, QuestionFeedback
+from app.services import analytics, metrics
+
+_settings = get_settings()
 
 
 def _get_log_root_dir() -> Path:
@@ -30,22 +38,180 @@ def _ensure_log_dir() -> Path:
 
 
 def _get_log_path(session_id: str) -> Path:
-    """セッションIDからログファイルのパスを生成する。"""
+    """セッションIDから（旧形式の）ログファイルのパスを生成する。
+
+    旧形式は1セッション1つの JSON を丸ごと書き換える方式。
+    新規セッションは _get_event_log_path の追記専用ログに保存する。
+    """
 
     return _get_log_dir() / f"session_{session_id}.json"
 
 
+def _get_event_log_path(session_id: str) -> Path:
+    """セッションIDから追記専用イベントログ (JSONL) のパスを生成する。"""
+
+    return _get_log_dir() / f"session_{session_id}.jsonl"
+
+
+def get_analytics() -> analytics.FeedbackAnalytics:
+    """フィードバック集計のストア（logs/analytics）を返す。"""
+
+    return analytics.get_store(
+        _get_log_root_dir() / "analytics",
+        checkpoint_every=_settings.ANALYTICS_CHECKPOINT_EVERY,
+    )
+
+
+def _record_analytics(record: Callable[[analytics.FeedbackAnalytics], None]) -> None:
+    """集計を更新する。失敗してもログの保存自体は成功として扱う（rebuild_analytics で作り直せる）。"""
+
+    if not _settings.ANALYTICS_ENABLED:
+        return
+    try:
+        record(get_analytics())
+    except Exception as exc:
+        print(f"analytics: 集計の更新に失敗しました: {exc!r}")
+
+
 def _now_iso_utc() -> str:
     """現在時刻（UTC）の ISO8601 文字列を返す。"""
 
     return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
 
+def _append_event(session_id: str, event: dict[str, Any]) -> None:
+    """イベントを1行の JSON としてセッションのイベントログ末尾に追記する。
+
+    O_APPEND で開いて1回の write で書くため、同一セッションへの同時書き込みでも
+    行どうしが混ざったり、先に書いた内容が失われたりしない。
+    """
+
+    line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+    with metrics.span("log_write"):
+        fd = os.open(
+            _get_event_log_path(session_id),
+            os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+            0o644,
+        )
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+
+def session_exists(session_id: str) -> bool:
+    """セッションログ（新形式・旧形式のいずれか）が存在するかを返す。"""
+
+    return _get_event_log_path(session_id).exists() or _get_log_path(session_id).exists()
+
+
+def encode_vector(vector: np.ndarray) -> str:
+    """ベクトルを float32（リトルエンディアン）の base64 文字列にする（ログに保存する形式）。"""
+    return base64.b64encode(np.asarray(vector, dtype="<f4").tobytes()).decode("ascii")
+
+
+def decode_vector(encoded: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(encoded), dtype="<f4").astype(np.float32)
+
+
+def _apply_event(
+    data: dict[str, Any], event: dict[str, Any], *, include_vectors: bool = False
+) -> dict[str, Any]:
+    """イベント1件をセッションビューに反映する。"""
+
+    kind = event.get("type")
+    if kind == "created":
+        return dict(event["data"])
+    if kind == "feedbacks":
+        # append_feedback は feedbacks 全体を置き換える
+        data["feedbacks"] = event["feedbacks"]
+    elif kind == "snapshot":
+        history = data.setdefault("idea_history", [])
+        history.append(
+            {
+                "step": len(history) + 1,
+                "title": event["title"],
+                "summary": event["summary"],
+                "timestamp": event["timestamp"],
+            }
+        )
+    elif kind == "snapshot_embedding":
+        # 同じ step に複数ある場合（埋め込みモデルの変更など）は後のものを使う
+        history = data.get("idea_history") or []
+        step = event["step"]
+        if 1 <= step <= len(history):
+            entry = history[step - 1]
+            entry["embedding"] = event["embedding"]
+            entry["distance"] = event["distance"]
+            if include_vectors:
+                entry["vector"] = decode_vector(event["vector"])
+    return data
+
+
+def get_log_root_dir() -> Path:
+    """ログのルートディレクトリを返す（集計・分析結果の出力先の起点）。"""
+
+    return _get_log_root_dir()
+
+
+def list_session_ids() -> list[str]:
+    """ログのあるセッション ID（新形式・旧形式）を並べて返す。"""
+
+    return sorted(
+        {
+            p.name[len("session_") :].rsplit(".", 1)[0]
+            for p in _get_log_dir().glob("session_*.json*")
+        }
+    )
+
+
+def load_session_log(session_id: str, *, include_vectors: bool = False) -> dict[str, Any]:
+    """セッションの現在のビューを返す。
+
+    旧形式の JSON があればそれを起点に、イベントログを先頭から順に適用して組み立てる。
+    include_vectors=True の場合、埋め込み済みの idea_history の各 step に "vector"（numpy 配列）も入れる。
+
+    - どちらのファイルも存在しない場合は FileNotFoundError を送出。
+    - JSON パースに失敗した場合は ValueError を送出。
+      ただし書き込み途中で落ちた可能性のある最終行は読み飛ばす。
+    """
+
+    legacy_path = _get_log_path(session_id)
+    event_path = _get_event_log_path(session_id)
+    if not legacy_path.exists() and not event_path.exists():
+        raise FileNotFoundError(f"session log not found: {session_id}")
+
+    data: dict[str, Any] = {}
+    if legacy_path.exists():
+        try:
+            with legacy_path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"invalid JSON log for session: {session_id}") from exc
+
+    if event_path.exists():
+        with event_path.open("r", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        for i, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError as exc:
+                if i == len(lines) - 1:
+                    break
+                raise ValueError(f"invalid JSON log for session: {session_id}") from exc
+            data = _apply_event(data, event, include_vectors=include_vectors)
+
+    return data
+
+
 def create_session_log(new_idea: NewIdea, questions: List[Question]) -> str:
-    """新しい自己レビューセッションのログファイルを作成する。
+    """新しい自己レビューセッションのログを作成する。
 
     ログスキーマは 04_logging_service_prompt.md に準拠し、
     評価指標A/Bおよびサブ指標 (2-1, 2-2, 3-1, 3-2, 3-3, 4-1, 4-2) と 1:1 で対応する。
+    ログは追記専用のイベントログ (session_<id>.jsonl) の先頭に "created" イベントとして書く。
     """
 
     _ensure_log_dir()
@@ -74,9 +240,8 @@ def create_session_log(new_idea: NewIdea, questions: List[Question]) -> str:
         },
     }
 
-    path = _get_log_path(session_id)
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    _append_event(session_id, {"type": "created", "at": created_at, "data": data})
+    _record_analytics(lambda store: store.record_session(session_id, created_at, questions))
 
     return session_id
 
@@ -84,61 +249,103 @@ def create_session_log(new_idea: NewIdea, questions: List[Question]) -> str:
 def append_feedback(session_id: str, feedbacks: List[QuestionFeedback]) -> None:
     """指定セッションの feedbacks を上書き保存する。
 
-    - ファイルが存在しない場合は FileNotFoundError を送出。
-    - JSON パースに失敗した場合は ValueError を送出。
+    - ログが存在しない場合は FileNotFoundError を送出。
     - feedbacks フィールドのみを更新し、他フィールドは変更しない。
+    - 既存ログは読み書きせず、"feedbacks" イベントを1行追記するだけ (O(1))。
     """
 
     _ensure_log_dir()
-    path = _get_log_path(session_id)
-    if not path.exists():
+    if not session_exists(session_id):
         raise FileNotFoundError(f"session log not found: {session_id}")
 
-    try:
-        with path.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-    except json.JSONDecodeError as exc:
-        raise ValueError(f"invalid JSON log for session: {session_id}") from exc
-
-    data["feedbacks"] = [fb.dict() for fb in feedbacks]
-
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    _append_event(
+        session_id,
+        {
+            "type": "feedbacks",
+            "at": _now_iso_utc(),
+            "feedbacks": [fb.dict() for fb in feedbacks],
+        },
+    )
+    _record_analytics(lambda store: store.record_feedbacks(session_id, feedbacks))
 
 
 # 12/7 ログ管理方法の追加
 def add_idea_snapshot(session_id: str, title: str, content: str) -> None: # 引数名を修正
     """
     企画案のスナップショットを履歴に追加保存する。
+
+    "snapshot" イベントを1行追記するだけ (O(1))。step 番号は読み込み時に
+    イベントの順序から振られる。
     """
     _ensure_log_dir()
-    path = _get_log_path(session_id)
-    
-    if not path.exists():
+
+    if not session_exists(session_id):
         raise FileNotFoundError(f"session log not found: {session_id}")
 
-    try:
-        with path.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-    except json.JSONDecodeError as exc:
-        raise ValueError(f"invalid JSON log for session: {session_id}") from exc
-
-    # idea_history フィールドがなければ作成
-    if "idea_history" not in data:
-        data["idea_history"] = []
-
-    # 新しいスナップショットを作成
-    snapshot = {
-        "step": len(data["idea_history"]) + 1,
-        "title": title,
-        "summary": content,
-        "timestamp": _now_iso_utc()
-    }
+    _append_event(
+        session_id,
+        {
+            "type": "snapshot",
+            "title": title,
+            "summary": content,
+            "timestamp": _now_iso_utc(),
+        },
+    )
+
+
+def add_snapshot_embedding(
+    session_id: str,
+    step: int,
+    embedding: str,
+    vector: np.ndarray,
+    distance: float | None,
+) -> None:
+    """スナップショット（step）の埋め込みと、前の step からの距離を保存する。
+
+    "snapshot_embedding" イベントを1行追記するだけ (O(1))。embedding は "{provider}/{model}"、
+    distance は前の step との 1 - コサイン類似度（step 1 は None）。
+    """
+
+    _append_event(
+        session_id,
+        {
+            "type": "snapshot_embedding",
+            "step": step,
+            "embedding": embedding,
+            "vector": encode_vector(vector),
+            "distance": distance,
+            "at": _now_iso_utc(),
+        },
+    )
+
+def rebuild_analytics() -> int:
+    """全セッションログからフィードバック集計を作り直す。返り値は取り込んだセッション数。
+
+    集計を有効にする前のログを取り込むとき、集計ファイルを消したときに使う（ログを全件読む）。
+    """
+
+    def sessions():
+        for session_id in list_session_ids():
+            try:
+                yield load_session_log(session_id)
+            except (OSError, ValueError) as exc:
+                print(f"analytics: {session_id} を読み込めませんでした: {exc!r}")
 
-    data["idea_history"].append(snapshot)
+    return get_analytics().rebuild(sessions())
 
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
 
 # __all__ を更新
-__all__ = ["create_session_log", "append_feedback", "add_idea_snapshot"]
+__all__ = [
+    "create_session_log",
+    "append_feedback",
+    "add_idea_snapshot",
+    "add_snapshot_embedding",
+    "decode_vector",
+    "encode_vector",
+    "load_session_log",
+    "list_session_ids",
+    "get_log_root_dir",
+    "session_exists",
+    "get_analytics",
+    "rebuild_analytics",
+]
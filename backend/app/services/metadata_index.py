@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import numpy as np
+
+from app.models import CaseFilter, DecisionCase
+
+# 単一値のフィールド（tags は複数値なので別扱い）
+_SCALAR_FIELDS = ("status", "project_id", "decision_level")
+
+
+class MetadataIndex:
+    """DecisionCase のメタデータに対する真偽値マスク（ビットマップ）インデックス。
+
+    - build: フィールドの値ごとに shape (N,) の bool 配列を作っておく。
+    - mask: CaseFilter を満たす行の bool 配列を、マスクの OR / AND だけで計算する。
+      同じフィールド内の値は OR（いずれかに一致）、フィールド間は AND で結合する。
+    """
+
+    def __init__(self) -> None:
+        self.num_rows = 0
+        self.masks: dict[str, dict[str, np.ndarray]] = {}
+
+    def build(self, cases: list[DecisionCase]) -> "MetadataIndex":
+        """ケース一覧からインデックスを構築する。"""
+
+        self.num_rows = len(cases)
+        self.masks = {field: {} for field in (*_SCALAR_FIELDS, "tags")}
+
+        def add(field: str, value: str | None, row: int) -> None:
+            if value is None:
+                return
+            mask = self.masks[field].get(value)
+            if mask is None:
+                mask = self.masks[field][value] = np.zeros(self.num_rows, dtype=bool)
+            mask[row] = True
+
+        for row, case in enumerate(cases):
+            for field in _SCALAR_FIELDS:
+                add(field, getattr(case, field), row)
+            for tag in case.tags or []:
+                add("tags", tag, row)
+        return self
+
+    @classmethod
+    def restore(cls, num_rows: int, masks: dict[str, dict[str, np.ndarray]]) -> "MetadataIndex":
+        """build 済みのマスク（corpus_snapshot に保存したもの）からインデックスを復元する。"""
+
+        index = cls()
+        index.num_rows = num_rows
+        index.masks = {field: dict(masks.get(field, {})) for field in (*_SCALAR_FIELDS, "tags")}
+        return index
+
+    def _field_mask(self, field: str, values: list[str]) -> np.ndarray:
+        out = np.zeros(self.num_rows, dtype=bool)
+        for value in values:
+            mask = self.masks[field].get(value)
+            if mask is not None:
+                out |= mask
+        return out
+
+    def mask(self, filters: CaseFilter | None) -> np.ndarray | None:
+        """条件を満たす行の bool 配列を返す。条件が空の場合は None（全件対象）。"""
+
+        if filters is None:
+            return None
+
+        out: np.ndarray | None = None
+        for field in (*_SCALAR_FIELDS, "tags"):
+            values = getattr(filters, field)
+            if not values:
+                continue
+            field_mask = self._field_mask(field, values)
+            out = field_mask if out is None else out & field_mask
+        return out
+
+
+__all__ = ["MetadataIndex"]
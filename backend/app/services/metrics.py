@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, TypeVar
+
+from app.config import get_settings
+
+_settings = get_settings()
+
+_T = TypeVar("_T")
+
+# レイテンシ用ヒストグラムの既定バケット（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """単調増加するカウンタ（Prometheus の counter）。"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {v:g}" for k, v in items]
+
+
+class Histogram(_Metric):
+    """累積バケット付きのヒストグラム（Prometheus の histogram）。"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [バケットごとの件数..., 合計値, 件数]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return int(entry[-1]) if entry else 0
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+
+        lines: list[str] = []
+        for key, entry in items:
+            for upper, n in zip(self.buckets, entry):
+                labels = _format_labels(self.labelnames, key, f'le="{upper:g}"')
+                lines.append(f"{self.name}_bucket{labels} {n:g}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {entry[-1]:g}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {entry[-2]:g}")
+            lines.append(f"{self.name}_count{labels} {entry[-1]:g}")
+        return lines
+
+
+class Registry:
+    """メトリクスの登録先。render() で Prometheus のテキスト形式 (0.0.4) を返す。"""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))  # type: ignore[return-value]
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "decision_helper_request_duration_seconds",
+    "エンドポイント単位の処理時間",
+    ("request",),
+)
+STAGE_DURATION = REGISTRY.histogram(
+    "decision_helper_stage_duration_seconds",
+    "処理段階（embed / search / llm / fallback / log_write）ごとの処理時間（search の model は検索方式）",
+    ("stage", "provider", "model"),
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "decision_helper_stage_errors_total",
+    "例外で終了した処理段階の件数",
+    ("stage", "provider", "model"),
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "decision_helper_cache_requests_total",
+    "キャッシュの参照件数（cache: query_embedding / llm、result: hit / miss）",
+    ("cache", "result"),
+)
+QUESTION_GENERATIONS = REGISTRY.counter(
+    "decision_helper_question_generations_total",
+    "問い生成の件数（source: llm / cache / fallback）",
+    ("provider", "model", "source"),
+)
+EMBED_BATCH_SIZE = REGISTRY.histogram(
+    "decision_helper_embedding_batch_size",
+    "クエリ埋め込みの1回のプロバイダ呼び出しにまとめられたテキスト数",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+PROMPT_TOKENS = REGISTRY.histogram(
+    "decision_helper_prompt_tokens",
+    "問い生成の user メッセージの推定トークン数（stage: before = 切り詰め前 / after = 予算に収めた後）",
+    ("stage",),
+    buckets=(250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 16000, 32000),
+)
+LLM_PROMPT_TOKENS = REGISTRY.counter(
+    "decision_helper_llm_prompt_tokens_total",
+    "LLM が報告した入力トークン数（kind: input = 全体 / cached = プロバイダのプロンプトキャッシュに一致した分）",
+    ("provider", "model", "kind"),
+)
+FALLBACKS = REGISTRY.counter(
+    "decision_helper_fallbacks_total",
+    "フォールバックの件数（kind: questions = 固定の問い、retrieval = BM25 のみの検索、indexing = 索引構築中の BM25 のみの検索）",
+    ("kind",),
+)
+
+
+# リクエスト単位の段階別所要時間（構造化タイミングログ用）
+_request_timings: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+@contextmanager
+def span(stage: str, *, provider: str = "", model: str = "") -> Iterator[None]:
+    """処理段階の所要時間を計測し、ヒストグラムとリクエスト単位の記録に加える。"""
+
+    if not _settings.METRICS_ENABLED:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage, provider=provider, model=model)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_DURATION.observe(elapsed, stage=stage, provider=provider, model=model)
+        timings = _request_timings.get()
+        if timings is not None:
+            stages = timings["stages"]
+            stages[stage] = stages.get(stage, 0.0) + elapsed * 1000.0
+
+
+@contextmanager
+def request_timer(request: str, **fields: str) -> Iterator[dict]:
+    """リクエスト全体の所要時間を計測する。
+
+    ブロック内の span は同じリクエストの段階として集計され、TIMING_LOG_ENABLED の場合は
+    終了時に1行の JSON として出力される。yield した dict に項目を追加するとログに含まれる。
+    asyncio.to_thread は contextvars を引き継ぐため、別スレッドで実行した段階も集計される。
+    """
+
+    timings: dict = {"request": request, "stages": {}, **fields}
+    token = _request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        elapsed = time.perf_counter() - start
+        try:
+            _request_timings.reset(token)
+        except ValueError:
+            # 非同期ジェネレータ内で使い、別のコンテキストから閉じられた場合
+            pass
+        if _settings.METRICS_ENABLED:
+            REQUEST_DURATION.observe(elapsed, request=request)
+        if _settings.TIMING_LOG_ENABLED:
+            timings["total_ms"] = round(elapsed * 1000.0, 3)
+            timings["stages"] = {k: round(v, 3) for k, v in timings["stages"].items()}
+            print(json.dumps({"event": "timing", **timings}, ensure_ascii=False))
+
+
+def timed(request: str) -> Callable[[Callable[..., Awaitable[_T]]], Callable[..., Awaitable[_T]]]:
+    """非同期エンドポイント全体を request_timer で囲むデコレータ。"""
+
+    def decorator(func: Callable[..., Awaitable[_T]]) -> Callable[..., Awaitable[_T]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> _T:
+            with request_timer(request):
+                return await func(*args, **kwargs)
+
+        # FastAPI は wrapper の __globals__ で文字列の型注釈を解決しようとするため、
+        # 元の関数のモジュールで解決済みのシグネチャを渡しておく
+        wrapper.__signature__ = inspect.signature(func, eval_str=True)  # type: ignore[attr-defined]
+        return wrapper
+
+    return decorator
+
+
+def annotate(**fields: Any) -> None:
+    """実行中のリクエストのタイミングログに項目（session_id など）を追加する。"""
+
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.update(fields)
+
+
+def record_llm_usage(provider: str, model: str, prompt_tokens: int, cached_tokens: int) -> None:
+    """LLM 呼び出しの入力トークン数とキャッシュに一致したトークン数を記録する。"""
+
+    LLM_PROMPT_TOKENS.inc(prompt_tokens, provider=provider, model=model, kind="input")
+    LLM_PROMPT_TOKENS.inc(cached_tokens, provider=provider, model=model, kind="cached")
+    annotate(llm_prompt_tokens=prompt_tokens, llm_cached_tokens=cached_tokens)
+
+
+def render() -> str:
+    """/metrics 用のテキストを返す。"""
+
+    return REGISTRY.render()
+
+
+__all__ = [
+    "CACHE_REQUESTS",
+    "Counter",
+    "EMBED_BATCH_SIZE",
+    "FALLBACKS",
+    "Histogram",
+    "LLM_PROMPT_TOKENS",
+    "PROMPT_TOKENS",
+    "QUESTION_GENERATIONS",
+    "REGISTRY",
+    "Registry",
+    "REQUEST_DURATION",
+    "annotate",
+    "STAGE_DURATION",
+    "STAGE_ERRORS",
+    "record_llm_usage",
+    "render",
+    "request_timer",
+    "span",
+    "timed",
+]
@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import json
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Sequence
+
+# トークン数の推定:
+#   ASCII 文字は英語の BPE と同様に約4文字で1トークン、
+#   それ以外（日本語など）は1文字でほぼ1トークンとして数える（cl100k / o200k / Gemini の実測に近い）
+_ASCII = re.compile(r"[\x00-\x7f]")
+_ASCII_CHARS_PER_TOKEN = 4
+
+# 切り詰めた文字列の末尾に付ける印
+ELLIPSIS = "…"
+# 配分がこれより少ない文字列は、数文字だけ残さずに空にする
+MIN_FRAGMENT_TOKENS = 8
+# ケースの summary の上限はこの単位で切り下げる（断片の種類を減らし、キャッシュに当たりやすくする）
+SUMMARY_TOKEN_STEP = 32
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数をローカルで推定する（API もトークナイザも使わない）。"""
+
+    ascii_chars = len(_ASCII.findall(text))
+    return (len(text) - ascii_chars) + math.ceil(ascii_chars / _ASCII_CHARS_PER_TOKEN)
+
+
+def compact_json(obj: Any) -> str:
+    """空白を入れずに JSON にする（indent=2 と比べて改行・インデント分のトークンが減る）。"""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """推定トークン数が max_tokens 以下になるよう末尾を切り、切った場合は ELLIPSIS を付ける。"""
+
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 1:
+        return ""
+
+    # 先頭から1文字ずつ費用（ASCII は 1/4、それ以外は 1）を足し、ELLIPSIS の分を残して切る
+    budget = (max_tokens - 1) * _ASCII_CHARS_PER_TOKEN
+    used = 0
+    for i, ch in enumerate(text):
+        used += 1 if ch <= "\x7f" else _ASCII_CHARS_PER_TOKEN
+        if used > budget:
+            return text[:i] + ELLIPSIS
+    return text
+
+
+def allocate(lengths: Sequence[int], weights: Sequence[float], total: int) -> list[int]:
+    """total を重みに比例して配分する（各要素は lengths を上限とし、余りは残りに配り直す）。"""
+
+    alloc = [0] * len(lengths)
+    remaining = max(0, total)
+    active = [i for i, n in enumerate(lengths) if n > 0 and weights[i] > 0]
+    while active and remaining > 0:
+        weight_sum = sum(weights[i] for i in active)
+        share = {i: remaining * weights[i] / weight_sum for i in active}
+        filled = [i for i in active if lengths[i] - alloc[i] <= share[i]]
+        if not filled:
+            for i in active:
+                alloc[i] += int(share[i])
+            break
+        for i in filled:
+            remaining -= lengths[i] - alloc[i]
+            alloc[i] = lengths[i]
+        active = [i for i in active if i not in filled]
+    return alloc
+
+
+class EncodedPrompt:
+    """エンコード結果と、推定トークン数の記録。
+
+    - tokens_before: 切り詰める前の推定トークン数
+    - tokens_after: text の推定トークン数
+    - truncated_cases / truncated_fields: summary を切ったケースの数 / 切った企画案の項目
+    - over_budget: 切り詰めても予算に収まらなかった（構造だけで予算を超える）場合 True
+    """
+
+    def __init__(
+        self,
+        text: str,
+        *,
+        tokens_before: int,
+        budget: int,
+        truncated_cases: int = 0,
+        truncated_fields: Sequence[str] = (),
+    ) -> None:
+        self.text = text
+        self.tokens_before = tokens_before
+        self.tokens_after = estimate_tokens(text)
+        self.budget = budget
+        self.truncated_cases = truncated_cases
+        self.truncated_fields = list(truncated_fields)
+        self.over_budget = bool(budget) and self.tokens_after > budget
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "budget": self.budget,
+            "truncated_cases": self.truncated_cases,
+            "truncated_fields": self.truncated_fields,
+            "over_budget": self.over_budget,
+        }
+
+
+class FragmentCache:
+    """シリアライズ済みのケース断片（compact JSON）の LRU キャッシュ。
+
+    キーはケースの内容と summary の上限トークン数（None は全文）。同じケースが何度も
+    プロンプトに入るので、JSON 化とトークン数の推定を毎回やり直さずに済む。
+    """
+
+    def __init__(self, max_entries: int = 2048) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[str, int, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, case: dict[str, Any], summary_tokens: int | None = None) -> tuple[str, int, int]:
+        """(断片の JSON, 断片の推定トークン数, 元の summary の推定トークン数) を返す。"""
+
+        key = (
+            tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in case.items()),
+            summary_tokens,
+        )
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        summary = case.get("summary") or ""
+        full_tokens = estimate_tokens(summary)
+        if summary_tokens is not None:
+            case = {**case, "summary": truncate_text(summary, summary_tokens)}
+        text = compact_json(case)
+        entry = (text, estimate_tokens(text), full_tokens)
+
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def encode_layout(
+    head: dict[str, Any],
+    cases_key: str,
+    cases: list[dict[str, Any]],
+    tail: dict[str, Any],
+    *,
+    weights: Sequence[float],
+    budget: int = 0,
+    fragments: FragmentCache | None = None,
+    proposal_key: str | None = None,
+    proposal_reserve: int = 0,
+) -> EncodedPrompt:
+    """{head の項目, cases_key: [ケース断片], tail の項目} の順に並べた compact JSON を作る。
+
+    プロバイダのプロンプトキャッシュ（先頭一致）が効くよう、変わらない head・ケース断片を前に、
+    リクエストごとの tail を最後に置く。cases は呼び出し側で決定的な順序に並べておく。
+
+    budget（推定トークン数、0 で無制限）を超える場合:
+    1. ケースの summary を weights（類似度など）に比例した配分で切る。配分は
+       SUMMARY_TOKEN_STEP 単位に切り下げ、同じ断片がキャッシュ・プロンプトキャッシュに再び当たるようにする
+    2. それでも超える場合、tail[proposal_key]（企画案）の title / summary を切る
+
+    proposal_reserve > 0 の場合、1. の配分では企画案を実際の長さではなく proposal_reserve
+    トークンとして数える。企画案が変わってもケース断片が同じになり、先頭一致が崩れない。
+    """
+
+    if fragments is None:
+        fragments = FragmentCache()
+    head_text = compact_json(head)[:-1]
+    tail_text = compact_json(tail)[1:]
+    # ケース配列の外枠（キー・括弧・区切りのカンマ）も数える
+    frame = json.dumps(cases_key) + ":[]," + "," * max(len(cases) - 1, 0)
+    fixed_tokens = estimate_tokens(head_text) + estimate_tokens(tail_text) + estimate_tokens(frame)
+
+    full = [fragments.get(c) for c in cases]
+    tokens_before = fixed_tokens + sum(tokens for _, tokens, _ in full)
+    parts = [text for text, _, _ in full]
+
+    truncated_cases = 0
+    truncated_fields: list[str] = []
+    if budget and tokens_before > budget:
+        summary_tokens = [n for _, _, n in full]
+        others = tokens_before - sum(summary_tokens)
+        proposal = tail.get(proposal_key) if proposal_key else None
+        if proposal_reserve > 0 and proposal is not None:
+            others += proposal_reserve - estimate_tokens(compact_json(proposal))
+        alloc = allocate(summary_tokens, weights, budget - others)
+
+        parts = []
+        case_tokens = 0
+        for case, (text, tokens, n), a in zip(cases, full, alloc):
+            if a < n:
+                a = a // SUMMARY_TOKEN_STEP * SUMMARY_TOKEN_STEP
+                text, tokens, _ = fragments.get(case, a if a >= MIN_FRAGMENT_TOKENS else 0)
+                truncated_cases += 1
+            parts.append(text)
+            case_tokens += tokens
+
+        if fixed_tokens + case_tokens > budget and isinstance(proposal, dict):
+            # ケースの summary を切っても超える: 大きな企画案なので、企画案の項目を切る
+            keys = [k for k in ("title", "summary") if isinstance(proposal.get(k), str) and proposal[k]]
+            lengths = [estimate_tokens(proposal[k]) for k in keys]
+            available = budget - (fixed_tokens + case_tokens - sum(lengths))
+            trimmed = dict(proposal)
+            for k, n, a in zip(keys, lengths, allocate(lengths, [1.0] * len(keys), available)):
+                if a < n:
+                    trimmed[k] = truncate_text(proposal[k], a) if a >= MIN_FRAGMENT_TOKENS else ""
+                    truncated_fields.append(k)
+            tail_text = compact_json({**tail, proposal_key: trimmed})[1:]
+
+    text = (
+        head_text
+        + ("," if head else "")
+        + f"{json.dumps(cases_key)}:[{','.join(parts)}]"
+        + ("," if tail else "")
+        + tail_text
+    )
+    return EncodedPrompt(
+        text,
+        tokens_before=tokens_before,
+        budget=budget,
+        truncated_cases=truncated_cases,
+        truncated_fields=truncated_fields,
+    )
+
+
+__all__ = [
+    "ELLIPSIS",
+    "MIN_FRAGMENT_TOKENS",
+    "SUMMARY_TOKEN_STEP",
+    "EncodedPrompt",
+    "FragmentCache",
+    "allocate",
+    "compact_json",
+    "encode_layout",
+    "estimate_tokens",
+    "truncate_text",
+]
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import numpy as np
+
+from app.services.ann_index import ExactIndex
+from app.services.utils import topk_desc
+
+# 採点時に float32 へ戻す行数の単位（一度に全行を展開しないため）
+_SCORE_CHUNK = 65536
+
+QUANTIZATION_MODES = ("none", "float16", "int8")
+
+
+class QuantizedMatrix:
+    """L2 正規化済み行列を float16 / 行ごとスケール付き int8 で保持する。
+
+    - float16: 各要素をそのまま半精度で保持する（メモリ 1/2）。
+    - int8: 行ごとに max|x| / 127 をスケールとして int8 に丸める（メモリ約 1/4）。
+    - X[rows] / X[start:end] で float32 に戻した行を返すので、IVFIndex にもそのまま渡せる。
+    """
+
+    def __init__(self, mode: str, data: np.ndarray, scales: np.ndarray | None = None) -> None:
+        self.mode = mode
+        self.data = data
+        self.scales = scales  # int8 の場合のみ shape (N,)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.data.shape
+
+    @property
+    def size(self) -> int:
+        return self.data.size
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    def __getitem__(self, rows) -> np.ndarray:
+        """指定行を float32 に戻して返す。"""
+
+        block = self.data[rows].astype("float32")
+        if self.scales is not None:
+            scales = self.scales[rows]
+            block *= scales[..., None] if np.ndim(scales) else scales
+        return block
+
+    def scores(self, Q_n: np.ndarray) -> np.ndarray:
+        """正規化済みクエリ行列 Q_n (Q, D) に対する近似内積 (Q, N) を返す。"""
+
+        n = self.data.shape[0]
+        out = np.empty((Q_n.shape[0], n), dtype="float32")
+        Q_t = Q_n.astype("float32").T
+        for start in range(0, n, _SCORE_CHUNK):
+            end = min(start + _SCORE_CHUNK, n)
+            block = self.data[start:end].astype("float32") @ Q_t
+            if self.scales is not None:
+                block *= self.scales[start:end, None]
+            out[:, start:end] = block.T
+        return out
+
+    def search(self, Q_n: np.ndarray, k: int) -> list[list[tuple[int, float]]]:
+        """量子化行列で採点し、クエリごとに上位 k 件を返す。"""
+
+        if self.data.size == 0:
+            return [[] for _ in range(Q_n.shape[0])]
+
+        scores = self.scores(Q_n)
+        results: list[list[tuple[int, float]]] = []
+        for row in scores:
+            idx = topk_desc(row, k)
+            results.append([(int(i), float(row[i])) for i in idx])
+        return results
+
+
+def quantize(X_n: np.ndarray, mode: str) -> QuantizedMatrix:
+    """正規化済み行列を指定モードで量子化する。"""
+
+    if mode == "float16":
+        return QuantizedMatrix(mode, X_n.astype("float16"))
+
+    if mode == "int8":
+        max_abs = np.max(np.abs(X_n), axis=1)
+        scales = np.where(max_abs == 0, 1.0, max_abs / 127.0).astype("float32")
+        data = np.clip(np.rint(X_n / scales[:, None]), -127, 127).astype("int8")
+        return QuantizedMatrix(mode, data, scales)
+
+    raise ValueError(f"unknown quantization mode: {mode}")
+
+
+def rescore(
+    Q_n: np.ndarray,
+    candidates: list[list[tuple[int, float]]],
+    exact_rows: np.ndarray,
+    row_ids: np.ndarray,
+    k: int,
+) -> list[list[tuple[int, float]]]:
+    """近似検索の候補を float32 の行で採点し直し、上位 k 件を返す。
+
+    exact_rows は row_ids に対応する正規化済み float32 行（全クエリの候補の和集合）。
+    """
+
+    position = {int(r): i for i, r in enumerate(row_ids)}
+    results: list[list[tuple[int, float]]] = []
+    for q, cands in zip(Q_n, candidates):
+        if not cands:
+            results.append([])
+            continue
+        ids = np.array([i for i, _ in cands], dtype=np.int64)
+        scores = exact_rows[[position[int(i)] for i in ids]] @ q
+        idx = topk_desc(scores, k)
+        results.append([(int(ids[i]), float(scores[i])) for i in idx])
+    return results
+
+
+def evaluate_quantization(
+    X_n: np.ndarray,
+    Q_n: np.ndarray,
+    mode: str,
+    *,
+    k: int = 5,
+    rescore_factor: int = 4,
+) -> dict:
+    """float32 の厳密検索を基準に、量子化による削減メモリと recall@k を計算する。"""
+
+    qm = quantize(X_n, mode)
+    truth = ExactIndex(X_n).search(Q_n, k)
+    approx = qm.search(Q_n, k)
+
+    wide = qm.search(Q_n, k * max(1, rescore_factor))
+    row_ids = np.unique([i for cands in wide for i, _ in cands]).astype(np.int64)
+    rescored = rescore(Q_n, wide, X_n[row_ids], row_ids, k)
+
+    def recall(results: list[list[tuple[int, float]]]) -> float:
+        hit = total = 0
+        for t, r in zip(truth, results):
+            ids = {i for i, _ in t}
+            hit += len(ids & {i for i, _ in r})
+            total += len(ids)
+        return hit / total if total else 1.0
+
+    float32_bytes = int(X_n.astype("float32").nbytes)
+    return {
+        "mode": mode,
+        "num_rows": int(X_n.shape[0]),
+        "dim": int(X_n.shape[1]),
+        "float32_bytes": float32_bytes,
+        "quantized_bytes": int(qm.nbytes),
+        "saved_bytes": float32_bytes - int(qm.nbytes),
+        "saved_ratio": 1.0 - qm.nbytes / float32_bytes if float32_bytes else 0.0,
+        "k": k,
+        "recall_at_k": recall(approx),
+        "recall_at_k_rescored": recall(rescored),
+        "rescore_factor": rescore_factor,
+    }
+
+
+__all__ = [
+    "QUANTIZATION_MODES",
+    "QuantizedMatrix",
+    "evaluate_quantization",
+    "quantize",
+    "rescore",
+]
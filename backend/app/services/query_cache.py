@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query_text(text: str) -> str:
+    """キャッシュキー用にクエリテキストを正規化する（NFKC + 空白の圧縮）。"""
+
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class QueryEmbeddingCache:
+    """クエリ埋め込みベクトルの LRU + TTL キャッシュ。
+
+    - キーは「正規化したクエリテキストの sha256 + モデル名」。
+    - max_entries を超えたら最も古く使われたものから捨てる。
+    - ttl_seconds を過ぎたエントリはミス扱いにして捨てる。
+    - ヒット/ミス/追い出し件数を stats() で返す。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600.0) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        normalized = normalize_query_text(text)
+        digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def get(self, text: str, model: str) -> np.ndarray | None:
+        """キャッシュ済みのベクトルを返す。無い・期限切れの場合は None。"""
+
+        key = self.make_key(text, model)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, vec = entry
+            if now - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, text: str, model: str, vec: np.ndarray) -> None:
+        """ベクトルを登録する。上限を超えた分は古いものから追い出す。"""
+
+        if self.max_entries <= 0:
+            return
+
+        key = self.make_key(text, model)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), vec)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """ヒット/ミス件数などの統計を返す。"""
+
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+__all__ = ["QueryEmbeddingCache", "normalize_query_text"]
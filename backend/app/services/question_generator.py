@@ -1,24 +1,37 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Tuple
+import re
+from typing import Any, AsyncIterator, Sequence, Tuple
 
 from dotenv import load_dotenv
 from pydantic import ValidationError
 
+from app.config import get_settings
 from app.models import (
     DecisionCase,
     NewIdea,
     Question,
     QuestionGenerationMeta,
+    LLMQuestionItem,
     LLMQuestionsPayload,
 )
 
+from app.services import metrics
 from app.services.loader import load_demo_questions
 from app.services.ai_services import ai_service
+from app.services.llm_cache import LLMResponseCache, make_cache_key
+from app.services.prompt_encoder import EncodedPrompt, FragmentCache, encode_layout
 
 load_dotenv()
 
+_settings = get_settings()
+llm_cache = LLMResponseCache(
+    max_entries=_settings.LLM_CACHE_MAX_ENTRIES,
+    max_disk_entries=_settings.LLM_CACHE_MAX_DISK_ENTRIES,
+    ttl_seconds=_settings.LLM_CACHE_TTL_SECONDS,
+)
+
 # Layer1 用のベース質問テンプレート
 BASE_QUESTIONS_LAYER1: list[dict[str, str]] = [
     {
@@ -103,47 +116,145 @@ def build_system_prompt() -> str:
 """.strip()
 
 
-def build_user_message(
+# user メッセージの先頭に置く、リクエストによらない部分（Layer1 テンプレと指示）
+_STATIC_HEAD: dict[str, Any] = {
+    "layer1_base_questions": BASE_QUESTIONS_LAYER1,
+    "instructions": {
+        "layer1": "BASE_QUESTIONS_LAYER1 を参考に、今回の案で特に弱そうな観点を1〜2つ選び、必要に応じて言い換えてください。",
+        "layer2": "similar_decision_cases の main_reason / tags から共通する懸念パターンを整理し、それを避けるための問いを1〜3個作ってください。",
+        "layer3": "current_proposal が過去ケースと比べて極端・特徴的な点を挙げ、その点を検証する問いを1〜2個作ってください。",
+        "case_ranking": "similar_decision_cases は id 順です。current_proposal との類似度の高い順は case_ranking を参照してください。",
+    },
+}
+
+# シリアライズ済みのケース断片（同じケースは多くのリクエストで繰り返し使われる）
+case_fragments = FragmentCache(max_entries=_settings.PROMPT_FRAGMENT_CACHE_MAX_ENTRIES)
+
+
+def encode_user_message(
     new_idea: NewIdea,
     cases: list[DecisionCase],
     num_questions_min: int,
     num_questions_max: int,
-) -> str:
-    """具体的な NewIdea / DecisionCase / テンプレを埋め込んだ user メッセージを構築する。"""
-
-    simplified_cases: list[dict[str, Any]] = []
-    for c in cases[:10]:
-        simplified_cases.append(
-            {
-                "id": c.id,
-                "title": c.title,
-                "summary": c.summary,
-                "status": c.status,
-                "main_reason": c.main_reason,
-                "tags": c.tags,
-            }
-        )
+    *,
+    scores: Sequence[float] | None = None,
+) -> EncodedPrompt:
+    """user メッセージを PROMPT_TOKEN_BUDGET に収まるようエンコードし、推定トークン数と合わせて返す。
 
-    payload = {
-        "current_proposal": new_idea.dict(),
-        "similar_decision_cases": simplified_cases,
-        "layer1_base_questions": BASE_QUESTIONS_LAYER1,
+    scores は cases と同じ順の類似度。予算を超える場合、類似度の低いケースほど summary を短くする。
+
+    プロバイダのプロンプトキャッシュ（先頭一致）に当たるよう、system プロンプトに続けて
+    Layer1 テンプレ・指示 → 類似ケース（id 順）→ 制約・類似度順・current_proposal の順に並べる。
+    """
+
+    top = cases[:10]
+    if scores is None:
+        weights = [1.0 / (rank + 1) for rank in range(len(top))]
+    else:
+        weights = [max(float(s), 0.0) for s in scores[: len(top)]]
+
+    # 類似度順ではなく id 順に並べ、同じケースの組み合わせなら同じ並びになるようにする
+    order = sorted(range(len(top)), key=lambda i: top[i].id)
+    simplified_cases: list[dict[str, Any]] = [
+        {
+            "id": top[i].id,
+            "title": top[i].title,
+            "summary": top[i].summary,
+            "status": top[i].status,
+            "main_reason": top[i].main_reason,
+            "tags": top[i].tags,
+        }
+        for i in order
+    ]
+
+    tail = {
         "constraints": {
             "num_questions_min": num_questions_min,
             "num_questions_max": num_questions_max,
         },
-        "instructions": {
-            "layer1": "BASE_QUESTIONS_LAYER1 を参考に、今回の案で特に弱そうな観点を1〜2つ選び、必要に応じて言い換えてください。",
-            "layer2": "similar_decision_cases の main_reason / tags から共通する懸念パターンを整理し、それを避けるための問いを1〜3個作ってください。",
-            "layer3": "current_proposal が過去ケースと比べて極端・特徴的な点を挙げ、その点を検証する問いを1〜2個作ってください。",
-        },
+        "case_ranking": [c.id for c in top],
+        "current_proposal": new_idea.dict(),
     }
 
-    return json.dumps(payload, ensure_ascii=False, indent=2)
+    encoded = encode_layout(
+        _STATIC_HEAD,
+        "similar_decision_cases",
+        simplified_cases,
+        tail,
+        weights=[weights[i] for i in order],
+        budget=_settings.PROMPT_TOKEN_BUDGET,
+        fragments=case_fragments,
+        proposal_key="current_proposal",
+        proposal_reserve=_settings.PROMPT_PROPOSAL_RESERVE_TOKENS,
+    )
+    metrics.PROMPT_TOKENS.observe(encoded.tokens_before, stage="before")
+    metrics.PROMPT_TOKENS.observe(encoded.tokens_after, stage="after")
+    metrics.annotate(
+        prompt_tokens_before=encoded.tokens_before,
+        prompt_tokens_after=encoded.tokens_after,
+    )
+    return encoded
+
+
+def build_user_message(
+    new_idea: NewIdea,
+    cases: list[DecisionCase],
+    num_questions_min: int,
+    num_questions_max: int,
+    *,
+    scores: Sequence[float] | None = None,
+) -> str:
+    """具体的な NewIdea / DecisionCase / テンプレを埋め込んだ user メッセージを構築する。
+
+    空白なしの JSON で、PROMPT_TOKEN_BUDGET（推定トークン数）を超える場合は切り詰める（encode_user_message）。
+    """
+
+    return encode_user_message(
+        new_idea, cases, num_questions_min, num_questions_max, scores=scores
+    ).text
+
+def _llm_labels() -> dict[str, str]:
+    """メトリクス用の provider / model ラベル。"""
+    return {"provider": ai_service.llm_provider, "model": ai_service.llm_model}
+
 
 def call_llm(system_prompt: str, user_message: str) -> LLMQuestionsPayload:
     # 11/27 add: services/ai_services.pyに集約
-    return ai_service.call_llm(system_prompt, user_message)
+    with metrics.span("llm", **_llm_labels()):
+        payload = ai_service.call_llm(system_prompt, user_message)
+    metrics.QUESTION_GENERATIONS.inc(source="llm", **_llm_labels())
+    return payload
+
+
+async def acall_llm(system_prompt: str, user_message: str) -> LLMQuestionsPayload:
+    """call_llm の非同期版。"""
+    with metrics.span("llm", **_llm_labels()):
+        payload = await ai_service.acall_llm(system_prompt, user_message)
+    metrics.QUESTION_GENERATIONS.inc(source="llm", **_llm_labels())
+    return payload
+
+
+def _llm_cache_key(system_prompt: str, user_message: str) -> str:
+    return make_cache_key(
+        system_prompt, user_message, f"{ai_service.llm_provider}/{ai_service.llm_model}"
+    )
+
+
+def _get_cached_payload(key: str, use_cache: bool) -> LLMQuestionsPayload | None:
+    """キャッシュが有効かつ bypass されていなければ、キャッシュ済みの応答を返す。"""
+    if not (_settings.LLM_CACHE_ENABLED and use_cache):
+        return None
+    payload = llm_cache.get(key)
+    metrics.CACHE_REQUESTS.inc(cache="llm", result="miss" if payload is None else "hit")
+    if payload is not None:
+        metrics.QUESTION_GENERATIONS.inc(source="cache", **_llm_labels())
+    return payload
+
+
+def _store_payload(key: str, payload: LLMQuestionsPayload) -> None:
+    """検証済みの応答をキャッシュに登録する（bypass 時も最新の応答で上書きする）。"""
+    if _settings.LLM_CACHE_ENABLED:
+        llm_cache.put(key, payload)
 
 def _fallback_questions(
     new_idea: NewIdea,
@@ -153,34 +264,37 @@ def _fallback_questions(
 ) -> Tuple[list[Question], QuestionGenerationMeta]:
     """LLM失敗時用の静的問い生成（Layer1のみ）。"""
 
-    k = max(3, min(num_questions_max, len(BASE_QUESTIONS_LAYER1)))
-    selected = BASE_QUESTIONS_LAYER1[:k]
-
-    based_on_ids = [c.id for c in cases[:3]]
-
-    questions: list[Question] = []
-    for i, tpl in enumerate(selected, start=1):
-        questions.append(
-            Question(
-                id=f"q{i}",
-                layer=1,
-                theme=tpl["theme"],
-                question=tpl["template"],
-                based_on_case_ids=based_on_ids,
-                risk_type=tpl["risk_type"],
-                priority=2,
-                note_for_admin="LLM出力のパースに失敗したため、Layer1テンプレートから生成されたフォールバック質問です。",
+    metrics.FALLBACKS.inc(kind="questions")
+    metrics.QUESTION_GENERATIONS.inc(source="fallback", **_llm_labels())
+    with metrics.span("fallback", **_llm_labels()):
+        k = max(3, min(num_questions_max, len(BASE_QUESTIONS_LAYER1)))
+        selected = BASE_QUESTIONS_LAYER1[:k]
+
+        based_on_ids = [c.id for c in cases[:3]]
+
+        questions: list[Question] = []
+        for i, tpl in enumerate(selected, start=1):
+            questions.append(
+                Question(
+                    id=f"q{i}",
+                    layer=1,
+                    theme=tpl["theme"],
+                    question=tpl["template"],
+                    based_on_case_ids=based_on_ids,
+                    risk_type=tpl["risk_type"],
+                    priority=2,
+                    note_for_admin="LLM出力のパースに失敗したため、Layer1テンプレートから生成されたフォールバック質問です。",
+                )
             )
-        )
 
-    meta = QuestionGenerationMeta(
-        num_questions=len(questions),
-        layer1_count=len(questions),
-        layer2_count=0,
-        layer3_count=0,
-        comment="LLM出力のパースに失敗したため、Layer1テンプレートのみで問いを生成しました。",
-    )
-    return questions, meta
+        meta = QuestionGenerationMeta(
+            num_questions=len(questions),
+            layer1_count=len(questions),
+            layer2_count=0,
+            layer3_count=0,
+            comment="LLM出力のパースに失敗したため、Layer1テンプレートのみで問いを生成しました。",
+        )
+        return questions, meta
 
 
 def generate_questions(
@@ -189,49 +303,224 @@ def generate_questions(
     *,
     num_questions_min: int = 3,
     num_questions_max: int = 7,
+    use_cache: bool = True,
+    scores: Sequence[float] | None = None,
 ) -> Tuple[list[Question], QuestionGenerationMeta]:
     """
     new_idea と類似 DecisionCase のリストをもとに、自己レビュー用の問いを生成する。
 
     - LLMに渡す system / user プロンプトの構築
-    - LLM呼び出し
+    - LLM呼び出し（同一プロンプト・同一モデルの応答はキャッシュから返す）
     - JSONパース
     - Question モデルへの変換
     - メタ情報（レイヤーごとの件数など）の返却
+
+    use_cache=False の場合はキャッシュを読まずに LLM を呼び出す。
+    scores は cases の類似度（プロンプトが予算を超えるときの summary の切り詰めに使う）。
     """
 
     system_prompt = build_system_prompt()
-    user_message = build_user_message(new_idea, cases, num_questions_min, num_questions_max)
+    user_message = build_user_message(
+        new_idea, cases, num_questions_min, num_questions_max, scores=scores
+    )
 
-    try:
-        payload = call_llm(system_prompt, user_message)
-    except (json.JSONDecodeError, ValidationError, Exception):
-        return _fallback_questions(new_idea, cases, num_questions_min, num_questions_max)
+    key = _llm_cache_key(system_prompt, user_message)
+    payload = _get_cached_payload(key, use_cache)
+    if payload is None:
+        try:
+            payload = call_llm(system_prompt, user_message)
+        except (json.JSONDecodeError, ValidationError, Exception):
+            return _fallback_questions(new_idea, cases, num_questions_min, num_questions_max)
+        _store_payload(key, payload)
 
-    questions: list[Question] = []
-    for i, q in enumerate(payload.questions, start=1):
-        questions.append(
-            Question(
-                id=q.id or f"q{i}",
-                layer=q.layer,
-                theme=q.theme,
-                question=q.question,
-                based_on_case_ids=q.based_on_case_ids,
-                risk_type=q.risk_type,
-                priority=q.priority,
-                note_for_admin=q.note_for_admin,
-            )
-        )
+    return _payload_to_questions(payload)
 
-    meta = QuestionGenerationMeta(
+
+async def agenerate_questions(
+    new_idea: NewIdea,
+    cases: list[DecisionCase],
+    *,
+    num_questions_min: int = 3,
+    num_questions_max: int = 7,
+    use_cache: bool = True,
+    scores: Sequence[float] | None = None,
+) -> Tuple[list[Question], QuestionGenerationMeta]:
+    """generate_questions の非同期版。LLM 応答待ちの間ワーカースレッドを占有しない。"""
+
+    system_prompt = build_system_prompt()
+    user_message = build_user_message(
+        new_idea, cases, num_questions_min, num_questions_max, scores=scores
+    )
+
+    key = _llm_cache_key(system_prompt, user_message)
+    payload = _get_cached_payload(key, use_cache)
+    if payload is None:
+        try:
+            payload = await acall_llm(system_prompt, user_message)
+        except (json.JSONDecodeError, ValidationError, Exception):
+            return _fallback_questions(new_idea, cases, num_questions_min, num_questions_max)
+        _store_payload(key, payload)
+
+    return _payload_to_questions(payload)
+
+
+def _item_to_question(item: LLMQuestionItem, index: int) -> Question:
+    """LLM 出力の1問分を Question モデルに変換する。"""
+
+    return Question(
+        id=item.id or f"q{index}",
+        layer=item.layer,
+        theme=item.theme,
+        question=item.question,
+        based_on_case_ids=item.based_on_case_ids,
+        risk_type=item.risk_type,
+        priority=item.priority,
+        note_for_admin=item.note_for_admin,
+    )
+
+
+def _build_meta(questions: list[Question], comment: str) -> QuestionGenerationMeta:
+    """問いの一覧からレイヤーごとの件数を集計したメタ情報を作る。"""
+
+    return QuestionGenerationMeta(
         num_questions=len(questions),
         layer1_count=sum(1 for q in questions if q.layer == 1),
         layer2_count=sum(1 for q in questions if q.layer == 2),
         layer3_count=sum(1 for q in questions if q.layer == 3),
-        comment=payload.meta.comment,
+        comment=comment,
     )
 
-    return questions, meta
+
+def _payload_to_questions(
+    payload: LLMQuestionsPayload,
+) -> Tuple[list[Question], QuestionGenerationMeta]:
+    """LLM の出力を Question モデルとメタ情報に変換する。"""
+
+    questions = [_item_to_question(q, i) for i, q in enumerate(payload.questions, start=1)]
+    return questions, _build_meta(questions, payload.meta.comment)
+
+
+class _StreamingQuestionsParser:
+    """ストリーミング中の JSON テキストから、完成した questions の要素を順に取り出す。
+
+    questions 配列の中を1文字ずつ走査し、文字列リテラルとエスケープを考慮して
+    波括弧の深さを追う。深さが 0 に戻った時点でその要素を1問としてパースする。
+    走査位置を保持するので、全体で O(出力長) で済む。
+    """
+
+    _ARRAY_START = re.compile(r'"questions"\s*:\s*\[')
+
+    def __init__(self) -> None:
+        self.buffer = ""
+        self._pos = -1  # 次に走査する位置（-1 は配列の開始前）
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start = 0
+        self._done = False
+
+    def feed(self, text: str) -> list[LLMQuestionItem]:
+        """テキスト断片を追加し、新たに完成した問いを返す。"""
+
+        self.buffer += text
+        items: list[LLMQuestionItem] = []
+        if self._done:
+            return items
+
+        if self._pos < 0:
+            m = self._ARRAY_START.search(self.buffer)
+            if m is None:
+                return items
+            self._pos = m.end()
+
+        buf = self.buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self._obj_start = i
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    items.append(LLMQuestionItem.model_validate_json(buf[self._obj_start : i + 1]))
+            elif ch == "]" and self._depth == 0:
+                self._done = True
+                i += 1
+                break
+            i += 1
+
+        self._pos = i
+        return items
+
+
+async def astream_questions(
+    new_idea: NewIdea,
+    cases: list[DecisionCase],
+    *,
+    num_questions_min: int = 3,
+    num_questions_max: int = 7,
+    use_cache: bool = True,
+    scores: Sequence[float] | None = None,
+) -> AsyncIterator[Question | QuestionGenerationMeta]:
+    """LLM のストリーミング出力から、問いが1つ完成するたびに Question を返す。
+
+    - 最後に QuestionGenerationMeta を1つ返す。
+    - キャッシュにヒットした場合は LLM を呼ばずにすべての問いをすぐ返す。
+    - 1問も得られないうちに失敗した場合は、フォールバックの問いを返す。
+    - 途中で失敗した場合は、受信済みの問いだけでメタ情報を作る。
+    """
+
+    system_prompt = build_system_prompt()
+    user_message = build_user_message(
+        new_idea, cases, num_questions_min, num_questions_max, scores=scores
+    )
+
+    key = _llm_cache_key(system_prompt, user_message)
+    cached = _get_cached_payload(key, use_cache)
+    if cached is not None:
+        cached_questions, cached_meta = _payload_to_questions(cached)
+        for question in cached_questions:
+            yield question
+        yield cached_meta
+        return
+
+    parser = _StreamingQuestionsParser()
+    questions: list[Question] = []
+    try:
+        # 所要時間には呼び出し側が各問いを送出している時間も含まれる
+        with metrics.span("llm", **_llm_labels()):
+            async for delta in ai_service.astream_llm(system_prompt, user_message):
+                for item in parser.feed(delta):
+                    question = _item_to_question(item, len(questions) + 1)
+                    questions.append(question)
+                    yield question
+            payload = LLMQuestionsPayload.model_validate_json(parser.buffer)
+        metrics.QUESTION_GENERATIONS.inc(source="llm", **_llm_labels())
+        _store_payload(key, payload)
+        comment = payload.meta.comment
+    except (json.JSONDecodeError, ValidationError, Exception):
+        if not questions:
+            fallback_questions, fallback_meta = _fallback_questions(
+                new_idea, cases, num_questions_min, num_questions_max
+            )
+            for question in fallback_questions:
+                yield question
+            yield fallback_meta
+            return
+        comment = "LLMのストリーミング出力が途中で途切れたため、受信済みの問いのみを返しました。"
+
+    yield _build_meta(questions, comment)
 
     # 11/27 add: questionsのデモを生成
 def generate_demo_questions() -> Tuple[list[Question], QuestionGenerationMeta]:
@@ -253,8 +542,12 @@ def generate_demo_questions() -> Tuple[list[Question], QuestionGenerationMeta]:
 
 __all__ = [
     "generate_questions",
+    "agenerate_questions",
+    "astream_questions",
     "build_system_prompt",
     "build_user_message",
+    "encode_user_message",
     "call_llm",
+    "acall_llm",
 ]
 
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows では共有索引は使えない
+    fcntl = None  # type: ignore[assignment]
+
+from app.config import get_settings
+from app.services import loader, similarity
+from app.services.corpus_snapshot import CorpusSnapshot, open_snapshot
+
+_settings = get_settings()
+
+# ディレクトリ構成:
+#   CURRENT              公開中の世代番号（{"generation": N}。一時ファイル + os.replace で更新）
+#   gen-0000000N.snapshot 世代 N のスナップショット（corpus_snapshot 形式）
+#   builder.lock         構築・公開を1プロセスに限るためのロック（flock）
+_CURRENT_FILE = "CURRENT"
+_LOCK_FILE = "builder.lock"
+_SNAPSHOT_PATTERN = re.compile(r"gen-(\d+)\.snapshot")
+
+# このプロセスが開いている世代（未接続なら None）
+_generation: int | None = None
+# 世代の切り替えを直列化するためのロック（ポーリングと管理 API が同時に切り替えないように）
+_ATTACH_LOCK = threading.Lock()
+
+
+def get_shared_index_dir() -> Path:
+    """共有索引のディレクトリ（SHARED_INDEX_DIR、既定は backend/data/shared_index）を返す。"""
+
+    if _settings.SHARED_INDEX_DIR:
+        return Path(_settings.SHARED_INDEX_DIR)
+    services_dir = Path(__file__).resolve().parent
+    return services_dir.parent.parent / "data" / "shared_index"
+
+
+def _snapshot_path(directory: Path, generation: int) -> Path:
+    return directory / f"gen-{generation:08d}.snapshot"
+
+
+def attached_generation() -> int | None:
+    """このプロセスが開いている世代番号を返す。"""
+    return _generation
+
+
+def read_current(directory: Path | None = None) -> int | None:
+    """公開中の世代番号を返す（まだ公開されていなければ None）。"""
+
+    directory = directory or get_shared_index_dir()
+    try:
+        with (directory / _CURRENT_FILE).open("r", encoding="utf-8") as f:
+            return int(json.load(f)["generation"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_current(directory: Path, generation: int) -> None:
+    tmp = directory / f"{_CURRENT_FILE}.{os.getpid()}.tmp"
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump({"generation": generation}, f)
+    os.replace(tmp, directory / _CURRENT_FILE)
+
+
+def _remove_old_generations(directory: Path, generation: int) -> None:
+    """残す世代数より古いスナップショットを消す。
+
+    他のワーカーが開いたままでも、memory-map 済みのファイルは削除後も読める（POSIX）。
+    """
+    keep = max(1, _settings.SHARED_INDEX_KEEP_GENERATIONS)
+    for path in directory.glob("gen-*.snapshot"):
+        m = _SNAPSHOT_PATTERN.fullmatch(path.name)
+        if m and int(m.group(1)) <= generation - keep:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+@contextmanager
+def builder_lock(directory: Path | None = None) -> Iterator[None]:
+    """共有索引の構築・公開を1プロセスに限るロック（他のプロセスは解放まで待つ）。"""
+
+    if fcntl is None:
+        raise RuntimeError("SHARED_INDEX_ENABLED は fcntl が使える環境（Linux / macOS）でのみ利用できます。")
+
+    directory = directory or get_shared_index_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    with (directory / _LOCK_FILE).open("a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _attach(snapshot: CorpusSnapshot, generation: int) -> bool:
+    """スナップショットの DecisionCase と行列でこのプロセスの索引を差し替える。"""
+    global _generation
+
+    with _ATTACH_LOCK:
+        # 古い世代で新しい世代を上書きしない
+        if _generation is not None and generation <= _generation:
+            return False
+        loader.use_snapshot(snapshot)
+        similarity.refresh_similarity()
+        _generation = generation
+    print(f"shared index: 世代 {generation} に切り替えました ({snapshot.path.name})")
+    return True
+
+
+def attach(generation: int, directory: Path | None = None) -> bool:
+    """公開済みの世代 generation を開き、このプロセスの索引を差し替える。"""
+
+    directory = directory or get_shared_index_dir()
+    snapshot = open_snapshot(_snapshot_path(directory, generation))
+    if snapshot is None:
+        return False
+    return _attach(snapshot, generation)
+
+
+def _open_if_current(directory: Path, generation: int) -> CorpusSnapshot | None:
+    """世代 generation が DecisionCase ファイル・現在の埋め込みと一致していれば開いて返す。"""
+
+    snapshot = open_snapshot(
+        _snapshot_path(directory, generation), loader.get_decision_cases_path()
+    )
+    if snapshot is None:
+        return None
+    if _settings.RETRIEVAL_MODE != "lexical" and snapshot.embedding != similarity.embedding_id():
+        return None
+    return snapshot
+
+
+def sync() -> int:
+    """共有索引を DecisionCase ファイルに合わせて最新にし、このプロセスで開く。返り値は世代番号。
+
+    builder ロックを取ってから公開中の世代を確認する。ファイルと一致していれば開くだけで、
+    一致しない（未公開・ファイルの更新後）場合はこのプロセスが構築して次の世代として公開する。
+    そのため同時に起動した N ワーカーのうち、埋め込みを行うのは最初にロックを取った1つだけになる。
+    """
+
+    directory = get_shared_index_dir()
+    with builder_lock(directory):
+        current = read_current(directory)
+        if current is not None:
+            snapshot = _open_if_current(directory, current)
+            if snapshot is not None:
+                _attach(snapshot, current)
+                return current
+
+        loader.reload_decision_cases()
+        state = similarity.refresh_similarity()
+        generation = (current or 0) + 1
+        similarity.write_state_snapshot(state, _snapshot_path(directory, generation))
+        _write_current(directory, generation)
+        _remove_old_generations(directory, generation)
+        print(f"shared index: 世代 {generation} を公開しました")
+
+    # 構築したプロセスも公開したファイルを開き直し、他のワーカーと同じページを共有する
+    attach(generation, directory)
+    return generation
+
+
+class GenerationWatcher:
+    """公開中の世代番号をポーリングし、新しい世代が公開されたら開き直す。
+
+    CorpusWatcher と同じく、切り替えに失敗しても監視は続ける（次の確認で再試行される）。
+    """
+
+    def __init__(self, *, interval_seconds: float = 2.0) -> None:
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def check(self) -> bool:
+        """新しい世代があれば切り替えて True を返す。"""
+
+        current = read_current()
+        if current is None or current == _generation:
+            return False
+        try:
+            return attach(current)
+        except Exception as exc:
+            print(f"shared index: 世代 {current} への切り替えに失敗しました: {exc}")
+            return False
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            self.check()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="shared-index-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval_seconds)
+            self._thread = None
+
+
+__all__ = [
+    "GenerationWatcher",
+    "attach",
+    "attached_generation",
+    "builder_lock",
+    "get_shared_index_dir",
+    "read_current",
+    "sync",
+]
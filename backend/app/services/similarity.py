@@ -1,17 +1,39 @@
 from __future__ import annotations
 
-from typing import List
+import asyncio
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Sequence
 
 import numpy as np
 from pydantic import BaseModel
 
-from app.models import DecisionCase, NewIdea
-from app.services.embeddings import embed_texts
-from app.services.loader import get_decision_cases
-from app.services.utils import normalize_rows
+from app.config import get_settings
+from app.models import CaseFilter, DecisionCase, NewIdea
+from app.services.ann_index import ExactIndex, IVFIndex, default_nlist
+from app.services.embedding_store import text_hash
+from app.services.embeddings import (
+    aembed_texts,
+    embed_texts,
+    embed_texts_cached,
+    get_embedding_model,
+    get_embedding_store,
+)
+from app.services import metrics
+from app.services.corpus_snapshot import SnapshotCases, get_snapshot_path, write_snapshot
+from app.services.lexical_index import BM25Index
+from app.services.loader import get_decision_cases, get_source
+from app.services.metadata_index import MetadataIndex
+from app.services.quantization import QuantizedMatrix, evaluate_quantization, quantize, rescore
+from app.services.query_cache import QueryEmbeddingCache
+from app.services.utils import normalize_rows, topk_desc
 
-CASES: list[DecisionCase] | None = None
-X_n: np.ndarray | None = None  # shape (N, D), L2 正規化済
+_settings = get_settings()
+query_cache = QueryEmbeddingCache(
+    max_entries=_settings.QUERY_CACHE_MAX_ENTRIES,
+    ttl_seconds=_settings.QUERY_CACHE_TTL_SECONDS,
+)
 
 
 class ScoredDecisionCase(BaseModel):
@@ -30,6 +52,17 @@ def build_case_text(case: DecisionCase) -> str:
     return "\n".join(parts)
 
 
+# BM25 の対象。ラベル（"Tags: " など）は全ケース共通の語になるだけなので含めない
+def build_lexical_text(case: DecisionCase) -> str:
+    parts = [
+        case.title,
+        case.summary,
+        " ".join(case.tags or []),
+        case.main_reason or "",
+    ]
+    return "\n".join(parts)
+
+
 # 埋め込みモデルが読み取りやすいように形式を整えている（構造化を崩している）
 def build_query_text(new_idea: NewIdea) -> str:
     parts = [
@@ -40,76 +73,775 @@ def build_query_text(new_idea: NewIdea) -> str:
     return "\n".join(parts)
 
 
-def initialize_similarity() -> None:
-    """DecisionCase の埋め込み行列を作成し、正規化してキャッシュする。"""
-    global CASES, X_n
+class SimilarityState:
+    """類似検索に使うデータ一式（ケース・正規化済み行列・ANN / BM25 / メタデータの各インデックス）。
+
+    一度作ったら変更しない。検索側は _STATE を最初に1回だけ読み、そのスナップショットを
+    最後まで使う。更新側は新しい SimilarityState を組み立ててから _STATE を1回の代入で
+    差し替えるため、実行中の検索が作りかけのインデックスを見ることはない。
+    """
+
+    def __init__(
+        self,
+        cases: Sequence[DecisionCase],
+        keys: list[str],
+        X_n: np.ndarray | QuantizedMatrix | None,
+        ann_index: IVFIndex | None = None,
+        lexical: BM25Index | None = None,
+        metadata: MetadataIndex | None = None,
+        *,
+        complete: bool = True,
+        vectors: np.ndarray | None = None,
+    ) -> None:
+        self.cases = cases
+        self.keys = keys  # 各行の build_case_text の内容ハッシュ
+        # shape (N, D), L2 正規化済。SIMILARITY_QUANTIZATION 指定時は QuantizedMatrix
+        self.X_n = X_n
+        self.ann_index = ann_index  # SIMILARITY_INDEX="ivf" かつ件数が十分な場合のみ
+        self.lexical = lexical  # build_lexical_text に対する BM25 インデックス
+        self.metadata = metadata or MetadataIndex().build(cases)  # status / tags などの絞り込み用
+        # False は起動直後の埋め込み前の状態（BM25 のみで検索できる）
+        self.complete = complete
+        # 量子化時の float32 正規化済み行列（スナップショットの memory-map）。
+        # None の場合、float32 はディスク上の埋め込みキャッシュから読む（float32_rows）
+        self.vectors = vectors
+
+    def float32_rows(self, rows: Sequence[int] | np.ndarray | None = None) -> np.ndarray:
+        """float32 の正規化済みベクトルを返す（rows を省略した場合は全行）。
+
+        X_n が float32 ならそれを、量子化済みならスナップショットの行列を使い、どちらも無い場合だけ
+        埋め込みキャッシュから読み直す。
+        """
+
+        source = self.X_n if isinstance(self.X_n, np.ndarray) else self.vectors
+        if source is not None:
+            if rows is None:
+                return np.asarray(source, dtype="float32")
+            return np.asarray(source[np.asarray(rows, dtype=np.int64)], dtype="float32")
+        keys = self.keys if rows is None else [self.keys[int(i)] for i in rows]
+        return normalize_rows(get_embedding_store().get_many(keys))
+
+    @property
+    def quantized(self) -> bool:
+        return isinstance(self.X_n, QuantizedMatrix)
+
+
+class SimilarityNotReady(RuntimeError):
+    """類似検索の索引がまだ使えない（未初期化、または構築中で SEARCH_WHILE_INDEXING="unavailable"）。"""
+
+
+_STATE: SimilarityState | None = None
+# 更新処理どうしを直列化するためのロック（検索側はロックを取らない）
+_UPDATE_LOCK = threading.Lock()
+
+
+def get_state() -> SimilarityState | None:
+    """現在の SimilarityState を返す（未初期化なら None）。"""
+    return _STATE
+
+
+def is_ready() -> bool:
+    """埋め込みを含む索引の構築が完了していれば True を返す。"""
+    state = _STATE
+    return state is not None and state.complete
+
+
+def _build_ann_index(
+    X_n: np.ndarray | QuantizedMatrix,
+    keys: list[str],
+    previous: IVFIndex | None,
+) -> IVFIndex | None:
+    """設定に応じて IVF インデックスを構築（またはディスクから読み込み）する。
+
+    直前のインデックスがあればセントロイドを再利用し、転置リストの再割り当てだけを行う。
+    """
+    n = X_n.shape[0]
+    if _settings.SIMILARITY_INDEX != "ivf" or n < _settings.ANN_MIN_CASES:
+        return None
+
+    nlist = _settings.IVF_NLIST or default_nlist(n)
+    digest = hashlib.sha256()
+    for k in keys:
+        digest.update(k.encode("ascii"))
+    fingerprint = f"{digest.hexdigest()}:{nlist}"
+
+    path = get_embedding_store().directory / "ivf_index.npz"
+    if previous is None and path.exists():
+        try:
+            index = IVFIndex.load(path)
+            if index.fingerprint == fingerprint:
+                index.nprobe = _settings.IVF_NPROBE
+                return index.attach(X_n)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # 件数が大きく変わって適切な nlist が2倍以上ずれた場合は k-means からやり直す
+    reusable = (
+        previous is not None
+        and previous.centroids is not None
+        and previous.centroids.shape[1] == X_n.shape[1]
+        and previous.nlist * 2 > min(nlist, n) > previous.nlist // 2
+    )
+    if reusable:
+        assert previous is not None
+        index = previous.reassign(X_n, fingerprint=fingerprint)
+    else:
+        index = IVFIndex(nlist=nlist, nprobe=_settings.IVF_NPROBE)
+        index.build(X_n, fingerprint=fingerprint)
+    index.save(path)
+    return index
+
+
+def embedding_id() -> str:
+    """行列を作った埋め込みの識別子（"{provider}/{model}"）。スナップショットの照合に使う。"""
+    store = get_embedding_store()
+    return f"{store.provider}/{store.model}"
+
+
+def refresh_similarity() -> SimilarityState:
+    """loader の現在の DecisionCase 一覧から SimilarityState を作り直し、差し替える。
+
+    - 内容（build_case_text）が変わっていないケースは現在の行列の行をそのまま使う。
+    - 新規・変更されたケースだけを埋め込む（ディスク上の埋め込みキャッシュも経由する）。
+    - 削除されたケースの行は新しい行列に含めない。
+    - BM25 / メタデータのインデックスは埋め込みより先に毎回作り直す（通信が不要で十分速いため）。
+    - RETRIEVAL_MODE="lexical" の場合は埋め込みを行わない。
+    - 起動直後（完成した索引がまだ無い場合）は、埋め込みの前に BM25 だけの状態を先に公開する。
+    - 一覧がスナップショットから開いたもの（SnapshotCases）の場合は、内容ハッシュ・BM25・
+      メタデータをスナップショットから読み、同じ埋め込みで作った行列があればそれも使う。
+    """
+    global _STATE
+
+    with _UPDATE_LOCK:
+        previous = _STATE
+        cases = get_decision_cases()
+
+        if not cases:
+            _STATE = SimilarityState(list(cases), [], None)
+            return _STATE
+
+        snapshot = cases.snapshot if isinstance(cases, SnapshotCases) else None
+        if snapshot is not None:
+            keys = snapshot.keys
+            lexical = snapshot.lexical
+            metadata = snapshot.metadata
+            texts: list[str] | None = None
+        else:
+            cases = list(cases)
+            texts = [build_case_text(c) for c in cases]
+            keys = [text_hash(t) for t in texts]
+            lexical = BM25Index().build([build_lexical_text(c) for c in cases])
+            metadata = MetadataIndex().build(cases)
+
+        if _settings.RETRIEVAL_MODE == "lexical":
+            _STATE = SimilarityState(cases, keys, None, lexical=lexical, metadata=metadata)
+            return _STATE
+
+        X_n: np.ndarray | None = None
+        if snapshot is not None and snapshot.embedding == embedding_id():
+            X_n = snapshot.vectors
+        # 量子化しても float32 の再採点にスナップショットの行列を使う（埋め込みキャッシュ無しで動く）
+        vectors = X_n
+
+        if X_n is None:
+            if texts is None:
+                texts = [build_case_text(c) for c in cases]
+            X_n = _embed_case_texts(cases, texts, keys, lexical, metadata, previous)
+            if X_n is None:
+                _STATE = SimilarityState(cases, keys, None, lexical=lexical, metadata=metadata)
+                return _STATE
 
-    CASES = get_decision_cases()
+        mode = _settings.SIMILARITY_QUANTIZATION
+        matrix: np.ndarray | QuantizedMatrix = X_n
+        if mode != "none":
+            matrix = quantize(X_n, mode)
+            print(
+                f"similarity: {mode} 量子化で {X_n.nbytes - matrix.nbytes:,} bytes 削減 "
+                f"({X_n.nbytes:,} -> {matrix.nbytes:,})"
+            )
+            del X_n
 
-    if not CASES:
-        X_n = None
+        ann_index = _build_ann_index(
+            matrix, keys, previous.ann_index if previous is not None else None
+        )
+
+        _STATE = SimilarityState(
+            cases,
+            keys,
+            matrix,
+            ann_index,
+            lexical,
+            metadata,
+            vectors=vectors if mode != "none" else None,
+        )
+        return _STATE
+
+
+def _embed_case_texts(
+    cases: Sequence[DecisionCase],
+    texts: list[str],
+    keys: list[str],
+    lexical: BM25Index,
+    metadata: MetadataIndex,
+    previous: SimilarityState | None,
+) -> np.ndarray | None:
+    """refresh_similarity 用に、ケースの正規化済み行列を作る（埋め込みが空なら None）。
+
+    _UPDATE_LOCK を取った状態で呼ぶ。
+    """
+    global _STATE
+
+    if previous is None or not previous.complete:
+        _STATE = SimilarityState(
+            cases, keys, None, lexical=lexical, metadata=metadata, complete=False
+        )
+
+    prev_rows: dict[str, int] = {}
+    if previous is not None and previous.X_n is not None:
+        prev_rows = {k: i for i, k in enumerate(previous.keys)}
+
+    delta = [i for i, k in enumerate(keys) if k not in prev_rows]
+    # 量子化済みの行は再利用せず、ディスク上の float32 から量子化し直す（API は呼ばない）
+    if (
+        previous is None
+        or not isinstance(previous.X_n, np.ndarray)
+        or len(delta) == len(keys)
+    ):
+        vecs = embed_texts_cached(texts)
+        if vecs.size == 0:
+            return None
+        return normalize_rows(vecs)
+
+    X_n = np.empty((len(keys), previous.X_n.shape[1]), dtype=previous.X_n.dtype)
+    reused = [i for i, k in enumerate(keys) if k in prev_rows]
+    X_n[reused] = previous.X_n[[prev_rows[keys[i]] for i in reused]]
+    if delta:
+        X_n[delta] = normalize_rows(embed_texts_cached([texts[i] for i in delta]))
+    return X_n
+
+
+def write_state_snapshot(state: SimilarityState, path: Path | None = None) -> None:
+    """SimilarityState からコーパスのスナップショットを書き出す。
+
+    path を省略した場合は、読み込んだ DecisionCase ファイルに対応するパス（decision_case.snapshot）。
+    """
+
+    vectors: np.ndarray | None = None
+    if state.X_n is not None:
+        vectors = state.float32_rows()
+
+    source = get_source()
+    if source is None:
         return
 
-    texts = [build_case_text(c) for c in CASES]
-    vecs = embed_texts(texts)
+    path = path or get_snapshot_path(source[0])
+    write_snapshot(
+        path,
+        cases=state.cases,
+        keys=state.keys,
+        lexical=state.lexical or BM25Index().build([]),
+        metadata=state.metadata,
+        source=source[1],
+        vectors=vectors,
+        embedding=embedding_id() if vectors is not None else None,
+    )
+    print(f"similarity: コーパスのスナップショットを書き出しました ({path})")
+
+
+def initialize_similarity() -> None:
+    """DecisionCase の埋め込み行列を作成し、正規化してキャッシュする。
+
+    ケースの埋め込みはディスク上のキャッシュ (embedding_store) を経由するため、
+    再起動時は新規・変更されたケースだけが埋め込み API に送られる。
+    CORPUS_SNAPSHOT_ENABLED の場合、JSON から読んだとき（またはスナップショットの行列が
+    現在の埋め込みと異なるとき）は、次回の起動用にスナップショットを書き出す。
+    """
+    state = refresh_similarity()
 
-    if vecs.size == 0:
-        X_n = None
+    if not _settings.CORPUS_SNAPSHOT_ENABLED or not state.cases or state.lexical is None:
         return
+    if isinstance(state.cases, SnapshotCases):
+        snapshot = state.cases.snapshot
+        if state.X_n is None or snapshot.embedding == embedding_id():
+            return
+
+    try:
+        write_state_snapshot(state)
+    except OSError as e:
+        print(f"similarity: スナップショットを書き出せませんでした ({e!r})")
+
+
+def _require_state() -> SimilarityState:
+    state = _STATE
+    if state is None or (state.X_n is None and state.lexical is None):
+        raise SimilarityNotReady("initialize_similarity() が実行されていません。")
+    if not state.complete and _settings.SEARCH_WHILE_INDEXING == "unavailable":
+        raise SimilarityNotReady("類似検索の索引を構築中です。")
+    return state
+
+
+def analyze_similarity_cases_batch(
+    query_vecs: np.ndarray,
+    *,
+    topk: int = 5,
+    exact: bool = False,
+    state: SimilarityState | None = None,
+    mask: np.ndarray | None = None,
+) -> list[list[tuple[int, float]]]:
+    """クエリ行列 (Q, D) と CASES の類似度を計算し、クエリごとに上位 topk 件を返す。
+
+    - 厳密検索では (Q×N) の行列積を1回だけ行う。
+    - ANN インデックスがあれば近似検索、無ければ全件の厳密検索を行う。
+    - exact=True の場合は常に厳密検索（リファレンスモード）を使う。
+    - state を省略した場合は現在の SimilarityState を使う。
+    - mask (N,) を渡した場合は True の行だけを取り出してから採点する。
+    """
+    state = state or _STATE
+    if state is None or state.X_n is None or state.X_n.size == 0 or topk <= 0:
+        return [[] for _ in range(query_vecs.shape[0])]
+
+    Q_n = normalize_rows(query_vecs)
+
+    if mask is not None:
+        return _search_rows(state, Q_n, topk, np.flatnonzero(mask), exact=exact)
+
+    if isinstance(state.X_n, QuantizedMatrix):
+        return _search_quantized(state, Q_n, topk, exact=exact)
+
+    if state.ann_index is not None and not exact:
+        return state.ann_index.search(Q_n, topk)
+
+    return ExactIndex(state.X_n).search(Q_n, topk)
+
+
+def _exact_rows(state: SimilarityState, rows: np.ndarray) -> np.ndarray:
+    """指定行の float32 正規化済みベクトルを取得する（SimilarityState.float32_rows）。"""
+    return state.float32_rows(rows)
+
+
+def _search_quantized(
+    state: SimilarityState,
+    Q_n: np.ndarray,
+    topk: int,
+    *,
+    exact: bool,
+) -> list[list[tuple[int, float]]]:
+    """量子化行列で候補を絞り、必要に応じて float32 で採点し直す。
+
+    exact=True の場合は全行を float32 で採点する（リファレンスモード）。
+    """
+    assert isinstance(state.X_n, QuantizedMatrix)
+
+    if exact:
+        all_rows = np.arange(state.X_n.shape[0])
+        return ExactIndex(_exact_rows(state, all_rows)).search(Q_n, topk)
+
+    wide = topk * max(1, _settings.RESCORE_FACTOR) if _settings.SIMILARITY_RESCORE else topk
+    if state.ann_index is not None:
+        candidates = state.ann_index.search(Q_n, wide)
+    else:
+        candidates = state.X_n.search(Q_n, wide)
+
+    if not _settings.SIMILARITY_RESCORE:
+        return candidates
 
-    X_n = normalize_rows(vecs)
+    row_ids = np.unique([i for cands in candidates for i, _ in cands]).astype(np.int64)
+    if row_ids.size == 0:
+        return candidates
+    return rescore(Q_n, candidates, _exact_rows(state, row_ids), row_ids, topk)
+
+
+def _search_rows(
+    state: SimilarityState,
+    Q_n: np.ndarray,
+    topk: int,
+    rows: np.ndarray,
+    *,
+    exact: bool,
+) -> list[list[tuple[int, float]]]:
+    """絞り込み済みの行 rows だけを厳密に採点する（行列積のコストは len(rows) に比例）。
+
+    ANN インデックスは使わない。量子化時は候補を float32 で採点し直す。
+    """
+    if rows.size == 0:
+        return [[] for _ in range(Q_n.shape[0])]
+
+    quantized = isinstance(state.X_n, QuantizedMatrix)
+    rescoring = quantized and not exact and _settings.SIMILARITY_RESCORE
+    sub = _exact_rows(state, rows) if quantized and exact else state.X_n[rows]
+
+    wide = topk * max(1, _settings.RESCORE_FACTOR) if rescoring else topk
+    candidates = [
+        [(int(rows[i]), score) for i, score in hits] for hits in ExactIndex(sub).search(Q_n, wide)
+    ]
+    if not rescoring:
+        return candidates
+
+    row_ids = np.unique([i for cands in candidates for i, _ in cands]).astype(np.int64)
+    return rescore(Q_n, candidates, _exact_rows(state, row_ids), row_ids, topk)
 
 
 def analyze_similarity_cases(
     query_vec: np.ndarray,
     *,
     topk: int = 5,
+    exact: bool = False,
+    state: SimilarityState | None = None,
+    mask: np.ndarray | None = None,
 ) -> list[tuple[int, float]]:
     """クエリベクトルと CASES の類似度を計算し、上位 topk 件を返す。"""
-    if X_n is None or X_n.size == 0:
+    if query_vec.size == 0:
         return []
+    return analyze_similarity_cases_batch(
+        query_vec[:1], topk=topk, exact=exact, state=state, mask=mask
+    )[0]
 
-    Q_n = normalize_rows(query_vec)
-    scores = (Q_n @ X_n.T)[0]
 
-    n = scores.shape[0]
-    if n == 0:
-        return []
+def lexical_search_batch(
+    query_texts: list[str],
+    *,
+    topk: int = 5,
+    state: SimilarityState | None = None,
+    mask: np.ndarray | None = None,
+) -> list[list[tuple[int, float]]]:
+    """BM25 だけでクエリごとの上位 topk 件を返す（埋め込み API を呼ばない）。
 
-    k = min(topk, n)
-    if k <= 0:
-        return []
+    スコアはクエリごとの最大 BM25 で割り、0〜1 に揃えて返す。
+    """
+    state = state or _STATE
+    if state is None or state.lexical is None or topk <= 0:
+        return [[] for _ in query_texts]
+
+    results: list[list[tuple[int, float]]] = []
+    for text in query_texts:
+        hits = state.lexical.search(text, topk, mask=mask)
+        top = hits[0][1] if hits else 0.0
+        results.append([(i, score / top) for i, score in hits])
+    return results
+
+
+def hybrid_search_batch(
+    query_vecs: np.ndarray,
+    query_texts: list[str],
+    *,
+    topk: int = 5,
+    alpha: float | None = None,
+    state: SimilarityState | None = None,
+    mask: np.ndarray | None = None,
+) -> list[list[tuple[int, float]]]:
+    """cosine と BM25 を線形結合したスコアで上位 topk 件を返す。
+
+    - 候補はベクトル検索の上位と BM25 の上位の和集合（それぞれ topk × 4 件、最低 50 件）。
+    - スコアは alpha × cosine + (1 - alpha) × (BM25 / クエリごとの最大 BM25)。
+    - BM25 側だけに現れた候補の cosine は行列の該当行から計算する。
+    """
+    state = state or _STATE
+    if state is None or state.lexical is None or state.X_n is None or topk <= 0:
+        return analyze_similarity_cases_batch(query_vecs, topk=topk, state=state, mask=mask)
+
+    alpha = _settings.HYBRID_ALPHA if alpha is None else alpha
+    wide = max(topk * 4, 50)
+    vector_hits = analyze_similarity_cases_batch(query_vecs, topk=wide, state=state, mask=mask)
+    Q_n = normalize_rows(query_vecs)
+
+    results: list[list[tuple[int, float]]] = []
+    for q, text, hits in zip(Q_n, query_texts, vector_hits):
+        bm25 = state.lexical.scores(text)
+        if mask is not None:
+            bm25 = np.where(mask, bm25, 0.0)
+        top = float(bm25.max()) if bm25.size else 0.0
+        if top > 0:
+            bm25 = bm25 / top
+
+        cosine = dict(hits)
+        lexical_only = [
+            i for i in topk_desc(bm25, wide).tolist() if bm25[i] > 0 and i not in cosine
+        ]
+        if lexical_only:
+            extra = state.X_n[np.array(lexical_only, dtype=np.int64)] @ q
+            cosine.update(zip(lexical_only, extra.tolist()))
+
+        ids = np.fromiter(cosine.keys(), dtype=np.int64, count=len(cosine))
+        fused = alpha * np.fromiter(cosine.values(), dtype=np.float32, count=len(cosine))
+        fused += (1 - alpha) * bm25[ids]
+        idx = topk_desc(fused, topk)
+        results.append([(int(ids[i]), float(fused[i])) for i in idx])
+    return results
+
+
+def _score_queries(
+    query_texts: list[str],
+    query_vecs: np.ndarray | None,
+    *,
+    topk: int,
+    state: SimilarityState,
+    filters: CaseFilter | None = None,
+) -> list[list[tuple[int, float]]]:
+    """RETRIEVAL_MODE に応じて採点する。query_vecs が None の場合は BM25 のみを使う。
+
+    filters はメタデータインデックスで行マスクに変換し、採点前に候補行を絞り込む。
+    """
+    mask = state.metadata.mask(filters)
+    mode = "lexical" if query_vecs is None else _settings.RETRIEVAL_MODE
+    if not state.complete:
+        # 起動直後の索引構築中（BM25 のみで回答する）
+        metrics.FALLBACKS.inc(kind="indexing")
+    with metrics.span("search", model=mode):
+        if query_vecs is None:
+            return lexical_search_batch(query_texts, topk=topk, state=state, mask=mask)
+        if mode == "hybrid":
+            return hybrid_search_batch(query_vecs, query_texts, topk=topk, state=state, mask=mask)
+        return analyze_similarity_cases_batch(query_vecs, topk=topk, state=state, mask=mask)
+
+
+def _uses_vectors(state: SimilarityState) -> bool:
+    return _settings.RETRIEVAL_MODE != "lexical" and state.X_n is not None
+
+
+def quantization_report(mode: str, *, k: int = 5, num_queries: int = 200) -> dict:
+    """現在のコーパスで量子化した場合の削減メモリと recall@k（float32 比）を計算する。
+
+    クエリにはコーパスの行に小さなノイズを加えたものを使う（シード固定）。
+    """
+    state = _require_state()
+    if not state.complete:
+        raise SimilarityNotReady("類似検索の索引を構築中です。")
+    X = state.float32_rows()
+
+    rng = np.random.default_rng(0)
+    sample = rng.choice(X.shape[0], size=min(num_queries, X.shape[0]), replace=False)
+    noise = rng.standard_normal((sample.size, X.shape[1])).astype("float32") * 0.5 / np.sqrt(X.shape[1])
+    Q_n = normalize_rows(X[sample] + noise)
+
+    return evaluate_quantization(X, Q_n, mode, k=k, rescore_factor=_settings.RESCORE_FACTOR)
+
+
+def embed_query(query_text: str) -> np.ndarray:
+    """クエリテキストを埋め込む。同じクエリはキャッシュから返し、API を呼ばない。"""
+    return embed_queries([query_text])
+
+
+def _lookup_queries(
+    query_texts: list[str], model: str
+) -> tuple[list[np.ndarray | None], dict[str, list[int]]]:
+    """キャッシュを引き、(ベクトル一覧, 未キャッシュのテキスト → 位置) を返す。
+
+    バッチ内で同じテキストが重複していても1回だけ埋め込むようにまとめる。
+    """
+    vecs: list[np.ndarray | None] = [query_cache.get(t, model) for t in query_texts]
+
+    missing: dict[str, list[int]] = {}
+    for i, v in enumerate(vecs):
+        if v is None:
+            missing.setdefault(query_texts[i], []).append(i)
 
-    # 上位 k 件のインデックスを argpartition で取得し、その部分だけを降順ソート
-    idx_part = np.argpartition(scores, -k)[-k:]
-    idx_sorted = idx_part[np.argsort(scores[idx_part])[::-1]]
+    num_misses = sum(len(rows) for rows in missing.values())
+    if len(vecs) > num_misses:
+        metrics.CACHE_REQUESTS.inc(len(vecs) - num_misses, cache="query_embedding", result="hit")
+    if num_misses:
+        metrics.CACHE_REQUESTS.inc(num_misses, cache="query_embedding", result="miss")
+    return vecs, missing
 
-    return [(int(i), float(scores[i])) for i in idx_sorted]
 
+def _fill_queries(
+    vecs: list[np.ndarray | None],
+    missing: dict[str, list[int]],
+    embedded: np.ndarray,
+    model: str,
+) -> np.ndarray:
+    """埋め込み結果をキャッシュに登録し、クエリ順の行列にまとめる。"""
+    for row, text in enumerate(missing.keys()):
+        vec = embedded[row : row + 1]
+        query_cache.put(text, model, vec)
+        for i in missing[text]:
+            vecs[i] = vec
 
-def search_similar_cases(new_idea: NewIdea, top_k: int = 5) -> List[ScoredDecisionCase]:
-    """NewIdea を受け取り、類似 DecisionCase をスコア付きで返す。"""
-    if CASES is None or X_n is None:
-        raise Exception("initialize_similarity() が実行されていません。")
+    if not vecs:
+        return np.zeros((0, 0), dtype="float32")
+    return np.concatenate([v for v in vecs if v is not None], axis=0)
+
+
+def _embedding_labels(model: str) -> dict[str, str]:
+    """get_embedding_model() の "<provider>/<model>" をメトリクスのラベルに分ける。"""
+    provider, _, name = model.partition("/")
+    return {"provider": provider, "model": name}
+
+
+def embed_queries(query_texts: list[str]) -> np.ndarray:
+    """複数のクエリテキストを埋め込む。キャッシュに無いものだけを1回の API 呼び出しで埋め込む。"""
+    model = get_embedding_model()
+    vecs, missing = _lookup_queries(query_texts, model)
+
+    if missing:
+        with metrics.span("embed", **_embedding_labels(model)):
+            embedded = embed_texts(list(missing.keys()))
+    else:
+        embedded = np.zeros((0, 0), dtype="float32")
+    return _fill_queries(vecs, missing, embedded, model)
+
+
+async def aembed_queries(query_texts: list[str]) -> np.ndarray:
+    """embed_queries の非同期版。"""
+    model = get_embedding_model()
+    vecs, missing = _lookup_queries(query_texts, model)
+
+    if missing:
+        with metrics.span("embed", **_embedding_labels(model)):
+            embedded = await aembed_texts(list(missing.keys()))
+    else:
+        embedded = np.zeros((0, 0), dtype="float32")
+    return _fill_queries(vecs, missing, embedded, model)
+
+
+def _embed_queries_or_none(query_texts: list[str], state: SimilarityState) -> np.ndarray | None:
+    """クエリを埋め込む。lexical モード、または埋め込みに失敗し BM25 で代替できる場合は None。"""
+    if not _uses_vectors(state):
+        return None
+    try:
+        return embed_queries(query_texts)
+    except Exception as e:
+        if state.lexical is None:
+            raise
+        print(f"similarity: クエリ埋め込みに失敗したため BM25 のみで検索します ({e!r})")
+        metrics.FALLBACKS.inc(kind="retrieval")
+        return None
+
+
+async def _aembed_queries_or_none(
+    query_texts: list[str], state: SimilarityState
+) -> np.ndarray | None:
+    """_embed_queries_or_none の非同期版。QUERY_EMBED_TIMEOUT_SECONDS を超えた場合も None。"""
+    if not _uses_vectors(state):
+        return None
+    timeout = _settings.QUERY_EMBED_TIMEOUT_SECONDS or None
+    try:
+        return await asyncio.wait_for(aembed_queries(query_texts), timeout)
+    except Exception as e:
+        if state.lexical is None:
+            raise
+        print(f"similarity: クエリ埋め込みに失敗したため BM25 のみで検索します ({e!r})")
+        metrics.FALLBACKS.inc(kind="retrieval")
+        return None
+
+
+def search_similar_cases(
+    new_idea: NewIdea,
+    top_k: int = 5,
+    filters: CaseFilter | None = None,
+) -> List[ScoredDecisionCase]:
+    """NewIdea を受け取り、類似 DecisionCase をスコア付きで返す。
+
+    filters を指定した場合は条件を満たすケースだけを対象にする。
+    """
+    state = _require_state()
 
     #テキストを埋め込みに渡しやすい形にする
     query_text = build_query_text(new_idea)
-    #テキストの埋め込み
-    query_vec = embed_texts([query_text])
+    #テキストの埋め込み（同一クエリの再送時はキャッシュを利用。lexical モードでは行わない）
+    query_vec = _embed_queries_or_none([query_text], state)
 
     #スコア順に並べ替える
-    idx_scores = analyze_similarity_cases(query_vec, topk=top_k)
+    idx_scores = _score_queries(
+        [query_text], query_vec, topk=top_k, state=state, filters=filters
+    )[0]
+
+    return [
+        ScoredDecisionCase(case=state.cases[idx], similarity=score) for idx, score in idx_scores
+    ]
+
+
+def search_similar_cases_batch(
+    new_ideas: list[NewIdea],
+    top_k: int = 5,
+    filters: CaseFilter | None = None,
+) -> List[List[ScoredDecisionCase]]:
+    """複数の NewIdea をまとめて検索し、アイデアごとの類似 DecisionCase を返す。
+
+    埋め込みは1回の embed_texts 呼び出し、採点は1回の (Q×N) 行列積で行う。
+    RETRIEVAL_MODE="hybrid" の場合は BM25 のスコアと結合し、"lexical" の場合は BM25 のみを使う。
+    """
+    state = _require_state()
+
+    if not new_ideas:
+        return []
+
+    query_texts = [build_query_text(idea) for idea in new_ideas]
+    query_vecs = _embed_queries_or_none(query_texts, state)
+
+    batch_idx_scores = _score_queries(
+        query_texts, query_vecs, topk=top_k, state=state, filters=filters
+    )
+
+    return [
+        [ScoredDecisionCase(case=state.cases[idx], similarity=score) for idx, score in idx_scores]
+        for idx_scores in batch_idx_scores
+    ]
+
+
+async def asearch_similar_cases(
+    new_idea: NewIdea,
+    top_k: int = 5,
+    filters: CaseFilter | None = None,
+) -> List[ScoredDecisionCase]:
+    """search_similar_cases の非同期版。
+
+    埋め込みは非同期クライアントで待ち、行列積はイベントループを塞がないよう別スレッドで行う。
+    """
+    results = await asearch_similar_cases_batch([new_idea], top_k=top_k, filters=filters)
+    return results[0]
+
+
+async def asearch_similar_cases_batch(
+    new_ideas: list[NewIdea],
+    top_k: int = 5,
+    filters: CaseFilter | None = None,
+) -> List[List[ScoredDecisionCase]]:
+    """search_similar_cases_batch の非同期版。
+
+    クエリ埋め込みが QUERY_EMBED_TIMEOUT_SECONDS 以内に返らない場合は BM25 のみで回答する。
+    """
+    state = _require_state()
+
+    if not new_ideas:
+        return []
+
+    query_texts = [build_query_text(idea) for idea in new_ideas]
+    query_vecs = await _aembed_queries_or_none(query_texts, state)
+
+    batch_idx_scores = await asyncio.to_thread(
+        _score_queries, query_texts, query_vecs, topk=top_k, state=state, filters=filters
+    )
 
     return [
-        ScoredDecisionCase(case=CASES[idx], similarity=score) for idx, score in idx_scores
+        [ScoredDecisionCase(case=state.cases[idx], similarity=score) for idx, score in idx_scores]
+        for idx_scores in batch_idx_scores
     ]
 
 
 __all__ = [
     "ScoredDecisionCase",
+    "SimilarityNotReady",
+    "SimilarityState",
+    "get_state",
+    "is_ready",
+    "refresh_similarity",
+    "aembed_queries",
+    "asearch_similar_cases",
+    "asearch_similar_cases_batch",
     "build_case_text",
+    "build_lexical_text",
     "build_query_text",
     "initialize_similarity",
     "analyze_similarity_cases",
+    "analyze_similarity_cases_batch",
+    "embed_queries",
+    "embed_query",
+    "embedding_id",
+    "hybrid_search_batch",
+    "lexical_search_batch",
+    "quantization_report",
+    "query_cache",
     "search_similar_cases",
+    "search_similar_cases_batch",
+    "write_state_snapshot",
 ]
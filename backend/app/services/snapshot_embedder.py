@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import queue
+import threading
+from typing import Any
+
+import numpy as np
+
+from app.services import logging_service
+from app.services.embeddings import embed_texts, get_embedding_model
+from app.services.utils import normalize_rows
+from app.services.visualize_trajectory import compute_metrics
+
+
+def embed_session_snapshots(session_id: str) -> int:
+    """セッションの idea_history のうち、現在の埋め込みモデルで未計算の step を埋め込んで保存する。
+
+    前の step からの距離も合わせて保存する。返り値は新たに保存した step 数。
+    """
+
+    data = logging_service.load_session_log(session_id, include_vectors=True)
+    history = data.get("idea_history") or []
+    model = get_embedding_model()
+    missing = [h for h in history if h.get("embedding") != model or "vector" not in h]
+    if not missing:
+        return 0
+
+    # 埋め込みキャッシュ（EmbeddingStore）はスレッド間で共有しないため、直接プロバイダに問い合わせる。
+    # ベクトルはセッションログに残るので、分析（visualize_trajectory）はそれを再利用する
+    vectors = normalize_rows(
+        embed_texts([h["summary"] if h["summary"].strip() else " " for h in missing])
+    )
+    for h, vector in zip(missing, vectors):
+        h["vector"] = vector
+
+    for h in missing:
+        step = h["step"]
+        distance = None
+        if step > 1:
+            distance = round(float(1.0 - history[step - 2]["vector"] @ h["vector"]), 6)
+        logging_service.add_snapshot_embedding(session_id, step, model, h["vector"], distance)
+    return len(missing)
+
+
+def session_trajectory(data: dict[str, Any]) -> dict[str, Any]:
+    """load_session_log(include_vectors=True) のビューから、保存済みの埋め込みで軌跡を組み立てる。
+
+    pending は現在の埋め込みモデルでまだ埋め込まれていない step 数。すべて埋め込み済みの場合だけ
+    全体の指標（visualize_trajectory と同じ）と PCA の2次元座標を返す。
+    """
+
+    session_id = data.get("session_id", "")
+    history = data.get("idea_history") or []
+    model = get_embedding_model()
+    done = [h.get("embedding") == model and "vector" in h for h in history]
+
+    result: dict[str, Any] = {
+        "session_id": session_id,
+        "embedding": model,
+        "pending": done.count(False),
+        "steps": [
+            {
+                "step": h["step"],
+                "title": h["title"],
+                "timestamp": h["timestamp"],
+                "distance": h.get("distance") if ok else None,
+            }
+            for h, ok in zip(history, done)
+        ],
+        "metrics": None,
+        "points": None,
+    }
+    if history and all(done):
+        vectors = np.stack([h["vector"] for h in history])
+        metrics, points = compute_metrics([(session_id, history)], vectors)
+        result["metrics"] = {k: v for k, v in metrics[0].items() if k not in ("session_id", "plot")}
+        if session_id in points:
+            result["points"] = np.round(points[session_id].astype(np.float64), 6).tolist()
+    return result
+
+
+class SnapshotEmbedder:
+    """保存されたスナップショットをバックグラウンドのスレッドで埋め込む。
+
+    キューにはセッション ID を入れ、同じセッションが処理待ちの間は重複して積まない。
+    処理は embed_session_snapshots（未計算の step だけを埋め込む）なので、取りこぼしても
+    次に同じセッションを submit したときにまとめて計算される。
+    """
+
+    def __init__(self, *, max_pending: int = 1000) -> None:
+        self._queue: queue.Queue[str | None] = queue.Queue(maxsize=max_pending)
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def submit(self, session_id: str) -> bool:
+        """セッションを処理待ちに入れる（既に処理待ち・キューが満杯の場合は False）。"""
+
+        self.start()
+        with self._lock:
+            if session_id in self._pending:
+                return False
+            try:
+                self._queue.put_nowait(session_id)
+            except queue.Full:
+                print(f"snapshot embedder: キューが満杯のため {session_id} を後回しにします")
+                return False
+            self._pending.add(session_id)
+        return True
+
+    def _run(self) -> None:
+        while True:
+            session_id = self._queue.get()
+            try:
+                if session_id is None:
+                    return
+                # 処理を始める前に外しておき、処理中に保存された step も次の回で拾う
+                with self._lock:
+                    self._pending.discard(session_id)
+                embed_session_snapshots(session_id)
+            except Exception as exc:
+                print(f"snapshot embedder: {session_id} の埋め込みに失敗しました: {exc!r}")
+            finally:
+                self._queue.task_done()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="snapshot-embedder", daemon=True)
+            self._thread.start()
+
+    def join(self) -> None:
+        """処理待ちがすべて終わるまで待つ。"""
+        self._queue.join()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout=timeout)
+
+
+snapshot_embedder = SnapshotEmbedder()
+
+
+__all__ = [
+    "SnapshotEmbedder",
+    "embed_session_snapshots",
+    "session_trajectory",
+    "snapshot_embedder",
+]
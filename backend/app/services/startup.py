@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# 起動時間に大きく効くプロバイダ SDK（選択したプロバイダの分だけ読み込まれているはず）
+_PROVIDER_MODULES = ("openai", "google.genai")
+
+
+class StartupReport:
+    """import から起動完了までの段階別所要時間を記録する。
+
+    - record(name, started): started（perf_counter の値）からの経過時間を段階として記録する
+    - phase(name): with ブロックの所要時間を段階として記録する
+    - mark(name): 計測開始からの経過時間を記録する
+    - finish(**fields): 合計時間と読み込み済みのプロバイダ SDK を確定し、fields と合わせて1行の JSON として出力する
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.total_ms: float | None = None
+        self.provider_modules: list[str] = []
+        self.fields: dict[str, str] = {}
+
+    def record(self, name: str, started: float) -> None:
+        self.started = min(self.started, started)
+        self.phases[name] = round((time.perf_counter() - started) * 1000.0, 3)
+
+    def mark(self, name: str) -> None:
+        """計測開始からの経過時間を name として記録する（リクエストの受け付け開始など）。"""
+        self.record(name, self.started)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def finish(self, **fields: str) -> dict:
+        self.total_ms = round((time.perf_counter() - self.started) * 1000.0, 3)
+        self.provider_modules = [m for m in _PROVIDER_MODULES if m in sys.modules]
+        self.fields.update(fields)
+        report = self.as_dict()
+        print(json.dumps({"event": "startup", **report}, ensure_ascii=False))
+        return report
+
+    def as_dict(self) -> dict:
+        return {
+            "total_ms": self.total_ms,
+            "phases": dict(self.phases),
+            "provider_modules": list(self.provider_modules),
+            **self.fields,
+        }
+
+
+report = StartupReport()
+
+
+__all__ = ["StartupReport", "report"]
@@ -16,5 +16,17 @@ def normalize_rows(vecs: np.ndarray) -> np.ndarray:
     return vecs / norms
 
 
-__all__ = ["normalize_rows"]
+def topk_desc(scores: np.ndarray, k: int) -> np.ndarray:
+    """1次元スコア配列から上位 k 件のインデックスを降順で返す。"""
+
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    # 上位 k 件のインデックスを argpartition で取得し、その部分だけを降順ソート
+    idx_part = np.argpartition(scores, -k)[-k:]
+    return idx_part[np.argsort(scores[idx_part])[::-1]]
+
+
+__all__ = ["normalize_rows", "topk_desc"]
 
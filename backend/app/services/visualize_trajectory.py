@@ -1,125 +1,427 @@
+"""セッションごとの企画案の変遷（idea_history）をまとめて分析・可視化する。
+
+backend/ ディレクトリで実行する:
+
+    python -m app.services.visualize_trajectory                    # 全セッション
+    python -m app.services.visualize_trajectory --session <id> ... # 指定したセッションだけ
+    python -m app.services.visualize_trajectory --no-plot          # 指標だけを出力
+
+- スナップショットの埋め込みは、保存時にセッションログへ書かれたもの（snapshot_embedder）を使う。
+  無い step だけを埋め込みキャッシュ（data/embeddings）を通して取得し、未登録の文は
+  EMBED_CHUNK_SIZE 件ずつまとめてプロバイダに問い合わせる。
+- ステップ間の距離（1 - コサイン類似度）は全セッション分を1つの行列でまとめて計算し、
+  PCA（2次元）はステップ数が同じセッションどうしをまとめて固有値分解する。
+- 図は matplotlib が入っている場合だけ、プロセスプールで並列に描く。
+- 出力（--out、既定は logs/trajectory）:
+    sessions.csv  セッションごとの指標
+    report.json   全体の集計
+    plots/        セッションごとの軌跡（session_<id>.png）
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import importlib.util
 import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Iterable
+
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.decomposition import PCA
-from sklearn.metrics.pairwise import cosine_similarity
-from openai import OpenAI
-from dotenv import load_dotenv
-
-# .envファイルを読み込む
-load_dotenv()
-
-# --- 設定 ---
-# 分析したいJSONファイルのパス（ファイル名は適宜変更してください）
-# ※ backend/app/logs/logs/ 以下のファイルを指定
-JSON_FILE_PATH = "backend/app/logs/logs/session_26636b0c-a1fc-47a7-9655-d29d21149069.json"
-
-# 日本語フォントの設定（OSに合わせてコメントアウトを外してください）
-# Macの場合
-# plt.rcParams['font.family'] = 'Hiragino Sans'
-# Windowsの場合
-#plt.rcParams['font.family'] = 'MS Gothic'
-# Linux/Colabなどの場合 (IPAexGothicなどがインストールされている必要あり)
-#plt.rcParams['font.family'] = 'IPAexGothic'
-
-def get_embeddings(texts):
-    """OpenAI APIを使ってテキストをベクトル化する"""
-    client = OpenAI() # 環境変数 OPENAI_API_KEY を使用
-    
-    # 空文字列対策
-    clean_texts = [t if t.strip() else " " for t in texts]
-    
-    print("OpenAI APIで埋め込みを計算中...")
-    resp = client.embeddings.create(
-        input=clean_texts,
-        model="text-embedding-3-small"
-    )
-    return np.array([d.embedding for d in resp.data])
-
-def visualize_trajectory(json_path):
-    # 1. JSONの読み込み
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    history = data.get("idea_history", [])
-    if not history:
-        print("エラー: idea_history が見つかりません。")
-        return
-
-    print(f"セッションID: {data.get('session_id')}")
-    print(f"ステップ数: {len(history)}")
-
-    # 2. テキストの抽出
-    # step順に並べる
-    history.sort(key=lambda x: x['step'])
-    titles = [f"Step {h['step']}" for h in history]
-    summaries = [h['summary'] for h in history]
-
-    # 3. ベクトル化 (Embedding)
-    vecs = get_embeddings(summaries)
-
-    # 4. 変化量の計算（コサイン類似度）
-    print("\n--- 思考の変化量分析 ---")
-    distances = []
-    for i in range(len(vecs) - 1):
-        sim = cosine_similarity([vecs[i]], [vecs[i+1]])[0][0]
-        dist = 1.0 - sim
-        distances.append(dist)
-        print(f"Step {i+1} -> {i+2}: 距離 {dist:.4f}")
-    
-    avg_change = np.mean(distances) if distances else 0
-    print(f"\n平均変化量: {avg_change:.4f}")
-
-    # 5. 次元圧縮 (PCA) で2次元化
-    # ※ 点が少なすぎる(2点未満)とPCAできないので注意
-    if len(vecs) < 2:
-        print("データ点が少なすぎるためグラフを描画できません。")
-        return
-
-    pca = PCA(n_components=2)
-    vecs_2d = pca.fit_transform(vecs)
-
-    # 6. 可視化 (プロット)
-    plt.figure(figsize=(10, 8))
-    
-    # 軌跡を描画
-    plt.plot(vecs_2d[:, 0], vecs_2d[:, 1], color='gray', linestyle='--', alpha=0.5)
-    
-    # 矢印を描画
-    for i in range(len(vecs_2d) - 1):
-        start = vecs_2d[i]
-        end = vecs_2d[i+1]
-        plt.arrow(
-            start[0], start[1], 
-            end[0] - start[0], end[1] - start[1],
-            head_width=0.02, head_length=0.03, fc='blue', ec='blue', alpha=0.6,
-            length_includes_head=True
+
+from app.services import logging_service
+from app.services.embedding_store import text_hash
+from app.services.embeddings import embed_texts_cached, get_embedding_model, get_embedding_store
+from app.services.utils import normalize_rows
+
+# 1回のプロバイダ呼び出しで埋め込む件数の上限
+EMBED_CHUNK_SIZE = 512
+# PCA で一度に固有値分解するセッション数（ステップ数 × 次元 × この数の行列を作る）
+PCA_CHUNK_SIZE = 1024
+
+_CSV_FIELDS = (
+    "session_id", "steps", "mean_shift", "max_shift", "total_shift", "net_shift",
+    "pca_explained", "plot",
+)
+
+
+def get_output_dir() -> Path:
+    """既定の出力先（backend/app/logs/trajectory）を返す。"""
+    return logging_service.get_log_root_dir() / "trajectory"
+
+
+def load_histories(session_ids: Iterable[str] | None = None) -> list[tuple[str, list[dict]]]:
+    """(session_id, step 順の idea_history) の一覧を返す。履歴の無いセッションも含める。
+
+    埋め込み済みの step には "embedding" と "vector" が入っている（load_session_log の include_vectors）。
+    """
+
+    histories: list[tuple[str, list[dict]]] = []
+    for session_id in session_ids if session_ids is not None else logging_service.list_session_ids():
+        try:
+            data = logging_service.load_session_log(session_id, include_vectors=True)
+        except (OSError, ValueError) as exc:
+            print(f"trajectory: {session_id} を読み込めませんでした: {exc!r}")
+            continue
+        history = sorted(data.get("idea_history") or [], key=lambda h: h["step"])
+        histories.append((session_id, history))
+    return histories
+
+
+def embed_summaries(texts: list[str]) -> tuple[np.ndarray, int]:
+    """summary 群の L2 正規化済みベクトルと、新たに埋め込んだ（キャッシュに無かった）件数を返す。"""
+
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32), 0
+
+    # 空文字列はプロバイダによってはエラーになるため空白1文字にする
+    texts = [t if t.strip() else " " for t in texts]
+    unique = list(dict.fromkeys(texts))
+    store = get_embedding_store()
+    missing = [t for t in unique if text_hash(t) not in store]
+
+    # 未登録分を分けて埋め込んでおけば、最後の呼び出しはキャッシュから読むだけになる
+    for start in range(0, len(missing), EMBED_CHUNK_SIZE):
+        embed_texts_cached(missing[start : start + EMBED_CHUNK_SIZE])
+    vectors = embed_texts_cached(unique)
+
+    rows = {t: i for i, t in enumerate(unique)}
+    return normalize_rows(vectors[[rows[t] for t in texts]]), len(missing)
+
+
+def step_vectors(steps: list[dict]) -> tuple[np.ndarray, int, int]:
+    """step 群の L2 正規化済みベクトルを返す（ログに保存済みのものはそのまま使う）。
+
+    返り値は (行列, 新たに埋め込んだ件数, ログから再利用した件数)。
+    """
+
+    if not steps:
+        return np.zeros((0, 0), dtype=np.float32), 0, 0
+
+    model = get_embedding_model()
+    missing = [i for i, h in enumerate(steps) if h.get("embedding") != model or "vector" not in h]
+    computed, embedded = embed_summaries([steps[i]["summary"] for i in missing])
+
+    reused = len(steps) - len(missing)
+    dim = computed.shape[1] if missing else len(steps[0]["vector"])
+    vectors = np.empty((len(steps), dim), dtype=np.float32)
+    if reused:
+        skip = set(missing)
+        stored = [i for i in range(len(steps)) if i not in skip]
+        vectors[stored] = np.stack([steps[i]["vector"] for i in stored])
+    if missing:
+        vectors[missing] = computed
+    return vectors, embedded, reused
+
+
+def step_distances(vectors: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """連結した各セッションのベクトルから、隣り合うステップ間の距離（1 - cos）を返す。
+
+    返り値は sum(max(n - 1, 0)) 要素で、セッションの順に並ぶ（セッションをまたぐ組は含まない）。
+    """
+
+    if len(vectors) < 2:
+        return np.zeros(0, dtype=np.float32)
+    sims = np.einsum("ij,ij->i", vectors[:-1], vectors[1:])
+    # 各セッションの最終行から次のセッションの先頭行への組を除く
+    boundary = np.cumsum(lengths)[:-1] - 1
+    keep = np.ones(len(sims), dtype=bool)
+    keep[boundary[(boundary >= 0) & (boundary < len(sims))]] = False
+    return (1.0 - sims[keep]).astype(np.float32)
+
+
+def pca_2d(groups: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(G, n, D) のセッション群をそれぞれ PCA で2次元にする。
+
+    返り値は (G, n, 2) の座標と (G, 2) の寄与率。ステップ数 n は次元 D より小さいので、
+    (n, n) のグラム行列を固有値分解して主成分得点を求める（SVD と同じ結果で、D に比例して軽い）。
+    符号は sklearn と同じく、各主成分で絶対値が最大の要素が正になるように揃える。
+    """
+
+    centered = groups - groups.mean(axis=1, keepdims=True)
+    gram = centered @ centered.transpose(0, 2, 1)
+    eigvals, eigvecs = np.linalg.eigh(gram)  # 昇順
+
+    n = groups.shape[1]
+    k = min(2, n)
+    top_vals = np.clip(eigvals[:, ::-1][:, :k], 0.0, None)
+    top_vecs = eigvecs[:, :, ::-1][:, :, :k]
+
+    idx = np.abs(top_vecs).argmax(axis=1)
+    signs = np.sign(np.take_along_axis(top_vecs, idx[:, None, :], axis=1))
+    signs[signs == 0] = 1.0
+    scores = top_vecs * signs * np.sqrt(top_vals)[:, None, :]
+
+    total = np.clip(eigvals, 0.0, None).sum(axis=1, keepdims=True)
+    ratio = np.divide(top_vals, total, out=np.zeros_like(top_vals), where=total > 0)
+    if k < 2:
+        scores = np.concatenate([scores, np.zeros_like(scores)], axis=2)
+        ratio = np.concatenate([ratio, np.zeros_like(ratio)], axis=1)
+    return scores, ratio
+
+
+def compute_metrics(
+    histories: list[tuple[str, list[dict]]],
+    vectors: np.ndarray,
+) -> tuple[list[dict[str, Any]], dict[str, np.ndarray]]:
+    """セッションごとの指標と、2ステップ以上あるセッションの PCA 座標を返す。
+
+    vectors は histories のステップを順に連結した L2 正規化済みの行列。
+    """
+
+    lengths = np.array([len(h) for _, h in histories], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    dists = step_distances(vectors, lengths)
+    pairs = np.maximum(lengths - 1, 0)
+    seg = np.repeat(np.arange(len(histories)), pairs)
+    total = np.bincount(seg, weights=dists, minlength=len(histories))
+    peak = np.zeros(len(histories))
+    np.maximum.at(peak, seg, dists)
+
+    # 最初と最後のスナップショットの距離
+    net = np.zeros(len(histories))
+    has_pairs = pairs > 0
+    first, last = offsets[:-1][has_pairs], offsets[1:][has_pairs] - 1
+    net[has_pairs] = 1.0 - np.einsum("ij,ij->i", vectors[first], vectors[last])
+
+    points: dict[str, np.ndarray] = {}
+    explained = np.full(len(histories), np.nan)
+    for n in np.unique(lengths[lengths >= 2]).tolist():
+        members = np.flatnonzero(lengths == n)
+        for start in range(0, len(members), PCA_CHUNK_SIZE):
+            chunk = members[start : start + PCA_CHUNK_SIZE]
+            rows = offsets[chunk][:, None] + np.arange(n)
+            scores, ratio = pca_2d(vectors[rows])
+            explained[chunk] = ratio.sum(axis=1)
+            for i, s in zip(chunk.tolist(), scores):
+                points[histories[i][0]] = s
+
+    metrics: list[dict[str, Any]] = []
+    for i, (session_id, _) in enumerate(histories):
+        has = bool(has_pairs[i])
+        metrics.append(
+            {
+                "session_id": session_id,
+                "steps": int(lengths[i]),
+                "mean_shift": round(float(total[i] / pairs[i]), 6) if has else None,
+                "max_shift": round(float(peak[i]), 6) if has else None,
+                "total_shift": round(float(total[i]), 6) if has else None,
+                "net_shift": round(float(net[i]), 6) if has else None,
+                "pca_explained": round(float(explained[i]), 6) if has else None,
+                "plot": None,
+            }
         )
+    return metrics, points
+
+
+def _summary(values: list[float]) -> dict[str, float] | None:
+    if not values:
+        return None
+    arr = np.asarray(values)
+    return {
+        "mean": round(float(arr.mean()), 6),
+        "p50": round(float(np.percentile(arr, 50)), 6),
+        "p90": round(float(np.percentile(arr, 90)), 6),
+        "max": round(float(arr.max()), 6),
+    }
+
+
+def build_report(metrics: list[dict[str, Any]], **fields: Any) -> dict[str, Any]:
+    """全セッションの集計（分布・ステップ数の内訳・変化の大きいセッション）を返す。"""
+
+    analysed = [m for m in metrics if m["mean_shift"] is not None]
+    steps: dict[str, int] = {}
+    for m in metrics:
+        steps[str(m["steps"])] = steps.get(str(m["steps"]), 0) + 1
+    top = sorted(analysed, key=lambda m: m["net_shift"], reverse=True)[:10]
+    return {
+        "num_sessions": len(metrics),
+        "num_analysed": len(analysed),
+        "total_steps": sum(m["steps"] for m in metrics),
+        "steps_histogram": dict(sorted(steps.items(), key=lambda kv: int(kv[0]))),
+        "mean_shift": _summary([m["mean_shift"] for m in analysed]),
+        "net_shift": _summary([m["net_shift"] for m in analysed]),
+        "max_shift": _summary([m["max_shift"] for m in analysed]),
+        "top_net_shift": [
+            {"session_id": m["session_id"], "steps": m["steps"], "net_shift": m["net_shift"]}
+            for m in top
+        ],
+        **fields,
+    }
+
+
+def _plot_session(job: tuple[str, np.ndarray, float, str, str | None]) -> str:
+    """1セッションの軌跡を PNG に描く（プロセスプールのワーカーで実行される）。"""
 
-    # 点をプロット
+    session_id, points, avg_change, output, font = job
+
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    if font:
+        plt.rcParams["font.family"] = font
+
+    fig, ax = plt.subplots(figsize=(10, 8))
+    # 軌跡と矢印
+    ax.plot(points[:, 0], points[:, 1], color="gray", linestyle="--", alpha=0.5)
+    for start, end in zip(points[:-1], points[1:]):
+        ax.arrow(
+            start[0], start[1],
+            end[0] - start[0], end[1] - start[1],
+            head_width=0.02, head_length=0.03, fc="blue", ec="blue", alpha=0.6,
+            length_includes_head=True,
+        )
     # Start (Step1) は緑、End は赤、途中は青
-    colors = ['blue'] * len(vecs_2d)
-    colors[0] = 'green'
-    colors[-1] = 'red'
-    
-    plt.scatter(vecs_2d[:, 0], vecs_2d[:, 1], c=colors, s=100, zorder=5)
-
-    # ラベルを表示
-    for i, (x, y) in enumerate(vecs_2d):
-        label = f"Step {i+1}"
-        plt.text(x + 0.02, y + 0.02, label, fontsize=12)
-
-    plt.title(f"Trajectory of Thought (Avg Shift: {avg_change:.3f})\nGreen:Start -> Red:End", fontsize=14)
-    plt.xlabel("PCA Component 1")
-    plt.ylabel("PCA Component 2")
-    plt.grid(True)
-    
-    # 保存
-    output_filename = "trajectory_plot.png"
-    plt.savefig(output_filename)
-    print(f"\nグラフを保存しました: {output_filename}")
-    plt.show()
+    colors = ["blue"] * len(points)
+    colors[0], colors[-1] = "green", "red"
+    ax.scatter(points[:, 0], points[:, 1], c=colors, s=100, zorder=5)
+    for i, (x, y) in enumerate(points):
+        ax.text(x + 0.02, y + 0.02, f"Step {i + 1}", fontsize=12)
+
+    ax.set_title(
+        f"Trajectory of Thought (Avg Shift: {avg_change:.3f})\nGreen:Start -> Red:End", fontsize=14
+    )
+    ax.set_xlabel("PCA Component 1")
+    ax.set_ylabel("PCA Component 2")
+    ax.grid(True)
+    fig.savefig(output)
+    plt.close(fig)
+    return output
+
+
+def plot_trajectories(
+    metrics: list[dict[str, Any]],
+    points: dict[str, np.ndarray],
+    out_dir: Path,
+    *,
+    workers: int | None = None,
+    font: str | None = None,
+) -> int:
+    """PCA 座標のあるセッションの図を並列に描き、metrics の plot に出力先を入れる。返り値は枚数。"""
+
+    if importlib.util.find_spec("matplotlib") is None:
+        print("trajectory: matplotlib が無いため図の出力を省略します（pip install matplotlib）。")
+        return 0
+
+    plot_dir = out_dir / "plots"
+    plot_dir.mkdir(parents=True, exist_ok=True)
+    jobs = []
+    for m in metrics:
+        p = points.get(m["session_id"])
+        if p is None:
+            continue
+        m["plot"] = str(plot_dir / f"session_{m['session_id']}.png")
+        jobs.append((m["session_id"], p, m["mean_shift"], m["plot"], font))
+    if not jobs:
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        for _ in pool.map(_plot_session, jobs, chunksize=max(1, len(jobs) // (workers * 4))):
+            pass
+    return len(jobs)
+
+
+def analyze_trajectories(
+    session_ids: Iterable[str] | None = None,
+    *,
+    out_dir: Path | None = None,
+    plot: bool = True,
+    workers: int | None = None,
+    font: str | None = None,
+) -> dict[str, Any]:
+    """セッション群の idea_history を分析し、sessions.csv / report.json（/ plots）を書き出す。
+
+    session_ids を省略した場合はログのある全セッション。返り値は report.json の内容。
+    """
+
+    out_dir = out_dir or get_output_dir()
+    timings: dict[str, float] = {}
+
+    started = time.perf_counter()
+    histories = load_histories(session_ids)
+    timings["load"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    steps = [h for _, history in histories for h in history]
+    vectors, embedded, reused = step_vectors(steps)
+    timings["embed"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    metrics, points = compute_metrics(histories, vectors)
+    timings["metrics"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    plotted = plot_trajectories(metrics, points, out_dir, workers=workers, font=font) if plot else 0
+    timings["plot"] = time.perf_counter() - started
+
+    report = build_report(
+        metrics,
+        embedding_model=get_embedding_model(),
+        num_texts=len(steps),
+        num_embedded=embedded,
+        num_reused=reused,
+        num_plots=plotted,
+        seconds={k: round(v, 3) for k, v in timings.items()},
+    )
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with (out_dir / "sessions.csv").open("w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=_CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(metrics)
+    with (out_dir / "report.json").open("w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    return report
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="企画案の変遷（idea_history）の分析")
+    parser.add_argument("--session", nargs="+", default=None, help="分析するセッション ID（省略時は全セッション）")
+    parser.add_argument("--out", type=Path, default=None, help="出力先ディレクトリ（既定: logs/trajectory）")
+    parser.add_argument("--no-plot", action="store_true", help="図を出力しない")
+    parser.add_argument("--workers", type=int, default=None, help="図を描くプロセス数（既定: CPU 数）")
+    # 日本語フォント（Mac: "Hiragino Sans" / Windows: "MS Gothic" / Linux: "IPAexGothic" など）
+    parser.add_argument("--font", default=None, help="図に使うフォント")
+    args = parser.parse_args(argv)
+
+    out_dir = args.out or get_output_dir()
+    report = analyze_trajectories(
+        args.session, out_dir=out_dir, plot=not args.no_plot, workers=args.workers, font=args.font
+    )
+    print(
+        f"セッション数: {report['num_sessions']}（分析対象 {report['num_analysed']}）"
+        f" / 新たに埋め込んだ文: {report['num_embedded']}（ログから再利用 {report['num_reused']}）"
+        f" / 図: {report['num_plots']}"
+    )
+    if report["mean_shift"]:
+        print(f"平均変化量: {report['mean_shift']['mean']:.4f}")
+    print(f"結果を書き出しました: {out_dir}")
+    return 0
+
+
+__all__ = [
+    "analyze_trajectories",
+    "build_report",
+    "compute_metrics",
+    "embed_summaries",
+    "get_output_dir",
+    "load_histories",
+    "main",
+    "pca_2d",
+    "plot_trajectories",
+    "step_distances",
+    "step_vectors",
+]
+
 
 if __name__ == "__main__":
-    visualize_trajectory(JSON_FILE_PATH)
\ No newline at end of file
+    raise SystemExit(main())
+
@@ -0,0 +1 @@
+"""合成データによるベンチマーク（python -m benchmarks.run で実行する）。"""
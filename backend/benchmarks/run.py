@@ -0,0 +1,412 @@
+"""主要コンポーネントのベンチマーク。
+
+backend/ ディレクトリで実行する:
+
+    python -m benchmarks.run --sizes 1000 10000 100000
+    python -m benchmarks.run --sizes 1000 --baseline benchmarks/results/<前回>.json
+
+- 埋め込みは外部 API を呼ばないスタブ（--provider stub: 乱数ベクトル）か、
+  ローカル埋め込み（--provider local）を使う。
+- コンポーネントごとに p50 / p99 レイテンシ、スループット、ピークメモリ（tracemalloc）を測る。
+  ピークメモリは計時とは別に1回だけ tracemalloc を有効にして測る（計時への影響を避けるため）。
+- 結果は JSON で書き出す。--baseline を指定すると p50 を比較し、
+  --max-regression 倍を超えて遅くなったコンポーネントがあれば終了コード 1 を返す。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+# app の import 前に設定する（API キーが無くても import できるように）
+os.environ.setdefault("EMBEDDING_PROVIDER", "local")
+
+import numpy as np
+
+from app.services import embeddings, loader, logging_service, question_generator, similarity
+from app.services.ai_services import ai_service
+from app.services.embedding_store import EmbeddingStore
+from benchmarks.synthetic import generate_cases, generate_idea, generate_sessions, write_cases
+
+_RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def _stub_embedder(dim: int) -> Callable[[list[str]], np.ndarray]:
+    """テキストに依存した乱数ベクトルを返すスタブ（1回の呼び出し単位で決定的）。"""
+
+    def embed(texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+        seed = zlib.crc32(texts[0].encode("utf-8")) ^ len(texts)
+        return np.random.default_rng(seed).standard_normal((len(texts), dim), dtype=np.float32)
+
+    return embed
+
+
+def _install_provider(provider: str, dim: int) -> None:
+    if provider == "stub":
+        ai_service.embed_texts = _stub_embedder(dim)  # type: ignore[method-assign]
+
+
+def _use_store(root: Path) -> None:
+    """埋め込みキャッシュを一時ディレクトリに向ける（実データのキャッシュを汚さない）。"""
+
+    embeddings._STORE = EmbeddingStore(ai_service.provider, ai_service.embedding_model, root=root)
+
+
+def _reset_similarity() -> None:
+    similarity._STATE = None
+    similarity.query_cache.clear()
+
+
+def _time_calls(fn: Callable[[], Any], calls: int) -> list[float]:
+    """fn を calls 回呼び、1回ごとの所要秒数を返す。"""
+
+    samples: list[float] = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _peak_memory(fn: Callable[[], Any]) -> int:
+    """fn を1回呼んだときの Python / NumPy 割り当てのピーク（bytes）を返す。"""
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def _record(
+    component: str,
+    samples: list[float],
+    *,
+    num_cases: int | None,
+    items_per_call: int = 1,
+    total_items: int | None = None,
+    peak_memory_bytes: int | None = None,
+) -> dict[str, Any]:
+    """計測結果を1レコードにまとめて表示する。total_items は最後の呼び出しが端数の場合に指定する。"""
+
+    arr = np.array(samples) * 1000.0
+    total = float(np.sum(samples))
+    total_items = total_items if total_items is not None else len(samples) * items_per_call
+    result = {
+        "component": component,
+        "num_cases": num_cases,
+        "calls": len(samples),
+        "items_per_call": items_per_call,
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "mean_ms": float(arr.mean()),
+        "throughput_per_s": total_items / total if total > 0 else None,
+        "peak_memory_bytes": peak_memory_bytes,
+    }
+    print(
+        f"{component:<42} N={num_cases!s:<8} p50={result['p50_ms']:.3f}ms p99={result['p99_ms']:.3f}ms "
+        f"peak={peak_memory_bytes or 0:,}B"
+    )
+    return result
+
+
+def bench_corpus(n: int, args: argparse.Namespace, workdir: Path) -> list[dict[str, Any]]:
+    """コーパス規模 n での読み込み・索引構築・検索・プロンプト構築を測る。"""
+
+    results: list[dict[str, Any]] = []
+    cases = generate_cases(n, seed=args.seed)
+    path = workdir / f"cases_{n}.json"
+    write_cases(cases, path)
+    del cases
+
+    # JSON からの読み込み・索引構築を測るため、スナップショットは最後にまとめて扱う
+    settings = similarity._settings
+    snapshot_enabled = settings.CORPUS_SNAPSHOT_ENABLED
+    settings.CORPUS_SNAPSHOT_ENABLED = False
+
+    # loader.load_decision_cases（キャッシュを捨ててファイルから読む）
+    def load() -> None:
+        loader._CASES = None
+        loader.load_decision_cases(path)
+
+    samples = _time_calls(load, args.repeat)
+    results.append(
+        _record(
+            "loader.load_decision_cases",
+            samples,
+            num_cases=n,
+            items_per_call=n,
+            peak_memory_bytes=_peak_memory(load),
+        )
+    )
+
+    # initialize_similarity（埋め込みキャッシュが空の状態から）
+    def cold_init(tag: str) -> Callable[[], None]:
+        def run() -> None:
+            _use_store(workdir / f"embeddings_{n}_{tag}")
+            _reset_similarity()
+            similarity.initialize_similarity()
+
+        return run
+
+    samples = _time_calls(cold_init("timed"), 1)
+    peak = _peak_memory(cold_init("traced"))
+    results.append(
+        _record(
+            "similarity.initialize_similarity",
+            samples,
+            num_cases=n,
+            items_per_call=n,
+            peak_memory_bytes=peak,
+        )
+    )
+
+    # refresh_similarity（内容が変わっていない再読み込み。行列の行を再利用する）
+    samples = _time_calls(similarity.refresh_similarity, args.repeat)
+    results.append(
+        _record(
+            "similarity.refresh_similarity(warm)",
+            samples,
+            num_cases=n,
+            items_per_call=n,
+            peak_memory_bytes=_peak_memory(similarity.refresh_similarity),
+        )
+    )
+
+    state = similarity.get_state()
+    assert state is not None and state.X_n is not None
+    rng = np.random.default_rng(args.seed)
+    queries = rng.standard_normal((args.queries, state.X_n.shape[1]), dtype=np.float32)
+
+    # analyze_similarity_cases（1クエリずつ。引数は shape (1, D)）
+    it = iter(queries[:, None, :])
+    samples = _time_calls(lambda: similarity.analyze_similarity_cases(next(it), topk=5), args.queries)
+    results.append(
+        _record(
+            "similarity.analyze_similarity_cases",
+            samples,
+            num_cases=n,
+            peak_memory_bytes=_peak_memory(lambda: similarity.analyze_similarity_cases(queries[:1], topk=5)),
+        )
+    )
+
+    # analyze_similarity_cases_batch（batch_size クエリずつ）
+    batches = [queries[i : i + args.batch_size] for i in range(0, args.queries, args.batch_size)]
+    it_b = iter(batches)
+    samples = _time_calls(
+        lambda: similarity.analyze_similarity_cases_batch(next(it_b), topk=5), len(batches)
+    )
+    results.append(
+        _record(
+            "similarity.analyze_similarity_cases_batch",
+            samples,
+            num_cases=n,
+            items_per_call=args.batch_size,
+            total_items=args.queries,
+            peak_memory_bytes=_peak_memory(
+                lambda: similarity.analyze_similarity_cases_batch(batches[0], topk=5)
+            ),
+        )
+    )
+
+    # build_user_message（上位10件のケースを埋め込んだ user メッセージ）
+    idea_rng = random.Random(args.seed)
+    ideas = [generate_idea(idea_rng) for _ in range(args.queries)]
+    top_cases = state.cases[:10]
+    it_i = iter(ideas)
+    samples = _time_calls(
+        lambda: question_generator.build_user_message(next(it_i), top_cases, 5, 8), args.queries
+    )
+    results.append(
+        _record(
+            "question_generator.build_user_message",
+            samples,
+            num_cases=n,
+            peak_memory_bytes=_peak_memory(
+                lambda: question_generator.build_user_message(ideas[0], top_cases, 5, 8)
+            ),
+        )
+    )
+
+    # コーパスのスナップショット（書き出し・JSON の代わりに開く・スナップショットからの索引構築）
+    settings.CORPUS_SNAPSHOT_ENABLED = True
+    try:
+        samples = _time_calls(lambda: similarity.write_state_snapshot(state), 1)
+        results.append(_record("similarity.write_state_snapshot", samples, num_cases=n, items_per_call=n))
+
+        samples = _time_calls(load, args.repeat)
+        results.append(
+            _record(
+                "loader.load_decision_cases(snapshot)",
+                samples,
+                num_cases=n,
+                items_per_call=n,
+                peak_memory_bytes=_peak_memory(load),
+            )
+        )
+
+        def snapshot_init() -> None:
+            load()
+            _reset_similarity()
+            similarity.initialize_similarity()
+
+        samples = _time_calls(snapshot_init, args.repeat)
+        results.append(
+            _record(
+                "similarity.initialize_similarity(snapshot)",
+                samples,
+                num_cases=n,
+                items_per_call=n,
+                peak_memory_bytes=_peak_memory(snapshot_init),
+            )
+        )
+    finally:
+        settings.CORPUS_SNAPSHOT_ENABLED = snapshot_enabled
+
+    loader._CASES = None
+    _reset_similarity()
+    return results
+
+
+def bench_logging(args: argparse.Namespace, workdir: Path) -> list[dict[str, Any]]:
+    """セッションログの書き込み・読み込みを測る（コーパス規模には依存しない）。"""
+
+    log_dir = workdir / "logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+    logging_service._get_log_dir = lambda: log_dir  # type: ignore[assignment]
+    # フィードバック集計（logs/analytics）も一時ディレクトリに向ける
+    logging_service._get_log_root_dir = lambda: workdir  # type: ignore[assignment]
+
+    sessions = generate_sessions(args.sessions, seed=args.seed)
+    session_ids: list[str] = []
+    results: list[dict[str, Any]] = []
+
+    it = iter(sessions)
+
+    def create() -> None:
+        s = next(it)
+        session_ids.append(logging_service.create_session_log(s["new_idea"], s["questions"]))
+
+    samples = _time_calls(create, len(sessions))
+    peak = _peak_memory(
+        lambda: logging_service.create_session_log(sessions[0]["new_idea"], sessions[0]["questions"])
+    )
+    results.append(_record("logging_service.create_session_log", samples, num_cases=None, peak_memory_bytes=peak))
+
+    pairs = iter(zip(session_ids, sessions))
+
+    def feedback() -> None:
+        sid, s = next(pairs)
+        logging_service.append_feedback(sid, s["feedbacks"])
+
+    samples = _time_calls(feedback, len(sessions))
+    peak = _peak_memory(lambda: logging_service.append_feedback(session_ids[0], sessions[0]["feedbacks"]))
+    results.append(_record("logging_service.append_feedback", samples, num_cases=None, peak_memory_bytes=peak))
+
+    snapshot_calls = [
+        (sid, title, content)
+        for sid, s in zip(session_ids, sessions)
+        for title, content in s["snapshots"]
+    ]
+    it_s = iter(snapshot_calls)
+    samples = _time_calls(lambda: logging_service.add_idea_snapshot(*next(it_s)), len(snapshot_calls))
+    peak = _peak_memory(lambda: logging_service.add_idea_snapshot(*snapshot_calls[0]))
+    results.append(_record("logging_service.add_idea_snapshot", samples, num_cases=None, peak_memory_bytes=peak))
+
+    it_l = iter(session_ids)
+    samples = _time_calls(lambda: logging_service.load_session_log(next(it_l)), len(session_ids))
+    peak = _peak_memory(lambda: logging_service.load_session_log(session_ids[0]))
+    results.append(_record("logging_service.load_session_log", samples, num_cases=None, peak_memory_bytes=peak))
+
+    return results
+
+
+def compare(results: list[dict[str, Any]], baseline_path: Path, max_regression: float) -> bool:
+    """ベースラインと p50 を比較する。max_regression 倍を超えたものがあれば False。"""
+
+    with baseline_path.open("r", encoding="utf-8") as f:
+        baseline = {(r["component"], r["num_cases"]): r for r in json.load(f)["results"]}
+
+    ok = True
+    print(f"\nbaseline: {baseline_path}")
+    for r in results:
+        base = baseline.get((r["component"], r["num_cases"]))
+        if base is None or not base["p50_ms"]:
+            continue
+        ratio = r["p50_ms"] / base["p50_ms"]
+        mark = "REGRESSION" if ratio > max_regression else ""
+        ok = ok and not mark
+        print(f"{r['component']:<42} N={r['num_cases']!s:<8} p50 x{ratio:.2f} {mark}")
+    return ok
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Decision Question Helper のベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="コーパス件数（1k〜1M）")
+    parser.add_argument("--provider", choices=["stub", "local"], default="stub", help="埋め込みの実装")
+    parser.add_argument("--dim", type=int, default=256, help="stub 埋め込みの次元数")
+    parser.add_argument("--queries", type=int, default=200, help="検索・プロンプト構築の試行回数")
+    parser.add_argument("--batch-size", type=int, default=32, help="バッチ検索1回あたりのクエリ数")
+    parser.add_argument("--sessions", type=int, default=200, help="セッションログの件数")
+    parser.add_argument("--repeat", type=int, default=3, help="読み込み・再構築の試行回数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None, help="結果 JSON の出力先")
+    parser.add_argument("--baseline", type=Path, default=None, help="比較対象の結果 JSON")
+    parser.add_argument("--max-regression", type=float, default=1.5, help="p50 の許容倍率")
+    args = parser.parse_args(argv)
+
+    _install_provider(args.provider, args.dim)
+
+    results: list[dict[str, Any]] = []
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+        workdir = Path(tmp)
+        for n in args.sizes:
+            results.extend(bench_corpus(n, args, workdir))
+        results.extend(bench_logging(args, workdir))
+
+    created_at = datetime.now(timezone.utc)
+    report = {
+        "created_at": created_at.isoformat(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "provider": ai_service.provider if args.provider == "local" else "stub",
+        "embedding_model": ai_service.embedding_model if args.provider == "local" else f"random-d{args.dim}",
+        "settings": {
+            "SIMILARITY_INDEX": similarity._settings.SIMILARITY_INDEX,
+            "SIMILARITY_QUANTIZATION": similarity._settings.SIMILARITY_QUANTIZATION,
+            "RETRIEVAL_MODE": similarity._settings.RETRIEVAL_MODE,
+        },
+        "args": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+        "results": results,
+    }
+
+    output = args.output or _RESULTS_DIR / f"bench_{created_at.strftime('%Y%m%dT%H%M%SZ')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    print(f"\n結果を書き出しました: {output}")
+
+    if args.baseline is not None:
+        return 0 if compare(results, args.baseline, args.max_regression) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import json
+import random
+from pathlib import Path
+
+from app.models import DecisionCase, NewIdea, Question, QuestionFeedback
+
+# 実データ (decision_case.json) の書き方を真似た語彙。組み合わせで文面を作る
+_INDUSTRIES = [
+    "製造業", "小売", "物流", "金融", "医療", "教育", "建設", "不動産", "飲食", "自治体",
+    "アパレル", "農業", "保険", "人材", "広告", "旅行", "エネルギー", "通信",
+]
+_TARGETS = [
+    "地方の中小企業", "大手企業の情報システム部門", "店舗運営マネージャー", "現場の作業員",
+    "経営企画部", "人事部門", "若手社員", "中堅の営業担当", "個人事業主", "管理職",
+]
+_FEATURES = [
+    "稼働データの可視化", "異常値検知アラート", "需要予測", "レコメンド", "ダッシュボード",
+    "ナレッジ検索", "ワークフロー自動化", "チャットボット", "ログ監査", "帳票の電子化",
+    "マッチング", "在庫最適化", "顧客分析", "見積もり自動作成", "スケジュール調整",
+]
+_MODELS = [
+    "月額サブスクリプション", "従量課金", "初期導入費＋保守費", "成果報酬型", "フリーミアム",
+    "代理店経由の販売", "既存顧客へのクロスセル",
+]
+_REASONS = [
+    "想定市場の規模が小さく、固定費を回収できる見込みが立たなかった",
+    "既存プロダクトとのカニバリゼーションが懸念された",
+    "実行体制が不足しており、PoC 止まりになるリスクが高いと判断された",
+    "規制対応のコストが大きく、収益化までの期間が長すぎると判断された",
+    "競合が多く、明確な差別化要因を示せなかった",
+    "PoC で定量的な効果が確認でき、段階的な展開が承認された",
+    "ユニットエコノミクスが成立する見込みが示され、採用された",
+    "ステークホルダー間の調整がつかず、判断が保留された",
+]
+_TAGS = [
+    "B2B", "B2C", "SaaS", "DX", "PoC", "市場規模", "カニバリ", "規制", "差別化不足",
+    "実行体制リスク", "ユニットエコノミクス", "データ活用", "業務効率化", "新規事業",
+] + _INDUSTRIES
+_STATUSES = ["adopted", "rejected", "pending"]
+_LEVELS = ["経営会議", "新規事業委員会", "事業部長会議", "事業部内レビュー", "リスク管理委員会"]
+_THEMES = ["purpose_kpi", "target_scope", "execution", "finance", "risk", "differentiation"]
+_RISK_TYPES = ["market_size", "cannibalization", "execution_capacity", "regulation", "generic_check"]
+
+
+def _summary(rng: random.Random, industry: str) -> str:
+    """【目的】〜【ビジネスモデル・前提】形式の summary を作る。"""
+
+    target = rng.choice(_TARGETS)
+    features = "、".join(rng.sample(_FEATURES, 3))
+    return (
+        f"【目的】：\n{industry}における{rng.choice(_FEATURES)}の課題を解消し、業務の属人化をなくす。\n"
+        f"【ターゲット】：\n{industry}の{target}。\n"
+        f"【提供価値・機能】：\n{features}を提供する。初期は既存データを取り込んで利用する想定。\n"
+        f"【ビジネスモデル・前提】：\n{rng.choice(_MODELS)}。年間{rng.randint(5, 100)}社の受注で黒字化できる試算。"
+    )
+
+
+def generate_cases(n: int, *, seed: int = 0, num_projects: int | None = None) -> list[DecisionCase]:
+    """日本語風の DecisionCase を n 件生成する（seed が同じなら常に同じ内容）。"""
+
+    rng = random.Random(seed)
+    num_projects = num_projects or max(1, n // 20)
+    cases: list[DecisionCase] = []
+    for i in range(n):
+        industry = rng.choice(_INDUSTRIES)
+        feature = rng.choice(_FEATURES)
+        cases.append(
+            DecisionCase(
+                id=f"SC-{i + 1:07d}",
+                project_id=f"SP-{rng.randrange(num_projects) + 1:05d}",
+                title=f"{industry}向け{feature}サービス（{rng.choice(_TARGETS)}）",
+                summary=_summary(rng, industry),
+                status=rng.choice(_STATUSES),
+                main_reason=rng.choice(_REASONS) + "。",
+                tags=rng.sample(_TAGS, rng.randint(2, 6)),
+                decision_date=f"20{rng.randint(20, 25)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                decision_level=rng.choice(_LEVELS),
+                source="synthetic",
+            )
+        )
+    return cases
+
+
+def write_cases(cases: list[DecisionCase], path: Path) -> None:
+    """decision_case.json と同じ形式で書き出す。"""
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        json.dump([c.model_dump() for c in cases], f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def generate_idea(rng: random.Random) -> NewIdea:
+    """類似検索・問い生成の入力に使う NewIdea を1件生成する。"""
+
+    industry = rng.choice(_INDUSTRIES)
+    return NewIdea(
+        title=f"{industry}向け{rng.choice(_FEATURES)}の新規事業案",
+        summary=_summary(rng, industry),
+        tags=rng.sample(_TAGS, 3),
+    )
+
+
+def generate_sessions(n: int, *, seed: int = 0, num_questions: int = 8, num_snapshots: int = 5) -> list[dict]:
+    """セッションログの書き込みに使うデータを n 件分生成する。
+
+    各要素は {"new_idea", "questions", "feedbacks", "snapshots"} の dict。
+    """
+
+    rng = random.Random(seed)
+    sessions: list[dict] = []
+    for _ in range(n):
+        idea = generate_idea(rng)
+        questions = [
+            Question(
+                id=f"q{j + 1}",
+                layer=rng.randint(1, 3),
+                theme=rng.choice(_THEMES),
+                question=f"{rng.choice(_TARGETS)}にとっての{rng.choice(_FEATURES)}の価値は検証済みですか？",
+                based_on_case_ids=[f"SC-{rng.randint(1, 1000):07d}" for _ in range(2)],
+                risk_type=rng.choice(_RISK_TYPES),
+                priority=rng.randint(1, 3),
+                note_for_admin="synthetic",
+            )
+            for j in range(num_questions)
+        ]
+        feedbacks = [
+            QuestionFeedback(
+                question_id=q.id,
+                helpful_score=rng.randint(1, 5),
+                modified_idea=rng.random() < 0.3,
+                comment=None,
+            )
+            for q in questions
+        ]
+        snapshots = [(idea.title, _summary(rng, rng.choice(_INDUSTRIES))) for _ in range(num_snapshots)]
+        sessions.append(
+            {"new_idea": idea, "questions": questions, "feedbacks": feedbacks, "snapshots": snapshots}
+        )
+    return sessions
+
+
+__all__ = [
+    "generate_cases",
+    "generate_idea",
+    "generate_sessions",
+    "write_cases",
+]
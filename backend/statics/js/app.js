@@ -2,7 +2,7 @@
  *
  * 役割:
  * - タブ切り替え (Review Questions / Reference Cases)
- * - 「AIレビューを更新する」ボタンクリックでダミーデータを描画
+ * - 「AIレビューを更新する」ボタンクリックでレビュー結果をストリーミング描画
  * - 問いカードの「企画書に反映」ボタンで左ペインのテキストエリアに追記
  */
 
@@ -262,13 +262,13 @@
     });
   }
 
-  async function createIdeas() {
+  function buildSendData() {
     const titleInput = document.getElementById("idea-title");
     const bodyTextarea = document.getElementById("idea-body");
     const isDemo = document.getElementById("demo-mode-checkbox").checked;
 
     //送信データ作成
-    const sendData = {
+    return {
       new_idea: {
         title: titleInput ? titleInput.value : "",
         content: bodyTextarea ? bodyTextarea.value : "",
@@ -281,6 +281,10 @@
       },
       is_demo: isDemo
     };
+  }
+
+  async function createIdeas() {
+    const sendData = buildSendData();
 
     try{
       //常に同じURLへPOSTする
@@ -311,6 +315,67 @@
     }
   }
 
+  // 問いカードを1枚ずつ追加する（ストリーミング受信用）
+  function appendQuestion(question) {
+    const container = document.getElementById("questions-list");
+    if (!container) return;
+
+    const placeholder = container.querySelector(".placeholder-text");
+    if (placeholder) placeholder.remove();
+
+    container.appendChild(createQuestionCard(question));
+  }
+
+  // /api/review_sessions/stream を呼び出し、NDJSON のイベントを1行ずつ handlers に渡す
+  async function streamIdeas(handlers) {
+    const sendData = buildSendData();
+
+    try {
+      const response = await fetch("http://localhost:8000/api/review_sessions/stream", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(sendData)
+      });
+
+      if (!response.ok || !response.body) {
+        throw new Error(`HTTP error!\n status: ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder("utf-8");
+      let buffer = "";
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        // 改行までが1イベント。最後の行は未完成の可能性があるので残しておく
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const event = JSON.parse(line);
+          const handler = handlers[event.type];
+          if (handler) handler(event);
+        }
+      }
+
+      if (buffer.trim()) {
+        const event = JSON.parse(buffer);
+        const handler = handlers[event.type];
+        if (handler) handler(event);
+      }
+      return true;
+    }
+    catch (error) {
+      console.error("エラーが発生しました:", error);
+      alert("送信に失敗しました");
+      return false;
+    }
+  }
+
   // Dummy Data & Review Trigger
 
   function buildQuestions(ideaTitle, ideaBody) {
@@ -369,37 +434,37 @@
   }
 
   // 11/26 add: 非同期処理化(createIdeasが非同期処理なので)
+  // 類似ケース → 問い（1問ずつ）→ セッションID の順にストリーミングで受け取り、届いたものから描画する
   async function runReview() {
-    const titleInput = document.getElementById("idea-title");
-    const bodyTextarea = document.getElementById("idea-body");
-    const title = titleInput ? titleInput.value.trim() : "";
-    const body = bodyTextarea ? bodyTextarea.value.trim() : "";
-
-    showMessage("info", "ダミーデータでレビュー結果を更新しました。");
-
-    //現在はここから事前に作成している質問文の配列をquestionsに渡しているが将来的にはLLMが生成した質問を入れたいと考えている
-    //これをバックであるPython
-    // const questions = buildQuestions(title, body);
-    //  const cases = buildCases();
-
-    const responceData = await createIdeas();
-
-    // エラーなどでnullが帰ってきた場合中断
-    if (!responceData)  return;
+    showMessage("info", "AIレビューを実行中です…");
 
-    //12/7 修正2 サーバーから帰ってきたsession_idを変数に保存する
-    currentSessionId = responceData.session_id;
-
-    console.log(JSON.stringify(responceData, null, 2));
-
-    // 分離
-    const { questions, similar_cases } = responceData;
-
-    console.log(JSON.stringify(questions, null, 2));
-
-    renderQuestions(questions);
-    renderCases(similar_cases);
+    const questionsContainer = document.getElementById("questions-list");
+    if (questionsContainer) {
+      questionsContainer.innerHTML = "";
+      const p = document.createElement("p");
+      p.className = "placeholder-text";
+      p.textContent = "問いを生成しています…";
+      questionsContainer.appendChild(p);
+    }
     activateTab("questions");
+
+    await streamIdeas({
+      similar_cases: (event) => {
+        renderCases(event.similar_cases);
+      },
+      question: (event) => {
+        appendQuestion(event.question);
+      },
+      done: (event) => {
+        //12/7 修正2 サーバーから帰ってきたsession_idを変数に保存する
+        currentSessionId = event.session_id;
+        showMessage("success", "AIレビューを更新しました。");
+      },
+      error: (event) => {
+        console.error(event.detail);
+        showMessage("error", "AIレビューの途中でエラーが発生しました。");
+      },
+    });
   }
 
 